@@ -0,0 +1,71 @@
+"""Benchmark rendering a post with the HTML pipeline against the pandoc AST
+pipeline, for posts with an increasing number of sections and images. The
+conversion cache is disabled, so pandoc runs for each render.
+
+Run with `python benchmarks/pipeline.py`.
+"""
+import timeit
+import tracemalloc
+from gwbridge import application
+from gwbridge import convert
+
+SIZES = [10, 100, 1000]
+REPEAT = 3
+
+
+def make_document(sections):
+    body = [
+        "## Section {0}\n\nSome *text* about figure {0}, with a [link](#s{0}).\n\n"
+        "![Figure {0}](img/{0}.png)\n".format(i)
+        for i in range(sections)
+    ]
+    return "# Title\n\n" + "\n".join(body)
+
+
+def make_img_map(sections):
+    return {
+        str(i): {
+            "local_paths": ["img/{}.png".format(i)],
+            "target_path": "https://www.example.com/{}.png".format(i),
+        }
+        for i in range(sections)
+    }
+
+
+def render(data, pipeline, converter, img_map):
+    soup, title, images = application.render_document(
+        data, {"pipeline": pipeline}, converter=converter
+    )
+    return application.finish_document(soup, title, img_map, images=images)
+
+
+def peak_memory(*args):
+    tracemalloc.start()
+    render(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+def main():
+    converter = convert.create_converter({"conversion_cache": False})
+    print(
+        "{:<9} {:>9} {:>12} {:>12}".format(
+            "pipeline", "sections", "time (ms)", "peak (MiB)"
+        )
+    )
+    for size in SIZES:
+        data = make_document(size)
+        img_map = make_img_map(size)
+        for pipeline in ["html", "ast"]:
+            args = (data, pipeline, converter, img_map)
+            elapsed = min(timeit.repeat(lambda: render(*args), number=1, repeat=REPEAT))
+            print(
+                "{:<9} {:>9} {:>12.1f} {:>12.2f}".format(
+                    pipeline, size, elapsed * 1000, peak_memory(*args)
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
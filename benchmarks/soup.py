@@ -0,0 +1,100 @@
+"""Benchmark the processing of a rendered post: finding its title and images,
+and pointing the images at their uploaded URLs. This compares searching the
+document for each image in turn against the single indexed traversal used by
+gwbridge, for documents with an increasing number of images, with each
+available parser.
+
+Run with `python benchmarks/soup.py`.
+"""
+import timeit
+from bs4 import BeautifulSoup
+from gwbridge import application
+
+SIZES = [10, 100, 500]
+PARSERS = ["html.parser", "lxml"]
+REPEAT = 3
+
+
+def make_document(images):
+    """A document with a title, and a paragraph and distinct image for each of
+    `images` sections
+    """
+
+    sections = [
+        "<h2>Section {0}</h2>\n<p>Some text about figure {0}.</p>\n"
+        '<figure><img src="img/{0}.png" alt="Figure {0}" /></figure>'.format(i)
+        for i in range(images)
+    ]
+    return "<h1>Title</h1>\n" + "\n".join(sections)
+
+
+def make_img_map(images):
+    return {
+        str(i): {
+            "local_paths": ["img/{}.png".format(i)],
+            "target_path": "https://www.example.com/{}.png".format(i),
+        }
+        for i in range(images)
+    }
+
+
+def per_image(html, parser, img_map):
+    """Process the document as gwbridge did previously: a traversal for the
+    title, one for the images, and one for each image to replace
+    """
+
+    soup = BeautifulSoup(html, parser)
+    soup.h1.extract()
+    [x["src"] for x in soup.find_all("img") if x.get("src")]
+    for img in img_map.values():
+        for local_path in img.get("local_paths"):
+            for match in soup.find_all(src=local_path):
+                match["src"] = img.get("target_path")
+
+
+def indexed(html, parser, img_map):
+    """Process the document with a single indexed traversal
+    """
+
+    soup = BeautifulSoup(html, parser)
+    heading, images = application.index_document(soup)
+    application.extract_title(soup, heading=heading)
+    application.replace_image_links(soup, img_map, images=images)
+
+
+def parse_only(html, parser, img_map):
+    BeautifulSoup(html, parser)
+
+
+def best_time(function, *args):
+    return min(timeit.repeat(lambda: function(*args), number=1, repeat=REPEAT))
+
+
+def main():
+    print(
+        "{:<12} {:>7} {:>12} {:>12} {:>12}".format(
+            "parser", "images", "parse (ms)", "per image", "indexed"
+        )
+    )
+    for parser in PARSERS:
+        try:
+            BeautifulSoup("", parser)
+        except Exception:
+            print("{:<12} unavailable".format(parser))
+            continue
+        for size in SIZES:
+            html = make_document(size)
+            img_map = make_img_map(size)
+            times = [
+                best_time(function, html, parser, img_map) * 1000
+                for function in [parse_only, per_image, indexed]
+            ]
+            print(
+                "{:<12} {:>7} {:>12.1f} {:>12.1f} {:>12.1f}".format(
+                    parser, size, *times
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""Benchmark each stage of preparing a post for publishing, for a set of
+synthetic posts: a small post, a post of about 1 MB, and a post with hundreds
+of images. Requests to the Wordpress server are answered in-process by
+`requests_mock`, so only gwbridge and its libraries are measured. The
+conversion cache is disabled, so pandoc runs for each conversion.
+
+The best time and the peak memory allocated by each stage are reported. The
+results can be saved as a named baseline in `benchmarks/baselines`, and later
+runs compared against it:
+
+    python benchmarks/suite.py --save 1.0.3
+    python benchmarks/suite.py --compare 1.0.3 --check
+
+With `--check`, the command exits with a non-zero status if any stage is
+slower than the baseline by more than the `--tolerance`. Timings are only
+comparable between runs on the same machine.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import itertools
+import platform
+import tempfile
+import tracemalloc
+import requests_mock
+from bs4 import BeautifulSoup
+from gwbridge import application
+from gwbridge import convert
+from gwbridge import media
+from gwbridge import transport
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+BASE_URL = "https://www.example.com"
+API_VERSION = "wp/v2"
+POST_ID = 1
+# Each stage is run at least REPEAT times, and fast stages are repeated until
+# they have run for MIN_ELAPSED seconds, up to MAX_REPEAT times
+REPEAT = 3
+MAX_REPEAT = 100
+MIN_ELAPSED = 0.5
+# Slowdown relative to the baseline beyond which a stage is a regression
+DEFAULT_TOLERANCE = 1.25
+# Stages faster than this are too noisy to be checked for regressions
+MIN_CHECKED_MS = 1.0
+
+PARAGRAPH = (
+    "Some *emphasised* text and some **strong** text, with `inline code`, a "
+    "[link](https://www.example.com/{0}) and a footnote-free aside about "
+    "section {0}, written to be long enough to wrap over several lines.\n"
+)
+
+
+def make_post(sections, images, paragraphs=1):
+    """The markdown source of a post with a title, and `sections` sections of
+    `paragraphs` paragraphs each, with `images` images spread evenly among
+    the sections
+    """
+
+    every = max(1, sections // max(1, images))
+    body = []
+    for i in range(sections):
+        body.append("## Section {}\n".format(i))
+        body.extend(PARAGRAPH.format(i) for _ in range(paragraphs))
+        if i % every == 0 and i // every < images:
+            body.append("![Figure {0}](img/{0}.png)\n".format(i // every))
+    return "# Title\n\n" + "\n".join(body)
+
+
+def make_large_post(size=1024 * 1024, images=20):
+    """A post of about `size` bytes of markdown
+    """
+
+    sections = size // (len(PARAGRAPH) * 10)
+    return make_post(sections, images, paragraphs=10)
+
+
+CORPORA = {
+    "small": lambda: make_post(sections=5, images=3),
+    "1mb": make_large_post,
+    "images": lambda: make_post(sections=300, images=300),
+}
+
+
+def write_corpus(data, root):
+    """Write the images referenced by a post to `root`, each with distinct
+    content
+    """
+
+    os.makedirs(os.path.join(root, "img"), exist_ok=True)
+    for src in set(re.findall(r"\]\((img/\d+\.png)\)", data)):
+        with open(os.path.join(root, src), "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n" + src.encode() * 64)
+
+
+def stub_server(mocker):
+    """Answer requests to the media and posts endpoints as an empty Wordpress
+    site would
+    """
+
+    uploads = itertools.count(100)
+
+    def upload(request, context):
+        media_id = next(uploads)
+        return {
+            "id": media_id,
+            "guid": {"rendered": "{}/uploads/{}.png".format(BASE_URL, media_id)},
+        }
+
+    media_url = "{}/{}/media".format(BASE_URL, API_VERSION)
+    mocker.get(media_url, json=[], headers={"X-WP-Total": "0", "X-WP-TotalPages": "1"})
+    mocker.post(media_url, json=upload)
+    mocker.post(
+        re.compile(re.escape("{}/{}/posts".format(BASE_URL, API_VERSION))),
+        json={"id": POST_ID, "guid": {"rendered": BASE_URL}},
+    )
+    return media_url
+
+
+class Stages:
+    """The stages of preparing a post, each as a function of the post's
+    markdown source which returns a `setup` function and the stage to run on
+    the arguments it returns. Only the stage is measured
+    """
+
+    def __init__(self, root, session, converter):
+        self.root = root
+        self.session = session
+        self.converter = converter
+        self.config = {
+            "base_url": BASE_URL,
+            "api_version": API_VERSION,
+            "conversion_cache": False,
+        }
+        self.media_url = "{}/{}/media".format(BASE_URL, API_VERSION)
+        self._html = {}
+
+    def html(self, data):
+        # Only the convert stage measures conversion, so the setup of the
+        # other stages converts each post once
+        if data not in self._html:
+            self._html[data] = self.converter.convert(data)
+        return self._html[data]
+
+    def soup(self, data):
+        return BeautifulSoup(self.html(data), application.DEFAULT_HTML_PARSER)
+
+    def img_map(self, soup):
+        return application.get_image_replacement_map(
+            soup,
+            self.media_url,
+            POST_ID,
+            self.session,
+            ledger=media.MediaLedger(),
+            root=self.root,
+        )
+
+    def all(self):
+        return {
+            "convert": lambda data: (lambda: (data,), self.converter.convert),
+            "parse": lambda data: (
+                lambda: (self.html(data), application.DEFAULT_HTML_PARSER),
+                BeautifulSoup,
+            ),
+            "extract_title": lambda data: (
+                lambda: (self.soup(data),),
+                application.extract_title,
+            ),
+            "get_image_replacement_map": lambda data: (
+                lambda: (self.soup(data),),
+                self.img_map,
+            ),
+            "upload_images": lambda data: (
+                lambda: (self.img_map(self.soup(data)),),
+                lambda img_map: application.upload_images(
+                    img_map,
+                    self.media_url,
+                    self.session,
+                    root=self.root,
+                    ledger=media.MediaLedger(),
+                    post_id=POST_ID,
+                    concurrency=media.DEFAULT_UPLOAD_CONCURRENCY,
+                ),
+            ),
+            "replace_image_links": lambda data: (
+                self.uploaded(data),
+                application.replace_image_links,
+            ),
+            "parse_document": lambda data: (
+                lambda: (data, self.config, {"id": POST_ID}, self.session),
+                lambda *args: application.parse_document(
+                    *args, root=self.root, ledger=media.MediaLedger()
+                ),
+            ),
+        }
+
+    def uploaded(self, data):
+        def setup():
+            soup = self.soup(data)
+            img_map = self.img_map(soup)
+            for digest, img in img_map.items():
+                img["target_path"] = "{}/uploads/{}.png".format(BASE_URL, digest)
+            return soup, img_map
+
+        return setup
+
+
+def measure(setup, stage):
+    """The best time in milliseconds and the peak memory in KiB allocated by
+    `stage`, called with the arguments returned by `setup`
+    """
+
+    times = []
+    while len(times) < REPEAT or (sum(times) < MIN_ELAPSED and len(times) < MAX_REPEAT):
+        args = setup()
+        start = time.perf_counter()
+        stage(*args)
+        times.append(time.perf_counter() - start)
+
+    args = setup()
+    tracemalloc.start()
+    stage(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"time_ms": round(min(times) * 1000, 3), "peak_kib": round(peak / 1024, 1)}
+
+
+def run(corpora):
+    converter = convert.create_converter({"conversion_cache": False})
+    session = transport.WordpressSession()
+    try:
+        with requests_mock.Mocker(session=session) as mocker:
+            stub_server(mocker)
+            for name in corpora:
+                data = CORPORA[name]()
+                with tempfile.TemporaryDirectory() as root:
+                    write_corpus(data, root)
+                    stages = Stages(root, session, converter)
+                    for stage, build in stages.all().items():
+                        yield name, stage, measure(*build(data))
+    finally:
+        converter.close()
+        session.close()
+
+
+def load_baseline(label):
+    with open(os.path.join(BASELINE_DIR, "{}.json".format(label))) as f:
+        return json.loads(f.read())
+
+
+def save_baseline(label, results):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = os.path.join(BASELINE_DIR, "{}.json".format(label))
+    with open(path, "w") as f:
+        f.write(
+            json.dumps(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                indent=4,
+                sort_keys=True,
+            )
+            + "\n"
+        )
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--corpus",
+        action="append",
+        choices=sorted(CORPORA),
+        help="Only benchmark this corpus. May be given more than once",
+    )
+    parser.add_argument(
+        "--save", metavar="LABEL", help="Save the results as a baseline"
+    )
+    parser.add_argument("--compare", metavar="LABEL", help="Compare with a baseline")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Exit with a non-zero status if any stage regressed",
+    )
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    baseline = load_baseline(args.compare).get("results") if args.compare else {}
+    print(
+        "{:<8} {:<26} {:>11} {:>11} {:>9}".format(
+            "corpus", "stage", "time (ms)", "peak (KiB)", "vs base"
+        )
+    )
+    results = {}
+    regressions = []
+    for corpus, stage, result in run(args.corpus or list(CORPORA)):
+        results.setdefault(corpus, {})[stage] = result
+        previous = baseline.get(corpus, {}).get(stage)
+        ratio = ""
+        if previous:
+            ratio = result.get("time_ms") / previous.get("time_ms")
+            if ratio > args.tolerance and result.get("time_ms") > MIN_CHECKED_MS:
+                regressions.append((corpus, stage, ratio))
+            ratio = "{:.2f}x".format(ratio)
+        print(
+            "{:<8} {:<26} {:>11.1f} {:>11.0f} {:>9}".format(
+                corpus, stage, result.get("time_ms"), result.get("peak_kib"), ratio
+            )
+        )
+
+    if args.save:
+        print("Saved baseline to {}".format(save_baseline(args.save, results)))
+    for corpus, stage, ratio in regressions:
+        print("Regression: {} {} is {:.2f}x slower".format(corpus, stage, ratio))
+
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,18 @@
 import os
+import logging
 
 ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
 METADATA_FILE = ".deploy/metadata.json"
 CONFIG_FILE = ".deploy/config.json"
+FINGERPRINT_FILE = ".deploy/fingerprint.json"
+JOURNAL_FILE = ".deploy/journal.jsonl"
+STATE_STORE_FILE = ".deploy/state.db"
+MEDIA_LEDGER_FILE = ".deploy/media.json"
+MEDIA_INDEX_FILE = ".deploy/cache/media-index.json"
+IMAGE_CACHE_DIR = ".deploy/cache/images"
+CONVERSION_CACHE_DIR = ".deploy/cache/conversions"
 PROGRAM_NAME = __name__
 
-from gwbridge.logger import configure_logger  # noqa: E402
-
-program_log = configure_logger()
+# Handlers are attached to the program log by the command line interface,
+# rather than on import, so that importing gwbridge doesn't configure logging
+program_log = logging.getLogger(PROGRAM_NAME)
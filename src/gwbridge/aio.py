@@ -0,0 +1,596 @@
+"""An asyncio engine for the publishing pipeline. Requests are made through a
+single `aiohttp` session, so many posts and images can be in flight at once
+at the cost of a coroutine each, rather than a thread. Posts are published by
+the same steps as the threaded engine, as per `gwbridge.steps`, which run
+the conversion of markdown to HTML, the hashing of images and the writing of
+state files in the default executor. Only the uploading of images, and the
+session and media index, are specific to this engine.
+
+This requires the optional `aiohttp` dependency, which can be installed with
+`pip install gwbridge[aio]`.
+"""
+import os
+import json
+import time
+import asyncio
+import functools
+import requests
+from urllib.parse import urlencode
+from gwbridge import MEDIA_INDEX_FILE
+from gwbridge import MEDIA_LEDGER_FILE
+from gwbridge import application
+from gwbridge import batch
+from gwbridge import bundle
+from gwbridge import convert
+from gwbridge import media
+from gwbridge import profiling
+from gwbridge import scheduler as scheduling
+from gwbridge import state
+from gwbridge import steps
+from gwbridge import transport
+from gwbridge import program_log
+
+try:
+    import aiohttp
+    import yarl
+except ImportError:
+    aiohttp = None
+
+FORM_CONTENT_TYPE = "application/x-www-form-urlencoded"
+
+
+class Request:
+    """A request sent to the Wordpress server, with the attributes of a
+    `requests.PreparedRequest` used when logging its exchange
+    """
+
+    def __init__(self, method, url, headers, body):
+        self.method = method
+        self.url = url
+        self.headers = headers
+        self.body = body
+
+
+class Response:
+    """A response from the Wordpress server, read in full so that the
+    connection is released back to the pool
+    """
+
+    def __init__(self, request, status_code, reason, headers, text):
+        self.request = request
+        self.url = request.url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(
+                "{} {} for url: {}".format(self.status_code, self.reason, self.url)
+            )
+
+
+class AsyncSession:
+    """The session used for every request to the Wordpress server in a run.
+    Connections are kept alive and pooled, and each request is signed with
+    OAuth1 before it is sent.
+
+    :param client: The OAuth1 client used to sign requests. If `None`,
+        requests aren't signed
+    :type client: `oauthlib.oauth1.Client`
+    :param timeout: The `(connect, read)` timeout for each request in seconds
+    :type timeout: tuple
+    :param pool_size: The maximum number of connections open at once
+    :type pool_size: int
+    :param scheduler: The scheduler which paces and retries every request
+    :type scheduler: `gwbridge.scheduler.Scheduler`
+    """
+
+    def __init__(
+        self,
+        client=None,
+        timeout=(transport.DEFAULT_CONNECT_TIMEOUT, transport.DEFAULT_READ_TIMEOUT),
+        pool_size=transport.DEFAULT_POOL_SIZE,
+        scheduler=None,
+    ):
+        if aiohttp is None:
+            raise ImportError(
+                "The asyncio engine requires aiohttp. Install it with "
+                "`pip install gwbridge[aio]`"
+            )
+        self.client = client
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.scheduler = scheduler
+        self._session = None
+
+    def _get_session(self):
+        # The aiohttp session must be created within the running event loop
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=self.timeout[0], sock_read=self.timeout[1]
+                ),
+            )
+        return self._session
+
+    async def request(self, method, url, params=None, data=None, headers=None):
+        """Sign and send a request, returning the complete response. A `dict`
+        of `data` is form encoded, and included in the signature. A file is
+        streamed from its current position
+        """
+
+        if self.scheduler is None:
+            return await self.send_request(method, url, params, data, headers)
+
+        return await self.scheduler.call_async(
+            method,
+            lambda: self.send_request(method, url, params, data, headers),
+            errors=(aiohttp.ClientError, asyncio.TimeoutError),
+        )
+
+    async def send_request(self, method, url, params=None, data=None, headers=None):
+        """Sign and send a single request
+        """
+
+        if hasattr(data, "read") and getattr(data, "name", None):
+            # aiohttp closes a file once it is sent, so each attempt streams
+            # from its own handle
+            with open(data.name, "rb") as f:
+                f.seek(data.tell())
+                return await self._send(method, url, params, f, headers)
+
+        return await self._send(method, url, params, data, headers)
+
+    async def _send(self, method, url, params, data, headers):
+        headers = dict(headers or {})
+        if params:
+            url = "{}?{}".format(url, urlencode(params))
+        if isinstance(data, dict):
+            data = urlencode(data)
+            headers.setdefault("Content-Type", FORM_CONTENT_TYPE)
+
+        if self.client is not None:
+            # Only form encoded bodies form part of an OAuth1 signature
+            signed_body = (
+                data if headers.get("Content-Type") == FORM_CONTENT_TYPE else None
+            )
+            url, headers, _ = self.client.sign(
+                url, http_method=method, body=signed_body, headers=headers
+            )
+            # The client encodes its output if it was created with a `decoding`
+            url = url.decode() if isinstance(url, bytes) else url
+            headers = {
+                k.decode()
+                if isinstance(k, bytes)
+                else k: v.decode()
+                if isinstance(v, bytes)
+                else v
+                for k, v in headers.items()
+            }
+
+        start = time.perf_counter()
+        async with self._get_session().request(
+            method, yarl.URL(url, encoded=True), data=data, headers=headers
+        ) as response:
+            body = await response.read()
+            text = body.decode(response.get_encoding())
+
+        profiler = profiling.active()
+        if profiler is not None:
+            profiler.record_request(
+                method,
+                url,
+                response.status,
+                profiling.body_size(data, headers),
+                len(body),
+                start,
+                time.perf_counter(),
+            )
+        return Response(
+            Request(method, url, headers, data),
+            response.status,
+            response.reason,
+            response.headers,
+            text,
+        )
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def create_session(config):
+    """Create the session used to make requests to the Wordpress server, as
+    configured by the `connect_timeout`, `timeout` and `pool_size` keys, and
+    the scheduling keys read by `gwbridge.scheduler.create_scheduler`.
+    Requests are only signed if a client key is configured
+    """
+
+    client = None
+    if config.get("client_key"):
+        client = application.build_oauth(config).client
+    pool_size = int(config.get("pool_size") or transport.DEFAULT_POOL_SIZE)
+
+    return AsyncSession(
+        client=client,
+        timeout=(
+            float(config.get("connect_timeout") or transport.DEFAULT_CONNECT_TIMEOUT),
+            float(config.get("timeout") or transport.DEFAULT_READ_TIMEOUT),
+        ),
+        pool_size=pool_size,
+        scheduler=scheduling.create_scheduler(config, concurrency=pool_size),
+    )
+
+
+class AsyncMediaIndex:
+    """An index of the media on the Wordpress server, as per
+    `gwbridge.media.MediaIndex`. All pages after the first are fetched at
+    once. Listings are cached in the same format as `MediaIndex`, so the two
+    can share a cache file.
+    """
+
+    def __init__(self, session, cache_file=None):
+        self.session = session
+        self.cache = media.MediaIndex(None, cache_file=cache_file)
+
+    async def fetch(self, media_url, params=None):
+        """Obtain every media item matching the query `params`
+        """
+
+        key, params, cached, headers = self.cache.prepare_query(media_url, params)
+        response = await self.session.get(
+            media_url, params={**params, "page": 1}, headers=headers
+        )
+        if response.status_code == 304 and cached:
+            return cached.get("items")
+        response.raise_for_status()
+
+        listing = media.first_page_listing(response.headers, response.json())
+        if media.is_current(cached, listing):
+            return cached.get("items")
+
+        pages = await asyncio.gather(
+            *[
+                self._fetch_page(media_url, params, n)
+                for n in range(2, listing.get("pages") + 1)
+            ]
+        )
+        for page in pages:
+            listing["items"].extend(page)
+
+        self.cache.store(key, listing)
+        return listing.get("items")
+
+    async def fetch_many(self, media_url, queries):
+        """Run several media listing queries at once
+        """
+
+        return await asyncio.gather(
+            *[self.fetch(media_url, params) for params in queries]
+        )
+
+    async def _fetch_page(self, media_url, params, page):
+        response = await self.session.get(media_url, params={**params, "page": page})
+        if response.status_code == 400:
+            return []
+        response.raise_for_status()
+
+        return [media.trim_media_item(x) for x in response.json()]
+
+    def save(self):
+        self.cache.save()
+
+
+class AsyncPublishContext:
+    """The resources shared between the posts published in a single run, as
+    per `gwbridge.application.PublishContext`
+    """
+
+    def __init__(self, config, workers=None):
+        self.session = create_session(config)
+        self.bundler = bundle.create_bundler(
+            config,
+            self.session,
+            workers=workers or config.get("workers") or 1,
+            bundler_class=bundle.AsyncBundler,
+        )
+        self.store = state.open_store(config)
+        if self.store is not None:
+            self.ledger = state.StoreLedger(self.store)
+        else:
+            self.ledger = media.MediaLedger(
+                config.get("media_ledger") or MEDIA_LEDGER_FILE
+            )
+        self.index = AsyncMediaIndex(
+            self.session, cache_file=config.get("media_index") or MEDIA_INDEX_FILE
+        )
+        self.converter = convert.create_converter(config)
+        self.upload_locks = {}
+
+    def save(self):
+        self.ledger.save()
+        self.index.save()
+
+    async def close(self):
+        await asyncio.get_event_loop().run_in_executor(None, self.save)
+        await self.session.close()
+        self.converter.close()
+        if self.store is not None:
+            self.store.close()
+
+
+async def get_image_replacement_map(
+    soup,
+    media_url,
+    post_id,
+    session,
+    ledger=None,
+    root=".",
+    index=None,
+    optimiser=None,
+    images=None,
+):
+    """Create the image map for a document, as per
+    `gwbridge.application.get_image_replacement_map`
+    """
+
+    if index is None:
+        index = AsyncMediaIndex(session)
+
+    return await steps.run_async(
+        application.image_map_steps(
+            soup,
+            media_url,
+            post_id,
+            session,
+            ledger=ledger,
+            root=root,
+            index=index,
+            optimiser=optimiser,
+            images=images,
+        )
+    )
+
+
+async def upload_images(
+    img_map,
+    media_url,
+    session,
+    root=".",
+    ledger=None,
+    post_id=None,
+    concurrency=media.DEFAULT_UPLOAD_CONCURRENCY,
+    locks=None,
+    journal=None,
+):
+    """Upload images in the blog post to the Wordpress server, with up to
+    `concurrency` uploads in flight at once, as per
+    `gwbridge.application.upload_images`. `locks` holds a lock for each image
+    digest, which should be shared between posts so that an image is only
+    uploaded once
+    """
+
+    if ledger is None:
+        ledger = media.MediaLedger()
+    if locks is None:
+        locks = {}
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def upload(digest):
+        async with semaphore:
+            return await upload_image(
+                digest,
+                img_map.get(digest),
+                media_url,
+                session,
+                root=root,
+                ledger=ledger,
+                post_id=post_id,
+                lock=locks.setdefault(digest, asyncio.Lock()),
+                journal=journal,
+            )
+
+    pending = application.unresolved_images(img_map)
+    results = await asyncio.gather(
+        *[upload(digest) for digest in pending], return_exceptions=True
+    )
+
+    return application.complete_uploads(img_map, dict(zip(pending, results)))
+
+
+async def upload_image(
+    digest,
+    img,
+    media_url,
+    session,
+    root=".",
+    ledger=None,
+    post_id=None,
+    lock=None,
+    journal=None,
+):
+    """Upload a single image from the image map, returning its URL on the
+    Wordpress server. The ledger and journal, which may write to disk, are
+    read and written in the executor
+    """
+
+    loop = asyncio.get_event_loop()
+    async with lock or asyncio.Lock():
+        uploaded = await loop.run_in_executor(None, ledger.lookup, digest)
+        if uploaded:
+            return uploaded.get("url")
+
+        path = img.get("upload_path") or os.path.join(root, img.get("local_paths")[0])
+        params = {"post": post_id} if post_id else None
+        # aiohttp streams file objects in chunks, reading them in the executor
+        with open(path, "rb") as f, profiling.stage("upload_image", path=path):
+            response = await session.post(
+                media_url,
+                data=f,
+                params=params,
+                headers=application.upload_headers(img, path),
+            )
+        response.raise_for_status()
+
+        new_src = await loop.run_in_executor(
+            None,
+            functools.partial(
+                application.record_upload,
+                digest,
+                response.json(),
+                img.get("filename"),
+                ledger,
+                journal=journal,
+            ),
+        )
+
+    return new_src
+
+
+async def prepare_document(
+    data,
+    config,
+    metadata,
+    session,
+    root=".",
+    ledger=None,
+    index=None,
+    locks=None,
+    converter=None,
+    journal=None,
+    parts=None,
+):
+    """Prepare the document to be published, as per
+    `gwbridge.application.prepare_document`. `locks` is shared between posts
+    as per `upload_images`
+    """
+
+    if index is None:
+        index = AsyncMediaIndex(session)
+
+    return await steps.run_async(
+        application.prepare_steps(
+            data,
+            config,
+            metadata,
+            session,
+            upload=functools.partial(upload_images, locks=locks),
+            root=root,
+            ledger=ledger,
+            index=index,
+            converter=converter,
+            journal=journal,
+            parts=parts,
+        )
+    )
+
+
+async def publish_post(config, root=".", context=None):
+    """Publish a single post, as per `gwbridge.application.publish_post`
+    """
+
+    if context is None:
+        context = AsyncPublishContext(config)
+        try:
+            return await publish_post(config, root=root, context=context)
+        finally:
+            await context.close()
+
+    return await steps.run_async(
+        application.publish_steps(
+            config,
+            root,
+            context,
+            upload=functools.partial(upload_images, locks=context.upload_locks),
+        )
+    )
+
+
+async def publish_posts(config, posts, cli_args=None):
+    """Publish every post in a loaded manifest at once, sharing one context,
+    as per `gwbridge.batch.publish_manifest`
+
+    :return: A result for each post, in manifest order
+    :rtype: list
+    """
+
+    context = AsyncPublishContext(config, workers=len(posts))
+
+    async def publish_entry(entry):
+        root = entry.get("path")
+        post_config = batch.build_post_config(
+            config, root, entry.get("config"), cli_args
+        )
+        start = time.monotonic()
+        result = {"path": root, "ok": False, "status": None, "error": None}
+        try:
+            result["status"] = await publish_post(
+                post_config, root=root, context=context
+            )
+            result["ok"] = result.get("status") in batch.PUBLISHED_STATUSES
+        except Exception as e:
+            program_log.error("Failed to publish {}: {}".format(root, e))
+            result["error"] = "{}: {}".format(e.__class__.__name__, e)
+        result["elapsed"] = time.monotonic() - start
+        return result
+
+    try:
+        return await asyncio.gather(*[publish_entry(entry) for entry in posts])
+    finally:
+        await context.close()
+
+
+async def publish(config):
+    """Publish the post configured in `config`. Run this with `run` to block
+    until it is done
+    """
+
+    return await publish_post(config)
+
+
+async def publish_manifest(config, cli_args=None):
+    """Publish every post listed in a manifest file. All posts are published
+    at once; the number of requests in flight is bounded by the size of the
+    connection pool. Run this with `run` to block until they are all done
+    """
+
+    manifest = batch.load_manifest(config.get("manifest"))
+    posts = batch.select_posts(config, manifest.get("posts"), cli_args)
+    program_log.info(
+        "Publishing {} posts from {} with the asyncio engine".format(
+            len(posts), config.get("manifest")
+        )
+    )
+
+    results = await publish_posts(config, posts, cli_args=cli_args)
+    batch.log_summary(results)
+    return results
+
+
+def run(coroutine):
+    """Run a coroutine to completion in a new event loop
+    """
+
+    if hasattr(asyncio, "run"):
+        return asyncio.run(coroutine)
+
+    # Python 3.6
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
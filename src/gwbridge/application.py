@@ -1,27 +1,79 @@
 import requests
 import os
 import datetime
-import pypandoc
 import mimetypes
 import json
-import shutil
 import logging
-import textwrap
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import parse_qs
 from requests_oauthlib import OAuth1
-from gwbridge import ROOT_DIR
 from gwbridge import CONFIG_FILE
 from gwbridge import METADATA_FILE
+from gwbridge import MEDIA_LEDGER_FILE
+from gwbridge import MEDIA_INDEX_FILE
+from gwbridge import bundle
+from gwbridge import changes
+from gwbridge import convert
+from gwbridge import files
+from gwbridge import fingerprint
+from gwbridge import journal as journaling
 from gwbridge import logger
+from gwbridge import media
+from gwbridge import optimise
+from gwbridge import pandoc_ast
+from gwbridge import profiling
+from gwbridge import sources
+from gwbridge import state
+from gwbridge import steps
+from gwbridge import transport
 from gwbridge import program_log
+from gwbridge.project import init  # noqa: F401
+from gwbridge.steps import Call
+
+# The maximum number of images to search the server for individually, rather
+# than fetching the full media listing
+SEARCH_LIMIT = 10
+DEFAULT_HTML_PARSER = "html.parser"
+# The type of an uploaded file whose extension isn't recognised
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
 
 
 def publish(ctx, **kwargs):
     """Publish a markdown file to a wordpress blog
     """
 
-    # Set logging verbosity
+    configure_verbosity(ctx)
+
+    # Consolidate cli args with config file
+    config = parse_args(**kwargs)
+
+    program_log.debug("Config: {}".format(str(config)))
+
+    trace = None
+    if config.get("trace"):
+        trace = logger.start_trace(program_log, config.get("trace"))
+    if config.get("profile") or config.get("profile_trace"):
+        profiling.start()
+    try:
+        return publish_config(ctx, config, cli_args=kwargs)
+    finally:
+        profiler = profiling.stop()
+        if profiler is not None:
+            profiling.log_summary(profiler)
+            if config.get("profile_trace"):
+                profiler.write_trace(config.get("profile_trace"))
+                program_log.info(
+                    "Profile trace written to {}".format(config.get("profile_trace"))
+                )
+        if trace is not None:
+            logger.stop_trace(program_log, trace)
+
+
+def configure_verbosity(ctx):
+    """Set the verbosity of logging from the `-v` and `-q` options
+    """
+
     if ctx.obj.get("verbosity") or ctx.obj.get("verbosity") == 0:
         # Default console verbosity will be INFO level logging
         if ctx.obj.get("verbosity") == 0:
@@ -30,31 +82,179 @@ def publish(ctx, **kwargs):
             logger.adjust_handler_level(
                 program_log, logging.StreamHandler, logging.DEBUG
             )
+        if ctx.obj.get("verbosity", 0) > 1:
+            # Show request and response bodies in full
+            logger.BODY_LIMIT = None
 
     program_log.debug("Context values: {}".format(str(ctx.obj)))
 
-    # Consolidate cli args with config file
-    config = parse_args(**kwargs)
 
-    program_log.debug("Config: {}".format(str(config)))
+def publish_config(ctx, config, cli_args=None):
+    """Publish the post, or the posts in the manifest, configured in the
+    consolidated `config`
+    """
 
-    oauth = OAuth1(
+    # Imported here to avoid a circular import, as these modules publish each
+    # post through this module
+    if config.get("engine") == "asyncio":
+        from gwbridge import aio
+    else:
+        from gwbridge import batch
+
+    try:
+        if config.get("manifest"):
+            if config.get("engine") == "asyncio":
+                results = aio.run(aio.publish_manifest(config, cli_args=cli_args))
+            else:
+                results = batch.publish_manifest(config, cli_args=cli_args)
+            if any(not result.get("ok") for result in results):
+                ctx.exit(1)
+            return results
+
+        if config.get("since") and not is_changed_since(config):
+            return requests.codes.not_modified
+    except changes.ChangeDetectionError as e:
+        program_log.error("Unable to find the posts changed: {}".format(e))
+        ctx.exit(1)
+
+    if config.get("engine") == "asyncio":
+        return aio.run(aio.publish(config))
+    return publish_post(config)
+
+
+def is_changed_since(config, root="."):
+    """Determine whether the post in `root` is affected by the changes made
+    since the commit named by the `since` key
+    """
+
+    changed = changes.changed_files(config.get("since"), cwd=root)
+    changes.log_changes(config.get("since"), changed)
+    if changes.is_affected(config, changed, root=root):
+        return True
+
+    program_log.info(
+        "Post is unchanged since {}. Skipping.".format(config.get("since"))
+    )
+    return False
+
+
+def build_oauth(config):
+    """Build the OAuth1 object used to sign requests to the Wordpress server
+    """
+
+    return OAuth1(
         client_key=config.get("client_key", None),
         client_secret=config.get("client_secret", None),
         resource_owner_key=config.get("resource_owner_key", None),
         resource_owner_secret=config.get("resource_owner_secret", None),
         signature_type="auth_header",
     )
-    program_log.debug("OAuth object built")
 
-    program_log.debug("Reading data from {}".format(config.get("file")))
-    # Read markdown file contents
-    with open(config.get("file"), "r") as f:
-        data = f.read()
 
-    program_log.debug("Loading metadata")
-    with open(METADATA_FILE, "r") as f:
-        metadata = json.loads(f.read())
+class PublishContext:
+    """The resources shared between the posts published in a single run:
+    the session used to make authenticated requests, the bundler batching the
+    requests which create and update posts, the state store if one is
+    configured, the media ledger, the index of media on the server and the
+    markdown converter
+
+    :param workers: The number of posts published at once, if not given by
+        the `workers` key
+    :type workers: int
+    """
+
+    def __init__(self, config, workers=None):
+        self.session = transport.create_session(config, auth=build_oauth(config))
+        self.bundler = bundle.create_bundler(
+            config, self.session, workers=workers or config.get("workers") or 1
+        )
+        self.store = state.open_store(config)
+        if self.store is not None:
+            self.ledger = state.StoreLedger(self.store)
+        else:
+            self.ledger = media.MediaLedger(
+                config.get("media_ledger") or MEDIA_LEDGER_FILE
+            )
+        self.index = media.MediaIndex(
+            self.session,
+            cache_file=config.get("media_index") or MEDIA_INDEX_FILE,
+            workers=int(
+                config.get("media_index_workers") or media.DEFAULT_INDEX_WORKERS
+            ),
+        )
+        self.converter = convert.create_converter(config)
+
+    def save(self):
+        """Persist the media ledger and index
+        """
+
+        self.ledger.save()
+        self.index.save()
+
+    def close(self):
+        """Persist the media ledger and index, and close the session,
+        converter and state store
+        """
+
+        self.save()
+        self.session.close()
+        self.converter.close()
+        if self.store is not None:
+            self.store.close()
+
+
+def publish_post(config, root=".", context=None):
+    """Publish a single post. `root` is the directory containing the post's
+    `.deploy` folder, against which the markdown file, metadata and images
+    are resolved. An existing `context` may be passed in to share it between
+    posts published in the same run.
+
+    If neither the post's sources nor the rendered payload have changed since
+    it was last published, no update is sent and a 304 status is returned,
+    unless `force` is set in the config. If a new post can't be created,
+    `None` is returned.
+    """
+
+    if context is None:
+        context = PublishContext(config)
+        program_log.debug("Publish context built")
+        try:
+            return publish_post(config, root=root, context=context)
+        finally:
+            context.close()
+
+    return steps.run(publish_steps(config, root, context))
+
+
+def publish_steps(config, root, context, upload=None):
+    """The steps of publishing a single post with the resources of the
+    `context`, as per `publish_post`, for either engine to run. Images are
+    uploaded with `upload`, which has the signature of `upload_images`, as
+    per `prepare_steps`
+    """
+
+    session = context.session
+
+    with profiling.stage("read", post=root):
+        parts, metadata = yield Call(read_document, config, root, blocking=True)
+    data = sources.join(parts)
+    journal = yield Call(journaling.open_journal, root, blocking=True)
+    yield Call(
+        resume_post,
+        journal,
+        metadata,
+        context.ledger,
+        root,
+        store=context.store,
+        blocking=True,
+    )
+    previous = yield Call(load_fingerprint, root, store=context.store, blocking=True)
+    unchanged = yield Call(
+        is_unchanged, config, data, metadata, previous, root, blocking=True
+    )
+    if unchanged:
+        yield Call(journal.clear, blocking=True)
+        return requests.codes.not_modified
 
     if not metadata.get("id", None):
         program_log.info("No Post ID found. Creating a new post.")
@@ -66,117 +266,365 @@ def publish(ctx, **kwargs):
         program_log.debug("Constructing URL for /posts endpoint: {}".format(url))
 
         # Create a blank post to obtain a post id
-        metadata["id"] = create_blank_post(url, oauth)
+        with profiling.stage("create_post", post=root):
+            metadata["id"] = yield from create_blank_post_steps(
+                url, session, bundler=context.bundler
+            )
         program_log.debug("New post id: {}".format(str(metadata.get("id"))))
+        if not metadata.get("id", None):
+            program_log.error("Something went wrong. Content not updated")
+            return None
+        yield Call(
+            journal.record,
+            journaling.POST_CREATED,
+            id=metadata.get("id"),
+            blocking=True,
+        )
 
         # Update the repository metadata file with new post ID. This change
         # will need to be committed back to the repository for persistence.
         program_log.debug("Updating local metadata file with new post id")
-        with open(METADATA_FILE, "w") as f:
-            f.write(json.dumps(metadata, indent=4))
-
-    if metadata.get("id", None):
-        program_log.info("Publishing content")
+        yield Call(write_metadata, metadata, root, blocking=True)
+        # The fields published to any previous post don't apply to the new one
+        previous = {}
 
+    program_log.info("Publishing content")
+    metadata_only = yield Call(
+        is_metadata_only, config, data, metadata, previous, root, blocking=True
+    )
+    if metadata_only:
+        payload = build_payload({}, metadata)
+        current = yield Call(
+            post_fingerprint,
+            data,
+            metadata,
+            config,
+            list(previous.get("images", {})),
+            payload,
+            root,
+            fields=previous.get("fields"),
+            blocking=True,
+        )
+    else:
         # Transform content into a form appropriate for wordpress
-        document = parse_document(data, config, metadata, oauth)
-        payload = {
-            "date": None,
-            **document,
-            **metadata,
-        }
-        program_log.debug("Payload: \n{}".format(payload))
-        url = construct_url(
-            base_url=config.get("base_url"),
-            api_version=config.get("api_version"),
-            endpoint="posts",
-            post_id=metadata.get("id"),
+        try:
+            document, img_map = yield from prepare_steps(
+                data,
+                config,
+                metadata,
+                session,
+                upload=upload,
+                root=root,
+                ledger=context.ledger,
+                index=context.index,
+                converter=context.converter,
+                journal=journal,
+                parts=parts,
+            )
+        finally:
+            # Record any uploads, even if preparing the document failed
+            yield Call(context.save, blocking=True)
+        payload = build_payload(document, metadata)
+        current = yield Call(
+            post_fingerprint,
+            data,
+            metadata,
+            config,
+            image_paths(img_map),
+            payload,
+            root,
+            blocking=True,
         )
-        program_log.debug("Constructed URL for post update: {}".format(url))
 
-        # Manually set the header to ensure that the body of the request is not used to sign it
-        headers = {"Content-Type": "application/json"}
-        # Push new blog content
-        response = requests.post(
-            url, data=json.dumps(payload), headers=headers, auth=oauth
+    if is_payload_unchanged(config, current, previous):
+        yield Call(
+            save_fingerprint,
+            current,
+            root,
+            metadata,
+            store=context.store,
+            blocking=True,
         )
-        program_log.debug(
-            textwrap.dedent(
-                """
-            ---------------- request ----------------
-            {req.method} {req.url}
-            {reqhdrs}
+        yield Call(journal.clear, blocking=True)
+        return requests.codes.not_modified
+    url = construct_url(
+        base_url=config.get("base_url"),
+        api_version=config.get("api_version"),
+        endpoint="posts",
+        post_id=metadata.get("id"),
+    )
+    program_log.debug("Constructed URL for post update: {}".format(url))
 
-            {req.body}
-            ---------------- response ----------------
-            {res.status_code} {res.reason} {res.url}
-            {reshdrs}
+    # Only send the fields that changed since the post was last published
+    payload = update_fields(config, payload, previous)
+    if program_log.isEnabledFor(logging.DEBUG):
+        program_log.debug("Payload: \n{}".format(logger.truncate(json.dumps(payload))))
 
-            {res.text}
+    # Push new blog content
+    with profiling.stage("update_post", post=root):
+        response = yield from update_post_steps(
+            url, payload, session, bundler=context.bundler
+        )
+    logger.log_exchange(program_log, response)
+
+    # If blog successfully published
+    if response.status_code == 200:
+        response_dict = json.loads(response.text)
+        yield Call(
+            journal.record,
+            journaling.CONTENT_PUSHED,
+            post=metadata.get("id"),
+            fingerprint=current,
+            blocking=True,
+        )
 
-        """
-            ).format(
-                req=response.request,
-                res=response,
-                reqhdrs=format_headers(response.request.headers),
-                reshdrs=format_headers(response.headers),
+        # Update relevant metadata from response
+        yield Call(write_metadata, metadata, root, blocking=True)
+        yield Call(
+            save_fingerprint,
+            current,
+            root,
+            metadata,
+            store=context.store,
+            modified=response_dict.get("modified_gmt"),
+            blocking=True,
+        )
+        yield Call(journal.clear, blocking=True)
+
+        program_log.info(
+            "Post successfully published, and is available at {}".format(
+                response_dict.get("guid").get("rendered")
+            )
+        )
+    else:
+        program_log.error(
+            "Something went wrong. The server returned status code: {}: {}".format(
+                response.status_code, logger.truncate(response.text)
             )
         )
 
-        # If blog successfully published
-        if response.status_code == 200:
-            response_dict = json.loads(response.text)
+    return response.status_code
 
-            # Update relevant metadata from response
-            with open(METADATA_FILE, "w") as f:
-                f.write(json.dumps(metadata, indent=4))
 
-            program_log.info(
-                "Post successfully published, and is available at {}".format(
-                    response_dict.get("guid").get("rendered")
-                )
-            )
-        else:
-            program_log.error(
-                "Something went wrong. The server returned status code: {}: {}".format(
-                    response.status_code, response.text
-                )
-            )
-            program_log.debug(
-                textwrap.dedent(
-                    """
-                ---------------- request ----------------
-                {req.method} {req.url}
-                {reqhdrs}
-
-                {req.body}
-                ---------------- response ----------------
-                {res.status_code} {res.reason} {res.url}
-                {reshdrs}
-
-                {res.text}
-
-            """
-                ).format(
-                    req=response.request,
-                    res=response,
-                    reqhdrs=format_headers(response.request.headers),
-                    reshdrs=format_headers(response.headers),
-                )
+def read_post(config, root="."):
+    """Read the markdown source and metadata of the post in `root`
+    """
+
+    parts, metadata = read_document(config, root)
+    return sources.join(parts), metadata
+
+
+def read_document(config, root="."):
+    """Read the metadata of the post in `root`, and its markdown source as a
+    list of parts, as per `gwbridge.sources.read_parts`
+    """
+
+    program_log.debug(
+        "Reading data from {}".format(", ".join(sources.source_files(config)))
+    )
+    parts = sources.read_parts(config, root)
+    if len(parts) > 1:
+        program_log.debug("Read {} parts: {}".format(len(parts), parts))
+
+    program_log.debug("Loading metadata")
+    with open(os.path.join(root, METADATA_FILE), "r") as f:
+        metadata = json.loads(f.read())
+
+    return parts, metadata
+
+
+def write_metadata(metadata, root="."):
+    """Write the metadata of the post in `root` back to its metadata file
+    """
+
+    files.write_atomic(
+        os.path.join(root, METADATA_FILE), json.dumps(metadata, indent=4)
+    )
+
+
+def resume_post(journal, metadata, ledger, root=".", store=None):
+    """Apply the steps completed by an unfinished run of the post in `root`,
+    as recorded in its `journal`, so that they aren't repeated. The post is
+    recorded in the state `store`, if given, as per `save_fingerprint`
+    """
+
+    post_id = metadata.get("id")
+    pushed = journaling.resume(journal, metadata, ledger)
+    if metadata.get("id") != post_id:
+        write_metadata(metadata, root)
+    if pushed:
+        # The content was pushed, but the run died before recording it
+        save_fingerprint(pushed, root, metadata, store=store)
+
+
+def load_fingerprint(root=".", store=None):
+    """Read the fingerprint recorded the last time the post in `root` was
+    published, from the state `store` if the post has no fingerprint file
+    """
+
+    previous = fingerprint.load_fingerprint(root)
+    if not previous and store is not None:
+        previous = (store.lookup_post(root) or {}).get("fingerprint") or {}
+    return previous
+
+
+def save_fingerprint(current, root, metadata, store=None, modified=None):
+    """Record the fingerprint of the post in `root` once it is published, and
+    the post in the state `store`, if given
+
+    :param modified: When the server last modified the post
+    :type modified: str
+    """
+
+    fingerprint.save_fingerprint(current, root)
+    if store is not None:
+        store.record_post(
+            root, metadata.get("id"), fingerprint=current, modified=modified
+        )
+
+
+def is_unchanged(config, data, metadata, previous, root="."):
+    """Determine whether an existing post can be skipped, because its sources
+    are unchanged since the `previous` fingerprint was recorded
+    """
+
+    if (
+        not config.get("force")
+        and metadata.get("id", None)
+        and fingerprint.is_unchanged(previous, data, metadata, config, root=root)
+    ):
+        program_log.info(
+            "Post {} is unchanged since it was last published. Skipping.".format(
+                metadata.get("id")
             )
-    else:
-        program_log.error("Something went wrong. Content not updated")
+        )
+        return True
+    return False
 
-    return response.status_code
+
+def build_payload(document, metadata):
+    """Build the body of the request updating a post
+    """
+
+    return {
+        "date": None,
+        **document,
+        **metadata,
+    }
+
+
+def post_fingerprint(data, metadata, config, images, payload, root=".", fields=None):
+    """Fingerprint a post's sources and each field of its payload. Fields
+    which weren't rendered for this update, such as the content of a post
+    whose metadata alone changed, are taken from the previously recorded
+    `fields`
+
+    :param images: The local paths of images referenced by the post
+    :type images: list
+    """
+
+    current = fingerprint.source_fingerprint(data, metadata, config, images, root=root)
+    current["fields"] = {**(fields or {}), **fingerprint.hash_fields(payload)}
+    current["payload"] = fingerprint.hash_json(current.get("fields"))
+    return current
+
+
+def image_paths(img_map):
+    """The local paths of every image in the image map
+    """
+
+    return [path for img in img_map.values() for path in img.get("local_paths")]
+
+
+def is_metadata_only(config, data, metadata, previous, root="."):
+    """Determine whether only the metadata of an existing post changed since
+    the `previous` fingerprint was recorded, in which case the post needn't
+    be rendered
+    """
+
+    if not config.get("force") and fingerprint.is_content_unchanged(
+        previous, data, metadata, config, root=root
+    ):
+        program_log.info("Only the post metadata changed. Skipping rendering.")
+        return True
+    return False
+
+
+def update_fields(config, payload, previous):
+    """The fields of the payload to send to the server: those which differ
+    from the payload last published, or every field if it isn't known or
+    `force` is set
+    """
+
+    if config.get("force") or not previous.get("fields"):
+        return payload
+
+    update = fingerprint.changed_fields(payload, previous.get("fields"))
+    program_log.debug("Updating fields: {}".format(", ".join(sorted(update))))
+    return update
 
 
-def create_blank_post(url, oauth):
+def is_payload_unchanged(config, current, previous):
+    """Determine whether the rendered payload is identical to the one last
+    published, in which case the update can be skipped
+    """
+
+    if not config.get("force") and current.get("payload") == previous.get("payload"):
+        program_log.info(
+            "Rendered post is identical to the published post. Skipping update."
+        )
+        return True
+    return False
+
+
+def create_blank_post(url, session, bundler=None):
     """ Create a blank post on the wordpress blog. This is executed to obtain
     a post id with which images can be uploaded, and the post can be update
-    with correct content
+    with correct content. The request is batched by the `bundler`, if given
+    """
+
+    return steps.run(create_blank_post_steps(url, session, bundler=bundler))
+
+
+def create_blank_post_steps(url, session, bundler=None):
+    """The steps of `create_blank_post`
+    """
+
+    if bundler is not None:
+        response = yield Call(bundler.post, url, blank_post_payload())
+    else:
+        response = yield Call(session.post, url, data=blank_post_payload())
+
+    logger.log_exchange(program_log, response)
+
+    return json.loads(response.text).get("id", None)
+
+
+def update_post(url, payload, session, bundler=None):
+    """Push new content to an existing post. The request is batched by the
+    `bundler`, if given
+    """
+
+    return steps.run(update_post_steps(url, payload, session, bundler=bundler))
+
+
+def update_post_steps(url, payload, session, bundler=None):
+    """The steps of `update_post`
     """
 
-    payload = {
+    if bundler is not None:
+        return (yield Call(bundler.post, url, payload))
+
+    # Manually set the header to ensure that the body of the request is not used to sign it
+    headers = {"Content-Type": "application/json"}
+    return (yield Call(session.post, url, data=json.dumps(payload), headers=headers))
+
+
+def blank_post_payload():
+    """The body of the request creating a blank post
+    """
+
+    return {
         "date": datetime.datetime.now(),
         "status": "draft",
         "title": "placeholder",
@@ -187,44 +635,86 @@ def create_blank_post(url, oauth):
         "format": "standard",
     }
 
-    response = requests.post(url, data=payload, auth=oauth)
 
-    program_log.debug(
-        textwrap.dedent(
-            """
-        ---------------- request ----------------
-        {req.method} {req.url}
-        {reqhdrs}
+def parse_document(data, config, metadata, session, root=".", ledger=None, index=None):
+    """Prepare the document to be published on Wordpress. This involves
+    extracting the title, uploading the relevant images, and changing
+    the links to these images to match those on the Wordpress site. Local
+    image paths are resolved relative to `root`
+    """
 
-        {req.body}
-        ---------------- response ----------------
-        {res.status_code} {res.reason} {res.url}
-        {reshdrs}
+    document, img_map = prepare_document(
+        data, config, metadata, session, root=root, ledger=ledger, index=index
+    )
+    return document
 
-        {res.text}
 
+def prepare_document(
+    data,
+    config,
+    metadata,
+    session,
+    root=".",
+    ledger=None,
+    index=None,
+    converter=None,
+    journal=None,
+    parts=None,
+):
+    """Prepare the document to be published as per `parse_document`, also
+    returning the map of images referenced by the document. Each upload is
+    recorded in the `journal`, if given. If the `parts` of the source are
+    given, each is rendered separately, as per `render_document`
     """
-        ).format(
-            req=response.request,
-            res=response,
-            reqhdrs=format_headers(response.request.headers),
-            reshdrs=format_headers(response.headers),
+
+    return steps.run(
+        prepare_steps(
+            data,
+            config,
+            metadata,
+            session,
+            root=root,
+            ledger=ledger,
+            index=index,
+            converter=converter,
+            journal=journal,
+            parts=parts,
         )
     )
 
-    return json.loads(response.text).get("id", None)
-
 
-def parse_document(data, config, metadata, oauth):
-    """Prepare the document to be published on Wordpress. This involves
-    extracting the title, uploading the relevant images, and changing
-    the links to these images to match those on the Wordpress site
+def prepare_steps(
+    data,
+    config,
+    metadata,
+    session,
+    upload=None,
+    root=".",
+    ledger=None,
+    index=None,
+    converter=None,
+    journal=None,
+    parts=None,
+):
+    """The steps of `prepare_document`. Images are uploaded with `upload`,
+    which has the signature of `upload_images`, and defaults to it
     """
-    program_log.debug("Converting content to html")
-    html = pypandoc.convert_text(data, "html", format="md")
-    soup = BeautifulSoup(html, "html.parser")
-    title = extract_title(soup)
-    program_log.debug("Extracted content title: {}".format(title))
+
+    if upload is None:
+        upload = upload_images
+    if ledger is None:
+        ledger = media.MediaLedger()
+
+    with profiling.stage("render", post=root):
+        soup, title, images = yield Call(
+            render_document,
+            data,
+            config,
+            converter=converter,
+            parts=parts,
+            blocking=True,
+        )
+    optimiser = optimise.create_optimiser(config)
 
     media_url = construct_url(
         base_url=config.get("base_url"),
@@ -232,104 +722,605 @@ def parse_document(data, config, metadata, oauth):
         endpoint="media",
     )
     program_log.debug("Constructed URL for media update: {}".format(media_url))
-    img_map = get_image_replacement_map(soup, media_url, metadata.get("id"), oauth)
-    img_map = upload_images(img_map, media_url, oauth)
+    with profiling.stage("images.resolve", post=root):
+        img_map = yield from image_map_steps(
+            soup,
+            media_url,
+            metadata.get("id"),
+            session,
+            ledger=ledger,
+            root=root,
+            index=index,
+            optimiser=optimiser,
+            images=images,
+        )
+    if optimiser is not None:
+        with profiling.stage("images.optimise", post=root):
+            yield Call(
+                optimise.optimise_images, img_map, optimiser, root=root, blocking=True
+            )
+    with profiling.stage("images.upload", post=root):
+        img_map = yield Call(
+            upload,
+            img_map,
+            media_url,
+            session,
+            root=root,
+            ledger=ledger,
+            post_id=metadata.get("id"),
+            concurrency=int(
+                config.get("upload_concurrency") or media.DEFAULT_UPLOAD_CONCURRENCY
+            ),
+            journal=journal,
+        )
+    with profiling.stage("finish", post=root):
+        document = yield Call(
+            finish_document, soup, title, img_map, images=images, blocking=True
+        )
+    return document, img_map
+
+
+def render_document(data, config, converter=None, parts=None):
+    """Convert the markdown source of a post to HTML with the `converter`, or
+    if none is given, the converter selected in the configuration, and extract
+    its title. The HTML is parsed with the parser named by the `html_parser`
+    key, either `html.parser` (the default) or `lxml`. If the `pipeline` key
+    is `ast`, the post is instead rendered to pandoc's AST, as per
+    `gwbridge.pandoc_ast.render_document`
+
+    If the `parts` of the post are given, as per `gwbridge.sources`, each is
+    converted on its own, and the images it references are resolved against
+    the post's root rather than the part's directory, before the parts are
+    joined
+
+    :return: The parsed HTML of the post body, the post title, and the image
+        elements in the body keyed by their `src`
+    :rtype: tuple
+    """
+
+    if config.get("pipeline") == "ast":
+        program_log.debug("Converting content to pandoc's AST")
+        return pandoc_ast.render_document(
+            data, config, converter=converter, parts=parts
+        )
+
+    program_log.debug("Converting content to html")
+    if converter is None:
+        converter = convert.create_converter(config)
+        try:
+            html = convert_parts(data, converter, parts)
+        finally:
+            converter.close()
+    else:
+        html = convert_parts(data, converter, parts)
+    soup = BeautifulSoup(html, config.get("html_parser") or DEFAULT_HTML_PARSER)
+    heading, images = index_document(soup)
+    title = extract_title(soup, heading=heading)
+    program_log.debug("Extracted content title: {}".format(title))
+
+    return soup, title, images
+
+
+def convert_parts(data, converter, parts=None):
+    """Convert the markdown source of a post to HTML, a part at a time if its
+    `parts` are given. The identifiers in the HTML of each part are prefixed,
+    so that the footnotes of one part don't collide with those of another
+    """
+
+    if parts is None:
+        return converter.convert(data)
+
+    return "\n".join(
+        rebase_images(converter.convert(part.text, id_prefix=prefix), part.directory)
+        for part, prefix in zip(parts, sources.id_prefixes(parts))
+    )
+
+
+def rebase_images(html, directory):
+    """Resolve the images in the HTML of a part in `directory` against the
+    post's root
+    """
+
+    if not directory or "<img" not in html:
+        return html
+
+    soup = BeautifulSoup(html, DEFAULT_HTML_PARSER)
+    for img in soup.find_all("img", src=True):
+        img["src"] = sources.rebase(img["src"], directory)
+    return soup.decode()
+
+
+def finish_document(soup, title, img_map, images=None):
+    """Point the images in the post body at their uploaded URLs, and build
+    the document to publish
+    """
+
     program_log.debug("Updating content with new image links")
-    replace_image_links(soup, img_map)
-    content = soup.encode(formatter="html5").lstrip()
+    if isinstance(soup, pandoc_ast.AstDocument):
+        return pandoc_ast.finish_document(soup, title, img_map, images=images)
 
-    document = {"title": title, "content": content.decode("utf-8")}
-    return document
+    replace_image_links(soup, img_map, images=images)
+    if soup.builder.NAME == "lxml" and soup.body is not None:
+        # lxml wraps the post in a complete HTML document
+        content = soup.body.decode_contents(formatter="html5").lstrip()
+    else:
+        content = soup.encode(formatter="html5").lstrip().decode("utf-8")
+
+    return {"title": title, "content": content}
+
+
+def index_document(soup):
+    """Find the title and images of a document in a single traversal of it
+
+    :return: The first `h1` element or `None`, and the `img` elements keyed by
+        their `src`
+    :rtype: tuple
+    """
+
+    heading = None
+    images = {}
+    for tag in soup.find_all(["h1", "img"]):
+        if tag.name == "h1":
+            heading = heading or tag
+        elif tag.get("src"):
+            images.setdefault(tag["src"], []).append(tag)
+
+    return heading, images
+
+
+def get_image_replacement_map(
+    soup,
+    media_url,
+    post_id,
+    session,
+    ledger=None,
+    root=".",
+    index=None,
+    optimiser=None,
+    images=None,
+):
+    """Create a dictionary associating the SHA-256 digest of each local image
+    in the document with the paths it is referenced by, and the URL to
+    replace them with. Images are identified by their content, so an image
+    referenced by several paths appears once, and an edited image is treated
+    as a new image. The URL of an image is taken from the media `ledger` if
+    it has been uploaded before, or otherwise from the images that exist on
+    the server under the image's upload filename.
+
+    The server is queried for as few images as possible: first those attached
+    to the post, then a search for each remaining image's digest, or if there
+    are many remaining images, the full media listing.
+
+    If images are optimised before they are uploaded, each image is instead
+    identified by the digest of its content and the `optimiser` settings.
+    """
+
+    return steps.run(
+        image_map_steps(
+            soup,
+            media_url,
+            post_id,
+            session,
+            ledger=ledger,
+            root=root,
+            index=index,
+            optimiser=optimiser,
+            images=images,
+        )
+    )
 
 
-def get_image_replacement_map(soup, media_url, post_id, oauth):
-    """Create a dictionary associating the current image file path with the URL
-    to replace it with, using the filename it will be uploaded as, as the key
+def image_map_steps(
+    soup,
+    media_url,
+    post_id,
+    session,
+    ledger=None,
+    root=".",
+    index=None,
+    optimiser=None,
+    images=None,
+):
+    """The steps of `get_image_replacement_map`
     """
-    images_in_doc = [x["src"] for x in soup.find_all("img")]
+
+    if ledger is None:
+        ledger = media.MediaLedger()
+    if index is None:
+        index = media.MediaIndex(session)
+
+    image_map = yield Call(
+        collect_images,
+        soup,
+        ledger,
+        root=root,
+        optimiser=optimiser,
+        images=images,
+        blocking=True,
+    )
+
+    # Only query the server for images the ledger has no record of
+    if post_id and unresolved_images(image_map):
+        images_existing = yield from existing_images_steps(
+            media_url, session, params={"parent": post_id}, index=index
+        )
+        yield Call(
+            resolve_existing_images,
+            image_map,
+            images_existing,
+            ledger,
+            post_id=post_id,
+            blocking=True,
+        )
+
+    unknown = unresolved_images(image_map)
+    if unknown and len(unknown) <= SEARCH_LIMIT:
+        # Uploads are named with a digest prefix, which is searchable, as is
+        # the post id prefix of uploads made by earlier versions
+        queries = search_queries(unknown) + legacy_search_queries(
+            image_map, unknown, post_id
+        )
+        listings = yield Call(index.fetch_many, media_url, queries)
+        for images_existing in listings:
+            yield Call(
+                resolve_existing_images,
+                image_map,
+                media_urls_by_filename(images_existing),
+                ledger,
+                post_id=post_id,
+                blocking=True,
+            )
+    elif unknown:
+        images_existing = yield from existing_images_steps(
+            media_url, session, index=index
+        )
+        yield Call(
+            resolve_existing_images,
+            image_map,
+            images_existing,
+            ledger,
+            post_id=post_id,
+            blocking=True,
+        )
+    program_log.debug("Extracted image map: {}".format(image_map))
+
+    return image_map
+
+
+def collect_images(soup, ledger, root=".", optimiser=None, images=None):
+    """Create the image map for the local images in the document, filling in
+    the URL of any image recorded in the `ledger`. Images which are optimised
+    by the `optimiser` are keyed by the digest of their optimised version.
+    The document is only searched for images if they aren't given, as per
+    `index_document`
+    """
+
+    if images is None:
+        heading, images = index_document(soup)
+    images_in_doc = list(images)
     program_log.debug("Local image links: {}".format(images_in_doc))
-    images_existing = get_existing_images(media_url, oauth)
     image_map = {}
 
     program_log.debug("Constructing map of local links to remote links")
     for img in images_in_doc:
-        target_filename = "{}-{}".format(post_id, os.path.basename(img))
-        image_map[target_filename] = {
-            "local_path": img,
-            "target_path": images_existing.get(target_filename, None),
+        if not media.is_local(img):
+            continue
+        digest = ledger.digest(os.path.join(root, img))
+        if digest is None:
+            program_log.warning("Image {} does not exist. Skipping.".format(img))
+            continue
+        source_digest, filename = None, img
+        if optimiser is not None and optimiser.applies(img):
+            source_digest, filename = digest, optimiser.filename(img)
+            digest = optimiser.variant(digest)
+
+        if digest in image_map:
+            if img not in image_map[digest]["local_paths"]:
+                image_map[digest]["local_paths"].append(img)
+            continue
+
+        uploaded = ledger.lookup(digest) or {}
+        image_map[digest] = {
+            "filename": media.upload_filename(digest, filename),
+            "local_paths": [img],
+            "target_path": uploaded.get("url", None),
         }
-    program_log.debug("Extracted image map: {}".format(image_map))
+        if source_digest:
+            image_map[digest]["source_digest"] = source_digest
 
     return image_map
 
 
-def upload_images(img_map, media_url, oauth):
-    """Upload images in the blog post to the Wordpress server
+def search_queries(digests):
+    """The media listing queries that search for uploads of the images with
+    the given digests
     """
 
-    for filename, img in img_map.items():
-        if img.get("target_path") is None:
+    return [{"search": digest[:12]} for digest in digests]
 
-            # Read local image data in
-            with open(img.get("local_path"), "rb") as f:
-                data = f.read()
 
-            headers = {
-                "Content-Type": mimetypes.guess_type(img.get("local_path"))[0],
-                "Content-Disposition": "attachment; filename={}".format(filename),
-            }
-            # Upload image data with filename as specified in header
-            response = requests.post(media_url, data=data, headers=headers, auth=oauth,)
+def legacy_search_queries(img_map, digests, post_id):
+    """The media listing queries that search for uploads of the images with
+    the given digests under their legacy filename, as per
+    `media.legacy_filename`. There are none for a post without an id
+    """
 
-            # Record the resulting URL from the image upload
-            new_src = json.loads(response.text).get("guid").get("rendered")
-            img_map[filename]["target_path"] = new_src
+    if not post_id:
+        return []
+    return [
+        {
+            "search": os.path.splitext(
+                media.legacy_filename(post_id, img_map[digest]["local_paths"][0])
+            )[0]
+        }
+        for digest in digests
+    ]
+
+
+class UploadError(Exception):
+    """Raised when one or more images could not be uploaded
+
+    :param failures: The reason each image failed to upload, keyed by the
+        image's local path
+    :type failures: dict
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__(
+            "Failed to upload {} image(s): {}".format(
+                len(failures),
+                "; ".join("{}: {}".format(k, v) for k, v in failures.items()),
+            )
+        )
+
+
+def upload_images(
+    img_map,
+    media_url,
+    session,
+    root=".",
+    ledger=None,
+    post_id=None,
+    concurrency=1,
+    journal=None,
+):
+    """Upload images in the blog post to the Wordpress server. Local image
+    paths are resolved relative to `root`, and each upload is recorded in the
+    media `ledger`, and in the `journal` if given. Uploaded images are
+    attached to the post `post_id`.
+
+    Up to `concurrency` images are uploaded at once. The image map is only
+    updated once every upload has succeeded. If any upload fails, an
+    `UploadError` describing each failure is raised and the image map is left
+    unchanged, although successful uploads are still recorded in the ledger
+    so that they aren't repeated.
+    """
+    if ledger is None:
+        ledger = media.MediaLedger()
+
+    pending = unresolved_images(img_map)
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {
+            digest: executor.submit(
+                upload_image,
+                digest,
+                img_map.get(digest),
+                media_url,
+                session,
+                root=root,
+                ledger=ledger,
+                post_id=post_id,
+                journal=journal,
+            )
+            for digest in pending
+        }
+        # Collect results in image map order, so that they don't depend on
+        # the order in which uploads complete
+        for digest, future in futures.items():
+            try:
+                results[digest] = future.result()
+            except Exception as e:
+                results[digest] = e
+
+    return complete_uploads(img_map, results)
+
+
+def complete_uploads(img_map, results):
+    """Fill in the image map with the URL each image was uploaded to, once all
+    uploads have finished. If any upload failed, the image map is left
+    unchanged and an `UploadError` is raised
+
+    :param results: The URL of each uploaded image, or the exception raised
+        while uploading it, keyed by the image's digest
+    :type results: dict
+    """
+
+    failures = {}
+    for digest, result in results.items():
+        if isinstance(result, Exception):
+            local_path = img_map.get(digest).get("local_paths")[0]
+            program_log.error("Failed to upload {}: {}".format(local_path, result))
+            failures[local_path] = result
+
+    if failures:
+        raise UploadError(failures)
+
+    for digest, target_path in results.items():
+        img_map[digest]["target_path"] = target_path
     program_log.debug("Updated image map after upload: {}".format(img_map))
 
     return img_map
 
 
-def get_existing_images(media_url, oauth):
-    """Obtain a dictionary of all images currently uploaded to the Wordpress
-    server to work out what isn't already there and needs to be uploaded
+def upload_image(
+    digest, img, media_url, session, root=".", ledger=None, post_id=None, journal=None
+):
+    """Upload a single image from the image map, returning its URL on the
+    Wordpress server
+    """
+
+    with ledger.upload_lock(digest):
+        # Another post may have uploaded the same image in the meantime
+        uploaded = ledger.lookup(digest)
+        if uploaded:
+            return uploaded.get("url")
+
+        path = img.get("upload_path") or os.path.join(root, img.get("local_paths")[0])
+        filename = img.get("filename")
+
+        headers = upload_headers(img, path)
+        params = {"post": post_id} if post_id else None
+        # Stream the image from disk, with filename as specified in header, so
+        # that it's never held in memory in full
+        with open(path, "rb") as f, profiling.stage("upload_image", path=path):
+            response = session.post(media_url, data=f, params=params, headers=headers)
+        response.raise_for_status()
+
+        # Record the resulting URL from the image upload
+        new_src = record_upload(
+            digest, json.loads(response.text), filename, ledger, journal=journal
+        )
+
+    return new_src
+
+
+def record_upload(digest, response_dict, filename, ledger, journal=None):
+    """Record an uploaded image in the media ledger, and in the journal if
+    given
+
+    :param response_dict: The media item returned by the server
+    :type response_dict: dict
+    :return: The URL of the uploaded image
+    :rtype: str
+    """
+
+    url = response_dict.get("guid").get("rendered")
+    ledger.record(digest, response_dict.get("id"), url, filename)
+    if journal is not None:
+        journal.record(
+            journaling.MEDIA_UPLOADED,
+            digest=digest,
+            id=response_dict.get("id"),
+            url=url,
+            filename=filename,
+        )
+
+    return url
+
+
+def unresolved_images(img_map):
+    """The digests of images in the image map without a URL to replace them
+    with
+    """
+
+    return [digest for digest, img in img_map.items() if img.get("target_path") is None]
+
+
+def resolve_existing_images(img_map, images_existing, ledger, post_id=None):
+    """Fill in the URL of any image in the image map that exists on the server
+    under its upload filename, recording it in the ledger. If the post's id is
+    given, an image is also matched by its legacy filename, as per
+    `media.legacy_filename`, so that images uploaded by earlier versions
+    aren't uploaded again
+    """
+
+    for digest in unresolved_images(img_map):
+        img = img_map.get(digest)
+        filenames = [img.get("filename")]
+        if post_id:
+            filenames.append(media.legacy_filename(post_id, img.get("local_paths")[0]))
+        for filename in filenames:
+            if filename in images_existing:
+                img["target_path"] = images_existing.get(filename)
+                ledger.record(digest, None, img.get("target_path"), filename)
+                break
+
+
+def upload_headers(img, path):
+    """The headers of the request uploading an image from the image map,
+    which name the file it is uploaded as. The length of the upload is taken
+    from the file at `path`, so that its content can be streamed. A file of
+    an unknown type is sent as binary data, as a request without a content
+    type has its streamed body read as form parameters when it is signed
+    """
+
+    return {
+        "Content-Type": mimetypes.guess_type(img.get("filename"))[0]
+        or DEFAULT_CONTENT_TYPE,
+        "Content-Disposition": "attachment; filename={}".format(img.get("filename")),
+        "Content-Length": str(os.stat(path).st_size),
+    }
+
+
+def get_existing_images(media_url, session, params=None, index=None):
+    """Obtain a dictionary of the images currently uploaded to the Wordpress
+    server to work out what isn't already there and needs to be uploaded.
+    The listing can be filtered on the server by passing query `params`, and
+    is fetched through the media `index`, which caches listings between calls
     """
 
+    return steps.run(
+        existing_images_steps(media_url, session, params=params, index=index)
+    )
+
+
+def existing_images_steps(media_url, session, params=None, index=None):
+    """The steps of `get_existing_images`
+    """
+
+    if index is None:
+        index = media.MediaIndex(session)
+
     program_log.debug("Obtaining existing image URLs")
-    response = requests.get(media_url, auth=oauth)
-    program_log.debug("Request URL: {}".format(response.url))
-    program_log.debug("Response status code: {}".format(response.status_code))
-    program_log.debug("Response content: {}".format(response.text))
-    images = json.loads(response.text)
-    image_urls = {
+    images = yield Call(index.fetch, media_url, params)
+    image_urls = media_urls_by_filename(images)
+    program_log.debug("Existing images on remote: {}".format(image_urls))
+    return image_urls
+
+
+def media_urls_by_filename(images):
+    """Map the filename of each media item to its URL
+    """
+
+    return {
         os.path.basename(x.get("guid", {}).get("rendered")): x.get("guid", {}).get(
             "rendered"
         )
         for x in images
     }
-    program_log.debug("Existing images on remote: {}".format(image_urls))
-    return image_urls
 
 
-def extract_title(soup):
+def extract_title(soup, heading=None):
     """ Determine the title of the blog post, and remove it from the body of
-    the content
+    the content. The `heading` is the first `h1` element, if it has already
+    been found. The title is the text of the heading without its markup, or
+    `None` if the post has no `h1`, as per `gwbridge.pandoc_ast.extract_title`
     """
 
-    title = soup.h1.string
-    soup.h1.extract()
+    heading = heading or soup.h1
+    if heading is None:
+        return None
+    title = heading.get_text()
+    heading.extract()
 
     return title
 
 
-def replace_image_links(soup, img_map):
+def replace_image_links(soup, img_map, images=None):
     """Replace all links to images within a blog post with the new link
-    of the uploaded image
+    of the uploaded image. The document is only searched for images if they
+    aren't given, as per `index_document`
     """
 
-    for filename, img in img_map.items():
-        matches = soup.find_all(src=img.get("local_path"))
-        for match in matches:
-            match["src"] = img.get("target_path")
+    if images is None:
+        heading, images = index_document(soup)
+
+    for digest, img in img_map.items():
+        for local_path in img.get("local_paths"):
+            for match in images.get(local_path, []):
+                match["src"] = img.get("target_path")
 
 
 def parse_args(**kwargs):
@@ -369,13 +1360,14 @@ def authenticate(ctx, **kwargs):
 
     # 0. Load client_key and client_secret from input arguments
     config = parse_args(**kwargs)
-    authentication_urls = discover_auth_endpoints(**config)
+    session = transport.create_session(config)
+    authentication_urls = discover_auth_endpoints(session, **config)
 
     # 1. Obtain request token to identify client in the next step
     oauth = OAuth1(
         client_key=config.get("client_key"), client_secret=config.get("client_secret"),
     )
-    r = requests.post(url=authentication_urls.get("request"), auth=oauth)
+    r = session.post(url=authentication_urls.get("request"), auth=oauth)
     credentials = parse_qs(r.content.decode("utf-8"))
     resource_owner_key = credentials.get("oauth_token")[0]
     resource_owner_secret = credentials.get("oauth_token_secret")[0]
@@ -400,7 +1392,7 @@ def authenticate(ctx, **kwargs):
         verifier=verifier,
     )
 
-    r = requests.post(url=authentication_urls.get("access"), auth=oauth)
+    r = session.post(url=authentication_urls.get("access"), auth=oauth)
     credentials = parse_qs(r.content.decode("utf-8"))
     resource_owner_key = credentials.get("oauth_token")[0]
     resource_owner_secret = credentials.get("oauth_token_secret")[0]
@@ -415,10 +1407,10 @@ def authenticate(ctx, **kwargs):
     print("{:25}{}".format("Resource owner secret", resource_owner_secret))
 
 
-def discover_auth_endpoints(**kwargs):
+def discover_auth_endpoints(session, **kwargs):
     """Identify the OAuth1.0 endpoints, required to follow the authorization flow
     """
-    r = requests.get(kwargs.get("base_url"))
+    r = session.get(kwargs.get("base_url"))
     response = json.loads(r.content.decode("utf-8"))
 
     urls = {
@@ -434,67 +1426,3 @@ def discover_auth_endpoints(**kwargs):
     }
 
     return urls
-
-
-def init(ctx, **kwargs):
-    """Initialise a directory as a project. This creates a `.deploy` folder
-    containing configuration files for the site, and post metadata.
-    """
-
-    default_config_dir = os.path.join(ROOT_DIR, "config")
-    deploy_dir = ".deploy"
-
-    try:
-        # Create a `.deploy` directory in the project root
-        os.makedirs(deploy_dir, exist_ok=False)
-    except FileExistsError:
-        rewrite = (
-            input(
-                "This project has already been initialised! Reset your configuration and start again? (y/[n]): "
-            )
-            or "n"
-        )
-        if rewrite.lower() in {"n", "no"}:
-            exit(0)
-
-    with open(os.path.join(default_config_dir, "config-default.json"), "r") as f:
-        config = json.loads(f.read())
-
-    # Prompt user to update configuration settings
-    while not config.get("base_url", None):
-        config["base_url"] = input(
-            "Enter the base URL of the wordpress blog to update (required): "
-        )
-        if not config.get("base_url"):
-            print("You must enter a base URL.")
-
-    config["api_version"] = input(
-        "Enter the version of the WPI you wish to use [{}]: ".format(
-            config.get("api_version")
-        )
-    ) or config.get("api_version")
-
-    config["file"] = input(
-        "Enter the name of the file to publish [{}]: ".format(config.get("file"))
-    ) or config.get("file")
-
-    # Write the updated configuration to the local repository
-    with open(os.path.join(deploy_dir, "config.json"), "w") as f:
-        f.write(json.dumps(config, indent=4))
-
-    program_log.info(
-        "Configuration file created at {}".format(
-            os.path.join(deploy_dir, "config.json")
-        )
-    )
-    shutil.copy(
-        os.path.join(default_config_dir, "metadata-default.json"),
-        os.path.join(deploy_dir, "metadata.json"),
-    )
-    program_log.info(
-        "Metadata file created at {}".format(os.path.join(deploy_dir, "metadata.json"))
-    )
-
-
-def format_headers(headers):
-    return "\n".join(f"{k}: {v}" for k, v in headers.items())
@@ -0,0 +1,205 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from gwbridge import CONFIG_FILE
+from gwbridge import program_log
+from gwbridge import application
+from gwbridge import changes
+
+DEFAULT_WORKERS = 4
+# A post that is unchanged since it was last published is reported as not
+# modified, which counts as a success
+PUBLISHED_STATUSES = {200, 304}
+
+
+def publish_manifest(config, cli_args=None):
+    """Publish every post listed in a manifest file within a single process.
+    Posts are published concurrently by a bounded pool of workers, which share
+    one set of OAuth credentials, one media index and one media ledger, so an
+    image used by several posts is uploaded only once. A summary of the
+    outcome for each post is logged once all posts have been processed.
+
+    :param config: The consolidated configuration, containing the path to the
+        manifest under the `manifest` key
+    :type config: dict
+    :param cli_args: The arguments passed on the command line. These take
+        priority over any per-post configuration
+    :type cli_args: dict
+    :return: A result for each post, in manifest order
+    :rtype: list
+    """
+
+    cli_args = cli_args or {}
+    manifest = load_manifest(config.get("manifest"))
+    workers = int(
+        cli_args.get("workers")
+        or manifest.get("workers")
+        or config.get("workers")
+        or DEFAULT_WORKERS
+    )
+    posts = select_posts(config, manifest.get("posts"), cli_args)
+    program_log.info(
+        "Publishing {} posts from {} with {} workers".format(
+            len(posts), config.get("manifest"), workers
+        )
+    )
+
+    context = application.PublishContext(config, workers=workers)
+
+    def publish_entry(entry):
+        post_config = build_post_config(
+            config, entry.get("path"), entry.get("config"), cli_args
+        )
+        return publish_one(post_config, entry.get("path"), context)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(publish_entry, posts))
+    finally:
+        context.close()
+
+    log_summary(results)
+    return results
+
+
+def publish_one(config, root, context):
+    """Publish a single post from a manifest, capturing any failure so that it
+    doesn't interrupt the remaining posts
+    """
+
+    start = time.monotonic()
+    result = {"path": root, "ok": False, "status": None, "error": None}
+    try:
+        result["status"] = application.publish_post(config, root=root, context=context)
+        result["ok"] = result.get("status") in PUBLISHED_STATUSES
+    except Exception as e:
+        program_log.error("Failed to publish {}: {}".format(root, e))
+        result["error"] = "{}: {}".format(e.__class__.__name__, e)
+    result["elapsed"] = time.monotonic() - start
+
+    return result
+
+
+def load_manifest(manifest_file):
+    """Read a manifest file listing the posts to publish. The manifest is
+    either a list of post directories, or an object of the form:
+
+        {"workers": 8, "posts": ["posts/a", {"path": "posts/b", "file": "b.md"}]}
+
+    where any keys alongside `path` override that post's configuration. Post
+    directories are resolved relative to the directory of the manifest.
+    """
+
+    with open(manifest_file, "r") as f:
+        manifest = json.loads(f.read())
+
+    if isinstance(manifest, list):
+        manifest = {"posts": manifest}
+
+    manifest_dir = os.path.dirname(manifest_file)
+    posts = []
+    for entry in manifest.get("posts", []):
+        if isinstance(entry, str):
+            entry = {"path": entry}
+        overrides = {k: v for k, v in entry.items() if k != "path"}
+        posts.append(
+            {
+                "path": os.path.normpath(os.path.join(manifest_dir, entry["path"])),
+                "config": overrides,
+            }
+        )
+    manifest["posts"] = posts
+
+    return manifest
+
+
+def select_posts(config, posts, cli_args=None):
+    """Select the posts affected by the changes made since the commit named
+    by the `since` key, as per `gwbridge.changes`. Every post is selected if
+    `since` isn't set
+    """
+
+    if not config.get("since"):
+        return posts
+
+    changed = changes.changed_files(config.get("since"))
+    changes.log_changes(config.get("since"), changed)
+    if changes.affects_all(changed, [config.get("manifest"), CONFIG_FILE]):
+        program_log.info("The manifest or project configuration changed")
+        return posts
+
+    selected = [
+        entry
+        for entry in posts
+        if changes.is_affected(
+            build_post_config(config, entry.get("path"), entry.get("config"), cli_args),
+            changed,
+            root=entry.get("path"),
+        )
+    ]
+    program_log.info(
+        "{} of {} posts changed since {}".format(
+            len(selected), len(posts), config.get("since")
+        )
+    )
+    return selected
+
+
+def build_post_config(config, root, overrides=None, cli_args=None):
+    """Build the configuration for a single post. In increasing order of
+    priority, this is made up of the project configuration, the post's own
+    `.deploy/config.json`, any overrides in the manifest entry, and the
+    arguments passed on the command line.
+    """
+
+    post_config = dict(config)
+
+    config_file = os.path.join(root, CONFIG_FILE)
+    if os.path.exists(config_file):
+        with open(config_file, "r") as f:
+            post_config.update(json.loads(f.read()))
+
+    post_config.update(overrides or {})
+
+    for key, value in (cli_args or {}).items():
+        if value:
+            post_config[key] = value
+
+    return post_config
+
+
+def log_summary(results):
+    """Log the outcome of each post published from a manifest
+    """
+
+    program_log.info("{:9}{:10}{}".format("Result", "Time (s)", "Post"))
+    for result in results:
+        if result.get("status") == 304:
+            outcome = "SKIPPED"
+        elif result.get("ok"):
+            outcome = "OK"
+        else:
+            outcome = "FAILED"
+        program_log.info(
+            "{:9}{:<10.2f}{}{}".format(
+                outcome,
+                result.get("elapsed"),
+                result.get("path"),
+                "" if result.get("ok") else " ({})".format(failure_reason(result)),
+            )
+        )
+
+    failed = len([r for r in results if not r.get("ok")])
+    program_log.info(
+        "{} posts published, {} failed".format(len(results) - failed, failed)
+    )
+
+
+def failure_reason(result):
+    """Describe why a post failed to publish
+    """
+
+    if result.get("error"):
+        return result.get("error")
+    return "status code {}".format(result.get("status"))
@@ -0,0 +1,380 @@
+"""Bundling of the requests which create and update posts into requests to
+the Wordpress batch endpoint (`/batch/v1`, added in Wordpress 5.6), which
+runs up to 25 requests in a single round trip.
+
+Requests made at about the same time by the posts published in a run are
+queued for up to `batch_window` seconds, or until as many requests are
+queued as posts are being published at once, and then sent together. The
+result of each request is taken from the batch response, so each post sees
+the same response it would have received on its own. Requests are sent
+individually instead if the server doesn't support batch requests, or
+doesn't allow a request to be batched.
+"""
+import json
+import time
+import asyncio
+import threading
+import http.client
+import requests
+from gwbridge import program_log
+
+BATCH_ENDPOINT = "batch/v1"
+# The most requests the Wordpress server accepts in a batch
+MAX_BATCH_SIZE = 25
+# Seconds to wait for further requests to batch with the first one queued
+DEFAULT_BATCH_WINDOW = 0.05
+# Statuses of a batch request to a server without the batch endpoint
+UNSUPPORTED_STATUSES = {404, 405, 501}
+# The error given for a request to a route which can't be batched
+NOT_ALLOWED_CODE = "rest_batch_not_allowed"
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+class Request:
+    """A request queued to be sent in a batch. This has the attributes of a
+    `requests.PreparedRequest` used when logging its exchange
+    """
+
+    def __init__(self, method, url, path, payload):
+        self.method = method
+        self.url = url
+        self.path = path
+        self.payload = payload
+        self.headers = dict(JSON_HEADERS)
+        self.body = encode(payload)
+
+
+class Response:
+    """The response to a request sent in a batch, with the attributes of a
+    `requests.Response` read by the publishing pipeline
+    """
+
+    def __init__(self, request, status_code, headers, body):
+        self.request = request
+        self.url = request.url
+        self.status_code = status_code
+        self.reason = http.client.responses.get(status_code, "")
+        self.headers = headers or {}
+        self.text = json.dumps(body)
+        self.content = self.text.encode("utf-8")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(
+                "{} {} for url: {}".format(self.status_code, self.reason, self.url)
+            )
+
+
+def encode(payload):
+    """Encode the body of a request as JSON. Dates, such as that of a blank
+    post, are encoded as they would be in a form
+    """
+
+    return json.dumps(payload, default=str)
+
+
+def batch_body(queued):
+    """The body of a batch request running each of the `queued` requests
+    """
+
+    return {
+        "requests": [
+            {"method": request.method, "path": request.path, "body": request.payload}
+            for request in queued
+        ]
+    }
+
+
+def parse_batch(queued, response):
+    """Read the result of each of the `queued` requests from the response to
+    the batch request
+
+    :return: The response to each request, or `None` for requests to be sent
+        individually instead
+    :rtype: list
+    """
+
+    if response.status_code >= 500:
+        # The server may have run some of the requests, so they mustn't be
+        # repeated
+        return [
+            Response(
+                request,
+                response.status_code,
+                dict(response.headers),
+                {"message": response.text},
+            )
+            for request in queued
+        ]
+    if response.status_code not in (200, 207):
+        return [None] * len(queued)
+
+    results = response.json().get("responses") or []
+    if len(results) != len(queued):
+        program_log.warning("The batch response doesn't match the batch request")
+        return [None] * len(queued)
+
+    responses = []
+    for request, result in zip(queued, results):
+        body = (result or {}).get("body")
+        if isinstance(body, dict) and body.get("code") == NOT_ALLOWED_CODE:
+            responses.append(None)
+        else:
+            responses.append(
+                Response(request, result.get("status"), result.get("headers"), body)
+            )
+    return responses
+
+
+class BaseBundler:
+    """The state shared by the bundlers for threads and coroutines
+
+    :param session: The session the batch requests are sent with
+    :param base_url: The root of the REST API, against which the path of each
+        batched request is resolved
+    :type base_url: str
+    :param size: The most requests sent in a batch
+    :type size: int
+    :param window: Seconds to wait for further requests to batch with the
+        first one queued
+    :type window: float
+    """
+
+    def __init__(self, session, base_url, size=MAX_BATCH_SIZE, window=None):
+        self.session = session
+        self.base_url = base_url.rstrip("/")
+        self.batch_url = "{}/{}".format(self.base_url, BATCH_ENDPOINT)
+        self.size = max(1, min(MAX_BATCH_SIZE, int(size)))
+        self.window = DEFAULT_BATCH_WINDOW if window is None else float(window)
+        # Cleared once the server is found not to support batch requests
+        self.supported = True
+        self.pending = []
+
+    def build_request(self, url, payload):
+        """Build a request to batch, or `None` if it can't be batched
+        """
+
+        if not self.supported or not url.startswith(self.base_url + "/"):
+            return None
+        return Request("POST", url, url[len(self.base_url) :], payload)
+
+    def take(self):
+        """Remove the next batch of requests from the queue
+        """
+
+        queued, self.pending = self.pending[: self.size], self.pending[self.size :]
+        return queued
+
+    def read_batch(self, queued, response):
+        """Read the responses to a batch, noting whether the server supports
+        batch requests
+        """
+
+        if response.status_code in UNSUPPORTED_STATUSES:
+            if self.supported:
+                program_log.info(
+                    "The server doesn't support batch requests. "
+                    "Sending requests individually."
+                )
+            self.supported = False
+        program_log.debug(
+            "Sent {} requests in a batch, which returned {}".format(
+                len(queued), response.status_code
+            )
+        )
+        return parse_batch(queued, response)
+
+
+class Queued:
+    """A request waiting to be sent, and its outcome once it has been
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.taken = False
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+    def resolve(self, response=None, error=None):
+        self.response = response
+        self.error = error
+        self.done.set()
+
+
+class Bundler(BaseBundler):
+    """Bundles the post requests made by the threads publishing posts into
+    batch requests. The thread queueing the request which fills a batch, or
+    whose wait for the batch to fill runs out, sends the batch on behalf of
+    the others
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._condition = threading.Condition()
+
+    def post(self, url, payload):
+        """Send a POST request with the JSON `payload`, in a batch if possible
+
+        :return: The response to the request
+        """
+
+        request = self.build_request(url, payload)
+        if request is None:
+            return self.send_one(url, payload)
+
+        entry = Queued(request)
+        deadline = time.monotonic() + self.window
+        with self._condition:
+            self.pending.append(entry)
+            self._condition.notify_all()
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: entry.taken or len(self.pending) >= self.size,
+                    timeout=max(0.0, deadline - time.monotonic()),
+                )
+                if entry.taken:
+                    break
+                queued = self.take()
+                for e in queued:
+                    e.taken = True
+                self._condition.notify_all()
+            self.send(queued)
+
+        entry.done.wait()
+        if entry.error is not None:
+            raise entry.error
+        return entry.response
+
+    def send(self, queued):
+        """Send the queued requests, in a batch if there is more than one, and
+        resolve each with its response
+        """
+
+        results = [None] * len(queued)
+        if len(queued) > 1 and self.supported:
+            try:
+                response = self.session.post(
+                    self.batch_url,
+                    data=encode(batch_body([e.request for e in queued])),
+                    headers=JSON_HEADERS,
+                )
+                results = self.read_batch([e.request for e in queued], response)
+            except Exception as e:
+                for entry in queued:
+                    entry.resolve(error=e)
+                return
+
+        for entry, response in zip(queued, results):
+            if response is not None:
+                entry.resolve(response)
+                continue
+            try:
+                entry.resolve(self.send_one(entry.request.url, entry.request.payload))
+            except Exception as e:
+                entry.resolve(error=e)
+
+    def send_one(self, url, payload):
+        return self.session.post(url, data=encode(payload), headers=JSON_HEADERS)
+
+
+class AsyncBundler(BaseBundler):
+    """Bundles the post requests made by the coroutines publishing posts on
+    one event loop into batch requests, as per `Bundler`
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._timer = None
+        self._tasks = set()
+
+    async def post(self, url, payload):
+        """Send a POST request with the JSON `payload`, in a batch if possible
+        """
+
+        request = self.build_request(url, payload)
+        if request is None:
+            return await self.send_one(url, payload)
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.pending.append((request, future))
+        if len(self.pending) >= self.size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        """Send the queued requests, a batch at a time
+        """
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self.pending:
+            task = asyncio.ensure_future(self.send(self.take()))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def send(self, queued):
+        results = [None] * len(queued)
+        if len(queued) > 1 and self.supported:
+            try:
+                response = await self.session.post(
+                    self.batch_url,
+                    data=encode(batch_body([request for request, _ in queued])),
+                    headers=JSON_HEADERS,
+                )
+                results = self.read_batch([request for request, _ in queued], response)
+            except Exception as e:
+                for _, future in queued:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+        async def resolve(request, future, response):
+            try:
+                if response is None:
+                    response = await self.send_one(request.url, request.payload)
+                if not future.done():
+                    future.set_result(response)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+
+        await asyncio.gather(
+            *[
+                resolve(request, future, response)
+                for (request, future), response in zip(queued, results)
+            ]
+        )
+
+    async def send_one(self, url, payload):
+        return await self.session.post(url, data=encode(payload), headers=JSON_HEADERS)
+
+
+def create_bundler(config, session, workers=1, bundler_class=Bundler):
+    """Create the bundler for the post requests made in a run, as configured
+    by the `batch_requests`, `batch_size` and `batch_window` keys. No
+    bundler is created, and each request is sent on its own, if batching is
+    disabled or only one post is published at a time
+
+    :param workers: The number of posts published at once
+    :type workers: int
+    :return: The bundler, or `None`
+    """
+
+    if config.get("batch_requests") is False or not config.get("base_url"):
+        return None
+    size = min(int(config.get("batch_size") or MAX_BATCH_SIZE), int(workers or 1))
+    if size <= 1:
+        return None
+
+    return bundler_class(
+        session, config.get("base_url"), size=size, window=config.get("batch_window"),
+    )
@@ -0,0 +1,116 @@
+"""Detection of the posts affected by the changes made to a git repository
+since a given commit, so that `gwbridge publish --since <ref>` only publishes
+those posts.
+
+A post is affected by a change to its markdown file, its metadata or
+configuration, or any image it referenced when it was last published, as
+recorded in its fingerprint. A post without a fingerprint is affected by a
+change to any file in its directory. Changes to the manifest or the project
+configuration affect every post.
+"""
+import os
+import subprocess
+from gwbridge import CONFIG_FILE
+from gwbridge import METADATA_FILE
+from gwbridge import fingerprint
+from gwbridge import program_log
+from gwbridge import sources
+
+
+class ChangeDetectionError(Exception):
+    """Raised when the files changed since a commit can't be determined
+    """
+
+
+def git(*args, cwd="."):
+    """Run a git command in `cwd`, returning its output
+    """
+
+    try:
+        result = subprocess.run(
+            ["git"] + list(args),
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+    except FileNotFoundError:
+        raise ChangeDetectionError("git is not installed")
+    if result.returncode != 0:
+        raise ChangeDetectionError(
+            "git {} failed: {}".format(" ".join(args), result.stderr.strip())
+        )
+
+    return result.stdout
+
+
+def changed_files(since, cwd="."):
+    """The files added, modified or deleted between the commit `since` and the
+    working tree of the repository containing `cwd`. Renamed files are
+    reported at both their old and new paths
+
+    :return: The absolute paths of the changed files
+    :rtype: set
+    """
+
+    toplevel = git("rev-parse", "--show-toplevel", cwd=cwd).strip()
+    output = git("diff", "--name-only", "--no-renames", "-z", since, "--", cwd=cwd)
+
+    return {
+        os.path.realpath(os.path.join(toplevel, path))
+        for path in output.split("\0")
+        if path
+    }
+
+
+def post_paths(config, root=".", previous=None):
+    """The paths of the files a post is published from, joined to `root`:
+    its markdown files, metadata and configuration, and the images it
+    referenced when the `previous` fingerprint was recorded
+    """
+
+    paths = sources.source_paths(config, root) + [METADATA_FILE, CONFIG_FILE]
+    paths.extend((previous or {}).get("images", {}))
+
+    return [os.path.join(root, path) for path in paths if path]
+
+
+def post_files(config, root="."):
+    """The files a post is published from, as per `post_paths`
+
+    :return: The absolute paths of the files, or `None` if the post hasn't
+        been published before, and so the images it references are unknown
+    :rtype: set
+    """
+
+    previous = fingerprint.load_fingerprint(root)
+    if not previous:
+        return None
+
+    return {os.path.realpath(path) for path in post_paths(config, root, previous)}
+
+
+def is_affected(config, changed, root="."):
+    """Determine whether the post in `root` is affected by the `changed`
+    files
+    """
+
+    files = post_files(config, root)
+    if files is None:
+        directory = os.path.join(os.path.realpath(root), "")
+        return any(path.startswith(directory) for path in changed)
+
+    return bool(files & changed)
+
+
+def affects_all(changed, paths):
+    """Determine whether any of the files which configure every post, such
+    as the manifest, are among the `changed` files
+    """
+
+    return any(os.path.realpath(path) in changed for path in paths if path)
+
+
+def log_changes(since, changed):
+    program_log.info("{} files changed since {}".format(len(changed), since))
+    program_log.debug("Changed files: {}".format(sorted(changed)))
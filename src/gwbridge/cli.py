@@ -1,5 +1,8 @@
 import click
-import gwbridge.application
+from gwbridge import logger
+
+# The modules implementing each command are imported by the command, so that
+# the libraries they depend on are only loaded when they are needed
 
 
 @click.group()
@@ -19,6 +22,7 @@ import gwbridge.application
 @click.option("-q", "verbosity", flag_value=0, help="Suppress all output")
 @click.pass_context
 def cli(ctx, **kwargs):
+    logger.configure_logger()
     ctx.obj = kwargs
 
 
@@ -30,9 +34,96 @@ def cli(ctx, **kwargs):
 @click.option("--resource-owner-secret", type=str, help="The resource owner secret")
 @click.option("--base-url", type=str, help="The URL to make API calls against")
 @click.option("--api-version", type=str, help="The version of the site's API to use")
+@click.option(
+    "--manifest",
+    type=click.Path(exists=True, dir_okay=False),
+    help="A JSON file listing post directories to publish in a single run",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    help="The number of posts to publish concurrently with --manifest",
+)
+@click.option(
+    "--upload-concurrency",
+    type=click.IntRange(min=1),
+    help="The number of images to upload at once for each post",
+)
+@click.option(
+    "--timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Seconds to wait for the server to respond to each request",
+)
+@click.option(
+    "--rate-limit",
+    type=click.FloatRange(min=0, min_open=True),
+    help="The maximum number of requests to make to the server per second",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(["threads", "asyncio"]),
+    help="Publish with a thread pool, or with asyncio (requires aiohttp)",
+)
+@click.option(
+    "--trace",
+    type=click.Path(dir_okay=False),
+    help="Record a trace of every message logged to this file, as JSON lines",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Time each stage of publishing and each request, and print a summary",
+)
+@click.option(
+    "--profile-trace",
+    type=click.Path(dir_okay=False),
+    help="Profile as with --profile, and write a Chrome trace to this file",
+)
+@click.option(
+    "--since",
+    type=str,
+    help="Only publish posts whose sources changed since this git commit",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Publish posts even if they are unchanged since they were last published",
+)
 @click.pass_context
 def publish(ctx, **kwargs):
-    gwbridge.application.publish(ctx, **kwargs)
+    from gwbridge import application
+
+    application.publish(ctx, **kwargs)
+
+
+@cli.command()
+@click.option("-f", "--file", type=str, help="The file to publish")
+@click.option("--client-key", type=str, help="The client key")
+@click.option("--client-secret", type=str, help="The client secret")
+@click.option("--resource-owner-key", type=str, help="The resource owner key")
+@click.option("--resource-owner-secret", type=str, help="The resource owner secret")
+@click.option("--base-url", type=str, help="The URL to make API calls against")
+@click.option("--api-version", type=str, help="The version of the site's API to use")
+@click.option(
+    "--timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Seconds to wait for the server to respond to each request",
+)
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Seconds between checks for changes [default: 0.2]",
+)
+@click.option(
+    "--debounce",
+    type=click.FloatRange(min=0),
+    help="Seconds to wait for further changes before publishing [default: 0.3]",
+)
+@click.pass_context
+def watch(ctx, **kwargs):
+    from gwbridge import watch as watcher
+
+    watcher.watch(ctx, **kwargs)
 
 
 @cli.command()
@@ -42,13 +133,51 @@ def publish(ctx, **kwargs):
 @click.option("--api-version", type=str, help="The version of the site's API to use")
 @click.pass_context
 def authenticate(ctx, **kwargs):
-    gwbridge.application.authenticate(ctx, **kwargs)
+    from gwbridge import application
+
+    application.authenticate(ctx, **kwargs)
+
+
+@cli.group()
+def state():
+    """Manage the SQLite store of posts and media"""
+
+
+@state.command(name="import")
+@click.option(
+    "--state-store", type=str, help="The store file [default: .deploy/state.db]"
+)
+@click.option(
+    "--manifest",
+    type=click.Path(exists=True, dir_okay=False),
+    help="A JSON file listing the post directories to import",
+)
+@click.pass_context
+def import_state(ctx, **kwargs):
+    """Fill the store from the JSON state files"""
+    from gwbridge import state as store
+
+    store.import_state(ctx, **kwargs)
+
+
+@state.command(name="export")
+@click.option(
+    "--state-store", type=str, help="The store file [default: .deploy/state.db]"
+)
+@click.pass_context
+def export_state(ctx, **kwargs):
+    """Write the JSON state files from the store"""
+    from gwbridge import state as store
+
+    store.export_state(ctx, **kwargs)
 
 
 @cli.command()
 @click.pass_context
 def init(ctx, **kwargs):
-    gwbridge.application.init(ctx, **kwargs)
+    from gwbridge import project
+
+    project.init(ctx, **kwargs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,400 @@
+"""The engines which convert the markdown source of a post to HTML. The
+engine is selected by the `converter` key of `.deploy/config.json`:
+
+- `pandoc`, the default, runs a new pandoc process for each post
+- `pandoc-server` starts a single `pandoc server` process, which is reused for
+  every post in a run. An existing server can be used by setting the
+  `pandoc_server` key to its URL
+- `commonmark` converts posts in-process, without pandoc, using the optional
+  `markdown-it-py` dependency. This supports CommonMark only, so is suited to
+  simple posts which don't rely on pandoc's extensions to markdown
+
+The output of each engine is cached on disk, keyed by the source, the formats
+converted between and the engine's version, so that unchanged posts aren't
+converted again.
+
+Each engine's `convert` method also takes an `id_prefix`, which is prepended
+to the identifiers in the HTML, such as those of footnotes, so that several
+documents converted separately can be joined into one post.
+
+Each engine imports the libraries it uses when it is created or first used,
+so that only the selected engine's dependencies are loaded.
+"""
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from gwbridge import CONVERSION_CACHE_DIR
+from gwbridge import fingerprint
+from gwbridge import program_log
+
+DEFAULT_CONVERTER = "pandoc"
+# The maximum size of the conversion cache in bytes
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+# The formats posts are converted from and to by default
+SOURCE_FORMAT = "markdown"
+OUTPUT_FORMAT = "html"
+# Seconds to wait for a pandoc server to start accepting connections
+SERVER_START_TIMEOUT = 10
+# Seconds a pandoc server may spend converting a single post
+SERVER_CONVERT_TIMEOUT = 60
+
+
+class PandocConverter:
+    """Converts markdown to HTML by running a pandoc process
+    """
+
+    def convert(self, data, format=SOURCE_FORMAT, to=OUTPUT_FORMAT, id_prefix=None):
+        import pypandoc
+
+        extra_args = ["--id-prefix={}".format(id_prefix)] if id_prefix else []
+        return pypandoc.convert_text(data, to, format=format, extra_args=extra_args)
+
+    def identity(self):
+        """Describe the engine that output is produced with
+        """
+
+        import pypandoc
+
+        return {"engine": "pandoc", "version": pypandoc.get_pandoc_version()}
+
+    def close(self):
+        pass
+
+
+class PandocServerConverter:
+    """Converts markdown to HTML with a long-lived pandoc server, which avoids
+    the cost of starting pandoc for each post. The server is started on the
+    first conversion, unless the URL of a running server is given, and is
+    stopped when the converter is closed
+
+    :param url: The URL of a running pandoc server
+    :type url: str
+    """
+
+    def __init__(self, url=None):
+        import requests
+
+        self.url = url
+        self.process = None
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+
+    def convert(self, data, format=SOURCE_FORMAT, to=OUTPUT_FORMAT, id_prefix=None):
+        options = {"text": data, "from": format, "to": to}
+        if id_prefix:
+            # The server takes the options of a defaults file, rather than
+            # the names of command line flags
+            options["identifier-prefix"] = id_prefix
+        response = self.session.post(
+            self.start(),
+            json=options,
+            headers={"Accept": "text/plain"},
+            timeout=SERVER_CONVERT_TIMEOUT,
+        )
+        response.raise_for_status()
+        response.encoding = "utf-8"
+
+        return response.text
+
+    def identity(self):
+        response = self.session.get(
+            self.start() + "/version", timeout=SERVER_CONVERT_TIMEOUT
+        )
+        response.raise_for_status()
+
+        return {"engine": "pandoc", "version": response.text.strip()}
+
+    def start(self):
+        """Start the pandoc server if it isn't running
+
+        :return: The URL of the server
+        :rtype: str
+        """
+
+        with self._lock:
+            if self.url:
+                return self.url
+
+            import pypandoc
+
+            port = free_port()
+            command = [
+                pypandoc.get_pandoc_path(),
+                "server",
+                "--port",
+                str(port),
+                "--timeout",
+                str(SERVER_CONVERT_TIMEOUT),
+            ]
+            program_log.debug("Starting pandoc server: {}".format(" ".join(command)))
+            self.process = subprocess.Popen(
+                command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            wait_for_port(port, self.process)
+            self.url = "http://127.0.0.1:{}".format(port)
+
+            return self.url
+
+    def close(self):
+        self.session.close()
+        if self.process is not None:
+            program_log.debug("Stopping pandoc server")
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+            self.url = None
+
+
+class CommonMarkConverter:
+    """Converts CommonMark to HTML in-process
+    """
+
+    def __init__(self):
+        try:
+            from markdown_it import MarkdownIt
+        except ImportError:
+            raise ImportError(
+                "The commonmark converter requires markdown-it-py. Install it "
+                "with `pip install gwbridge[commonmark]`"
+            )
+        self.markdown = MarkdownIt("commonmark")
+
+    def convert(self, data, format=SOURCE_FORMAT, to=OUTPUT_FORMAT, id_prefix=None):
+        # CommonMark has no footnotes, and no identifiers are generated
+        if (format, to) != (SOURCE_FORMAT, OUTPUT_FORMAT):
+            raise ValueError(
+                "The commonmark converter can't convert {} to {}".format(format, to)
+            )
+        return self.markdown.render(data)
+
+    def identity(self):
+        from markdown_it import __version__
+
+        return {"engine": "commonmark", "version": __version__}
+
+    def close(self):
+        pass
+
+
+class ConversionCache:
+    """A store of converted HTML on disk, bounded in size. Each entry is a
+    file, whose modification time records when it was last used, so that the
+    least recently used entries are evicted first. The store is safe to share
+    between threads and processes.
+
+    :param directory: The directory the entries are stored in
+    :type directory: str
+    :param max_size: The maximum total size of the entries in bytes
+    :type max_size: int
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Obtain the HTML stored under `key`, or `None`
+        """
+
+        path = os.path.join(self.directory, key + ".html")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                html = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            html = None
+
+        with self._lock:
+            if html is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return html
+
+    def put(self, key, html):
+        """Store HTML under `key`, evicting the least recently used entries if
+        the store is too large
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(html)
+            os.replace(temp, os.path.join(self.directory, key + ".html"))
+        except BaseException:
+            os.remove(temp)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the store is no larger
+        than its maximum size
+        """
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".html"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        size = sum(x[1] for x in entries)
+        for mtime, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            program_log.debug("Evicting {} from the conversion cache".format(path))
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+
+class CachingConverter:
+    """Wraps a converter, reusing the output it produced previously for the
+    same source and formats
+
+    :param converter: The converter used on a cache miss
+    :param cache: The store of converted HTML
+    :type cache: `ConversionCache`
+    """
+
+    def __init__(self, converter, cache):
+        self.converter = converter
+        self.cache = cache
+        self._identity = None
+
+    def convert(self, data, format=SOURCE_FORMAT, to=OUTPUT_FORMAT, id_prefix=None):
+        if self._identity is None:
+            self._identity = fingerprint.hash_json(self.converter.identity())
+        key = {
+            "source": fingerprint.hash_bytes(data),
+            "from": format,
+            "to": to,
+            "converter": self._identity,
+        }
+        if id_prefix:
+            key["id_prefix"] = id_prefix
+        key = fingerprint.hash_json(key)
+
+        html = self.cache.get(key)
+        if html is None:
+            html = self.converter.convert(
+                data, format=format, to=to, id_prefix=id_prefix
+            )
+            self.cache.put(key, html)
+
+        return html
+
+    def identity(self):
+        return self.converter.identity()
+
+    def close(self):
+        if self.cache.hits or self.cache.misses:
+            program_log.info(
+                "Conversion cache: {} hits, {} misses".format(
+                    self.cache.hits, self.cache.misses
+                )
+            )
+        self.converter.close()
+
+
+CONVERTERS = {
+    "pandoc": PandocConverter,
+    "pandoc-server": PandocServerConverter,
+    "commonmark": CommonMarkConverter,
+}
+
+
+def create_converter(config):
+    """Create the converter configured by the `converter` key. Unless the
+    `conversion_cache` key is `false`, its output is cached in the directory
+    it names, or by default in `$XDG_CACHE_HOME/gwbridge/conversions` if
+    `XDG_CACHE_HOME` is set, or otherwise in `.deploy/cache/conversions`. The
+    size of the cache in bytes is set by the `conversion_cache_size` key
+
+    :param config: The consolidated configuration
+    :type config: dict
+    :return: The converter, with `convert(data, format, to)`, `identity()`
+        and `close()` methods
+    """
+
+    converter = create_engine(config)
+
+    directory = config.get("conversion_cache", True)
+    if directory is False:
+        return converter
+    if directory is True:
+        directory = default_cache_dir()
+    cache = ConversionCache(
+        directory,
+        max_size=int(config.get("conversion_cache_size") or DEFAULT_CACHE_SIZE),
+    )
+
+    return CachingConverter(converter, cache)
+
+
+def create_engine(config):
+    """Create the converter engine configured by the `converter` key
+    """
+
+    name = config.get("converter") or DEFAULT_CONVERTER
+    if name not in CONVERTERS:
+        raise ValueError(
+            "Unknown converter {}. Expected one of: {}".format(
+                name, ", ".join(sorted(CONVERTERS))
+            )
+        )
+    if name == "pandoc-server":
+        return PandocServerConverter(url=config.get("pandoc_server"))
+
+    return CONVERTERS.get(name)()
+
+
+def default_cache_dir():
+    """The directory converted HTML is cached in by default
+    """
+
+    if os.environ.get("XDG_CACHE_HOME"):
+        return os.path.join(os.environ.get("XDG_CACHE_HOME"), "gwbridge", "conversions")
+    return CONVERSION_CACHE_DIR
+
+
+def free_port():
+    """Find a port on the loopback interface that isn't in use
+    """
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=SERVER_START_TIMEOUT):
+    """Wait for a process to start listening on a port
+    """
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(
+                "pandoc server exited with status {}".format(process.returncode)
+            )
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.05)
+
+    process.terminate()
+    raise RuntimeError("pandoc server did not start within {}s".format(timeout))
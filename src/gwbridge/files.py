@@ -0,0 +1,68 @@
+"""Writing of the state files in `.deploy`, such that a crash or interrupted
+run never leaves a file partially written.
+"""
+import os
+import stat
+import tempfile
+
+# The mode of a newly created file before the umask is applied, as per `open`
+DEFAULT_MODE = 0o666
+
+
+def current_umask():
+    """The umask of the process, which can only be read by setting it
+    """
+
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# Read once, as setting the umask to read it isn't safe while other threads
+# create files
+UMASK = current_umask()
+
+
+def write_atomic(path, data):
+    """Replace the contents of the file at `path` with `data`. The data is
+    written to a temporary file in the same directory, flushed to disk, and
+    renamed over `path`, so that readers see either the old or the new
+    contents in full. The file keeps the mode of the file it replaces, or if
+    there is none, is given the mode `open` would create it with
+
+    :param path: The file to write
+    :type path: str
+    :param data: The contents of the file
+    :type data: str or bytes
+    """
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp = tempfile.mkstemp(
+        dir=directory, prefix=".{}.".format(os.path.basename(path)), suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # The temporary file is created readable only by its owner
+        os.chmod(temp, file_mode(path))
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def file_mode(path):
+    """The permission bits of the file at `path`, or of a new file created
+    under the process umask if it doesn't exist
+    """
+
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return DEFAULT_MODE & ~UMASK
@@ -0,0 +1,155 @@
+import os
+import json
+import hashlib
+from gwbridge import FINGERPRINT_FILE
+from gwbridge import files
+
+# Configuration keys that affect the content of a post, and so are part of
+# its fingerprint. Other keys, such as credentials and the settings of the
+# connection, caches and concurrency, only change how a post is published
+CONTENT_CONFIG_KEYS = {
+    "api_version",
+    "base_url",
+    "converter",
+    "file",
+    "html_parser",
+    "optimise_images",
+    "pipeline",
+}
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_bytes(data):
+    """Compute the SHA-256 digest of a bytes or str object
+    """
+
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_json(obj):
+    """Compute the SHA-256 digest of a JSON serialisable object. Keys are
+    sorted so that the digest doesn't depend on insertion order
+    """
+
+    return hash_bytes(json.dumps(obj, sort_keys=True, default=str))
+
+
+def hash_file(path):
+    """Compute the SHA-256 digest of a file, reading it in chunks. Returns
+    `None` if the file doesn't exist
+    """
+
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+
+    return digest.hexdigest()
+
+
+def hash_fields(payload):
+    """Compute the digest of each field of a request body, so that the fields
+    which change between updates can be found without keeping the values
+    """
+
+    return {k: hash_json(v) for k, v in payload.items()}
+
+
+def changed_fields(payload, fields):
+    """The fields of a request body whose values differ from the digests
+    recorded in `fields` by `hash_fields`
+    """
+
+    return {k: v for k, v in payload.items() if fields.get(k) != hash_json(v)}
+
+
+def source_fingerprint(data, metadata, config, images, root="."):
+    """Fingerprint everything a post is rendered from: the markdown source,
+    the post metadata, the configuration affecting its content, and the local
+    images referenced by the post. Image paths are resolved relative to `root`
+
+    :param data: The markdown source of the post
+    :type data: str
+    :param metadata: The post metadata
+    :type metadata: dict
+    :param config: The configuration used to publish the post
+    :type config: dict
+    :param images: The local paths of images referenced by the post
+    :type images: list
+    :param root: The directory against which image paths are resolved
+    :type root: str
+    :return: The fingerprint of the post sources
+    :rtype: dict
+    """
+
+    return {
+        "source": hash_bytes(data),
+        "metadata": hash_json(metadata),
+        "config": hash_json(
+            {k: v for k, v in config.items() if k in CONTENT_CONFIG_KEYS}
+        ),
+        "images": {img: hash_file(os.path.join(root, img)) for img in images},
+    }
+
+
+def is_unchanged(previous, data, metadata, config, root="."):
+    """Determine whether a post is unchanged since the fingerprint `previous`
+    was recorded. The images checked are those referenced by the post when it
+    was fingerprinted, which is sufficient because any change to the set of
+    images referenced must also change the markdown source.
+    """
+
+    if not previous or not previous.get("payload"):
+        return False
+
+    current = source_fingerprint(
+        data, metadata, config, previous.get("images", {}).keys(), root=root
+    )
+    return all(previous.get(k) == v for k, v in current.items())
+
+
+def is_content_unchanged(previous, data, metadata, config, root="."):
+    """Determine whether everything a post's content is rendered from is
+    unchanged since the fingerprint `previous` was recorded, so that only its
+    metadata can have changed. Only fingerprints which record the fields of
+    the published post are considered, as the rendered fields must be known
+    """
+
+    if not previous or not previous.get("fields"):
+        return False
+
+    current = source_fingerprint(
+        data, metadata, config, previous.get("images", {}).keys(), root=root
+    )
+    return all(
+        previous.get(k) == current.get(k) for k in ["source", "config", "images"]
+    )
+
+
+def load_fingerprint(root="."):
+    """Read the fingerprint recorded the last time the post was published.
+    Returns an empty dictionary if there isn't one
+    """
+
+    fingerprint_file = os.path.join(root, FINGERPRINT_FILE)
+    if not os.path.exists(fingerprint_file):
+        return {}
+
+    with open(fingerprint_file, "r") as f:
+        return json.loads(f.read())
+
+
+def save_fingerprint(fingerprint, root="."):
+    """Record the fingerprint of a successfully published post
+    """
+
+    files.write_atomic(
+        os.path.join(root, FINGERPRINT_FILE),
+        json.dumps(fingerprint, indent=4, sort_keys=True),
+    )
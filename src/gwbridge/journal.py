@@ -0,0 +1,121 @@
+"""A write-ahead journal of the steps completed while publishing a post, so
+that a run which dies part way through can be resumed without repeating them.
+
+The journal is kept in `.deploy/journal.jsonl` while a post is being
+published. Each completed step is appended to it as a line of JSON and
+flushed to disk before the next step begins:
+
+- `post_created`, when a blank post is created for a new post
+- `media_uploaded`, when an image is uploaded
+- `content_pushed`, when the content of the post is updated
+
+Once the post is published and its metadata and fingerprint are saved, the
+journal is removed. If a journal is found when publishing starts, the
+previous run didn't finish, and the steps it records are applied before
+publishing continues.
+"""
+import os
+import json
+import threading
+from gwbridge import JOURNAL_FILE
+from gwbridge import program_log
+
+POST_CREATED = "post_created"
+MEDIA_UPLOADED = "media_uploaded"
+CONTENT_PUSHED = "content_pushed"
+
+
+class Journal:
+    """The journal of a single post. Safe to share between threads
+
+    :param path: The file the journal is written to. If `None`, steps are
+        only held in memory
+    :type path: str
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = []
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        self.entries.append(json.loads(line))
+                    except ValueError:
+                        # The run died while writing this step, so it didn't
+                        # complete
+                        break
+
+    def record(self, step, **fields):
+        """Record that a step has completed
+        """
+
+        entry = {"step": step, **fields}
+        with self._lock:
+            self.entries.append(entry)
+            if not self.path:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry, sort_keys=True) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def completed(self, step):
+        """The entries recorded for each completion of `step`
+        """
+
+        with self._lock:
+            return [e for e in self.entries if e.get("step") == step]
+
+    def clear(self):
+        """Remove the journal once the post has been published
+        """
+
+        with self._lock:
+            self.entries = []
+            if self.path and os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def open_journal(root="."):
+    """Open the journal of the post in `root`
+    """
+
+    return Journal(os.path.join(root, JOURNAL_FILE))
+
+
+def resume(journal, metadata, ledger):
+    """Apply the steps recorded by an unfinished run: adopt the post it
+    created, if the post's metadata wasn't updated, and record the images it
+    uploaded in the media `ledger`, so that they aren't uploaded again
+
+    :return: The fingerprint of the content pushed by the unfinished run, if
+        it pushed the content of the post but didn't record its fingerprint
+    :rtype: dict
+    """
+
+    if not journal.entries:
+        return None
+
+    program_log.info("Resuming an unfinished run from {}".format(journal.path))
+    for entry in journal.completed(POST_CREATED):
+        if not metadata.get("id"):
+            program_log.info("Using post {} created previously".format(entry["id"]))
+            metadata["id"] = entry.get("id")
+
+    for entry in journal.completed(MEDIA_UPLOADED):
+        if ledger.lookup(entry.get("digest")) is None:
+            ledger.record(
+                entry.get("digest"),
+                entry.get("id"),
+                entry.get("url"),
+                entry.get("filename"),
+            )
+
+    pushed = journal.completed(CONTENT_PUSHED)
+    if pushed and pushed[-1].get("post") == metadata.get("id"):
+        return pushed[-1].get("fingerprint")
+    return None
@@ -1,7 +1,14 @@
 import os
+import json
+import queue
 import logging
+import logging.handlers
 from gwbridge import PROGRAM_NAME
 
+# The number of characters of a request or response body included in the log.
+# `None` includes bodies in full
+BODY_LIMIT = 1000
+
 
 def configure_logger():
     """ Initialises the program log for use
@@ -11,7 +18,12 @@ def configure_logger():
     """
 
     program_log = logging.getLogger(PROGRAM_NAME)
-    program_log.setLevel(1)
+    # Records below INFO are only created once a handler needs them, so that
+    # debug messages cost nothing unless they're shown or traced
+    program_log.setLevel(logging.INFO)
+    if any(isinstance(h, logging.StreamHandler) for h in program_log.handlers):
+        # The log has already been configured
+        return program_log
 
     # Create a log to console
     console_handler = logging.StreamHandler()
@@ -49,6 +61,8 @@ def adjust_handler_level(logger, handler, level):
         if isinstance(h, handler):
             try:
                 h.setLevel(level)
+                if logger.getEffectiveLevel() > level:
+                    logger.setLevel(level)
                 updated = True
                 logger.info(
                     "{} logging level changed to {}".format(
@@ -80,3 +94,168 @@ def remove_handler(logger, handler):
     for h in logger.handlers:
         if isinstance(h, handler):
             logger.removeHandler(h)
+
+
+def truncate(text, limit=None):
+    """Shorten text to at most `limit` characters for the log, noting how much
+    was left out. By default, text is shortened to `BODY_LIMIT` characters
+    """
+
+    limit = BODY_LIMIT if limit is None else limit
+    if text is None or limit is None or len(text) <= limit:
+        return text
+
+    return "{}... ({} more characters)".format(text[:limit], len(text) - limit)
+
+
+class Exchange:
+    """A request to the Wordpress server and its response, as a log message.
+    The message is only formatted when a handler emits it, so logging an
+    exchange costs nothing if debug messages aren't shown or traced
+
+    :param response: The response, which refers to the request
+    :type response: `requests.Response`
+    """
+
+    def __init__(self, response):
+        self.response = response
+        self.limit = BODY_LIMIT
+
+    def to_dict(self):
+        request = self.response.request
+        body = request.body
+        if isinstance(body, bytes):
+            body = body.decode("utf-8", errors="replace")
+        elif body is not None and not isinstance(body, str):
+            # A streamed upload
+            body = "<{}>".format(getattr(body, "name", type(body).__name__))
+
+        return {
+            "request": {
+                "method": request.method,
+                "url": request.url,
+                "headers": dict(request.headers),
+                "body": truncate(body, self.limit),
+            },
+            "response": {
+                "status": self.response.status_code,
+                "reason": self.response.reason,
+                "url": self.response.url,
+                "headers": dict(self.response.headers),
+                "body": truncate(self.response.text, self.limit),
+            },
+        }
+
+    def summary(self):
+        request = self.response.request
+        return "{} {} returned {}".format(
+            request.method, request.url, self.response.status_code
+        )
+
+    def __str__(self):
+        exchange = self.to_dict()
+        req, res = exchange.get("request"), exchange.get("response")
+        return "\n".join(
+            [
+                "",
+                "---------------- request ----------------",
+                "{} {}".format(req.get("method"), req.get("url")),
+                format_headers(req.get("headers")),
+                "",
+                str(req.get("body")),
+                "---------------- response ----------------",
+                "{} {} {}".format(res.get("status"), res.get("reason"), res.get("url")),
+                format_headers(res.get("headers")),
+                "",
+                str(res.get("body")),
+                "",
+            ]
+        )
+
+
+def log_exchange(logger, response):
+    """Log a request and its response at debug level, with their bodies
+    truncated to `BODY_LIMIT` characters
+    """
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(Exchange(response))
+
+
+def format_headers(headers):
+    return "\n".join("{}: {}".format(k, v) for k, v in headers.items())
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats each record as a single line of JSON. Exchanges with the
+    Wordpress server are recorded as structured data
+    """
+
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "module": record.module,
+            "thread": record.threadName,
+        }
+        if isinstance(record.msg, Exchange):
+            entry["message"] = record.msg.summary()
+            entry.update(record.msg.to_dict())
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """A `QueueHandler` which leaves the formatting of each record to the
+    listener's thread. Records are only read by handlers in this process, so
+    they don't need to be made picklable first
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def start_trace(logger, path):
+    """Record every message logged, at every level, to `path` as JSON lines.
+    Records are passed to a background thread to be formatted and written, so
+    tracing doesn't slow down publishing
+
+    :return: The listener writing the trace, which should be stopped to flush
+        it once publishing is complete
+    :rtype: `logging.handlers.QueueListener`
+    """
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    file_handler = logging.FileHandler(path, encoding="utf-8")
+    file_handler.setFormatter(JsonLinesFormatter())
+
+    records = queue.Queue()
+    queue_handler = DeferredQueueHandler(records)
+    queue_handler.setLevel(logging.DEBUG)
+    logger.addHandler(queue_handler)
+    previous_level = logger.level
+    if logger.getEffectiveLevel() > logging.DEBUG:
+        logger.setLevel(logging.DEBUG)
+
+    listener = logging.handlers.QueueListener(records, file_handler)
+    listener.handler = queue_handler
+    listener.previous_level = previous_level
+    listener.start()
+
+    return listener
+
+
+def stop_trace(logger, listener):
+    """Stop recording a trace started with `start_trace`, writing any records
+    still queued
+    """
+
+    logger.removeHandler(listener.handler)
+    logger.setLevel(listener.previous_level)
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
@@ -0,0 +1,334 @@
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from gwbridge import files
+from gwbridge import fingerprint
+from gwbridge import program_log
+
+# The maximum page size permitted by the Wordpress REST API
+PER_PAGE = 100
+# The fields of each media item used by gwbridge. Requesting only these
+# substantially reduces the size of each page.
+MEDIA_FIELDS = "id,modified,guid"
+DEFAULT_INDEX_WORKERS = 4
+# The number of images uploaded at once for each post
+DEFAULT_UPLOAD_CONCURRENCY = 4
+
+
+class MediaLedger:
+    """A persistent record of the images uploaded to the Wordpress server,
+    keyed by the SHA-256 digest of their content. This allows an image to be
+    uploaded exactly once, regardless of how many posts or paths refer to it.
+
+    The ledger also keeps an index of the size and modification time of each
+    local file it has hashed, so that unchanged files aren't hashed again.
+    The ledger is safe to share between threads.
+
+    :param path: The file the ledger is persisted to. If `None`, the ledger is
+        only held in memory
+    :type path: str
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.media = {}
+        self.files = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._upload_locks = {}
+
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                ledger = json.loads(f.read())
+            self.media = ledger.get("media", {})
+            self.files = ledger.get("files", {})
+
+    def digest(self, path):
+        """Obtain the SHA-256 digest of a local file, reusing the recorded
+        digest if the file's size and modification time haven't changed.
+        Returns `None` if the file doesn't exist
+        """
+
+        key = os.path.normpath(path)
+        try:
+            stat = os.stat(key)
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            entry = self.files.get(key)
+        if (
+            entry
+            and entry.get("size") == stat.st_size
+            and entry.get("mtime") == stat.st_mtime_ns
+        ):
+            return entry.get("sha256")
+
+        digest = fingerprint.hash_file(key)
+        with self._lock:
+            self.files[key] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "sha256": digest,
+            }
+            self._dirty = True
+
+        return digest
+
+    def lookup(self, digest):
+        """Obtain the remote media recorded for an image digest, if any
+        """
+
+        with self._lock:
+            return self.media.get(digest)
+
+    def record(self, digest, media_id, url, filename):
+        """Record that the image with the given digest is available on the
+        Wordpress server
+        """
+
+        with self._lock:
+            self.media[digest] = {"id": media_id, "url": url, "filename": filename}
+            self._dirty = True
+
+    def upload_lock(self, digest):
+        """Obtain a lock specific to an image digest. This should be held while
+        uploading the image, so that two posts referencing the same image
+        don't both upload it
+        """
+
+        with self._lock:
+            return self._upload_locks.setdefault(digest, threading.Lock())
+
+    def save(self):
+        """Persist the ledger, if it has changed since it was loaded
+        """
+
+        if not self.path:
+            return
+
+        with self._lock:
+            if not self._dirty:
+                return
+            ledger = {"media": self.media, "files": self.files}
+            program_log.debug("Saving media ledger to {}".format(self.path))
+            files.write_atomic(self.path, json.dumps(ledger, indent=4, sort_keys=True))
+            self._dirty = False
+
+
+class MediaIndex:
+    """An index of the media on the Wordpress server. Listings are fetched
+    with the largest page size the API allows, with any pages after the first
+    fetched concurrently. Each listing is cached, and on subsequent requests
+    only the first page is fetched to revalidate the cached listing: if the
+    server reports the same total number of items and the same most recently
+    modified item (or the listing's ETag matches), the cached listing is used.
+
+    :param session: The session used to make authenticated requests
+    :type session: `gwbridge.transport.WordpressSession`
+    :param cache_file: The file the cached listings are persisted to. If
+        `None`, listings are only cached in memory
+    :type cache_file: str
+    :param workers: The maximum number of pages to fetch concurrently
+    :type workers: int
+    """
+
+    def __init__(self, session, cache_file=None, workers=DEFAULT_INDEX_WORKERS):
+        self.session = session
+        self.cache_file = cache_file
+        self.workers = workers
+        self.cache = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        if cache_file and os.path.exists(cache_file):
+            with open(cache_file, "r") as f:
+                self.cache = json.loads(f.read())
+
+    def fetch(self, media_url, params=None):
+        """Obtain every media item matching the query `params`, such as
+        `{"parent": 254}` or `{"search": "test1"}`
+
+        :return: The media items, most recently modified first
+        :rtype: list
+        """
+
+        key, params, cached, headers = self.prepare_query(media_url, params)
+        response = self.session.get(
+            media_url, params={**params, "page": 1}, headers=headers
+        )
+        program_log.debug(
+            "Media listing {} returned {}".format(response.url, response.status_code)
+        )
+        if response.status_code == 304 and cached:
+            program_log.debug("Media listing {} not modified".format(key))
+            return cached.get("items")
+        response.raise_for_status()
+
+        listing = first_page_listing(response.headers, json.loads(response.text))
+        if is_current(cached, listing):
+            program_log.debug("Cached media listing {} is up to date".format(key))
+            return cached.get("items")
+
+        pages = listing.get("pages")
+        if pages > 1:
+            program_log.debug(
+                "Fetching {} further pages of media listing {}".format(pages - 1, key)
+            )
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for page in executor.map(
+                    lambda n: self._fetch_page(media_url, params, n),
+                    range(2, pages + 1),
+                ):
+                    listing["items"].extend(page)
+
+        self.store(key, listing)
+        return listing.get("items")
+
+    def prepare_query(self, media_url, params=None):
+        """Build the parameters for a media listing query, and look up any
+        cached listing for it
+
+        :return: The cache key of the query, the query parameters, the cached
+            listing or `None`, and the headers to revalidate the cached
+            listing with
+        :rtype: tuple
+        """
+
+        params = {
+            "per_page": PER_PAGE,
+            "orderby": "modified",
+            "order": "desc",
+            "_fields": MEDIA_FIELDS,
+            **(params or {}),
+        }
+        key = "{}?{}".format(
+            media_url, "&".join("{}={}".format(k, params[k]) for k in sorted(params))
+        )
+        with self._lock:
+            cached = self.cache.get(key)
+
+        headers = {}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached.get("etag")
+
+        return key, params, cached, headers
+
+    def store(self, key, listing):
+        """Cache a complete media listing
+        """
+
+        with self._lock:
+            self.cache[key] = {
+                "etag": listing.get("etag"),
+                "total": listing.get("total"),
+                "newest": listing.get("newest"),
+                "items": listing.get("items"),
+            }
+            self._dirty = True
+
+    def fetch_many(self, media_url, queries):
+        """Run several media listing queries concurrently
+
+        :return: The media items for each query, in the order of `queries`
+        :rtype: list
+        """
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(
+                executor.map(lambda params: self.fetch(media_url, params), queries)
+            )
+
+    def _fetch_page(self, media_url, params, page):
+        """Fetch a single page of a media listing
+        """
+
+        response = self.session.get(media_url, params={**params, "page": page})
+        if response.status_code == 400:
+            # Items were removed since the first page was fetched, so this page
+            # no longer exists
+            return []
+        response.raise_for_status()
+
+        return [trim_media_item(x) for x in json.loads(response.text)]
+
+    def save(self):
+        """Persist the cached listings, if any have changed
+        """
+
+        if not self.cache_file:
+            return
+
+        with self._lock:
+            if not self._dirty:
+                return
+            program_log.debug("Saving media index to {}".format(self.cache_file))
+            files.write_atomic(self.cache_file, json.dumps(self.cache))
+            self._dirty = False
+
+
+def first_page_listing(headers, items):
+    """Describe a media listing from the response to a query for its first
+    page
+    """
+
+    items = [trim_media_item(x) for x in items]
+    return {
+        "etag": headers.get("ETag"),
+        "total": int(headers.get("X-WP-Total", len(items))),
+        "pages": int(headers.get("X-WP-TotalPages", 1)),
+        "newest": [items[0].get("id"), items[0].get("modified")] if items else None,
+        "items": items,
+    }
+
+
+def is_current(cached, listing):
+    """Determine whether a cached media listing is still current, given the
+    first page of the listing. If there is only one page, the listing is
+    complete anyway, so the cache isn't used
+    """
+
+    return (
+        listing.get("pages") > 1
+        and cached is not None
+        and cached.get("total") == listing.get("total")
+        and cached.get("newest") == listing.get("newest")
+    )
+
+
+def trim_media_item(item):
+    """Reduce a media item to the fields used by gwbridge, in case the server
+    ignored the `_fields` parameter
+    """
+
+    return {
+        "id": item.get("id"),
+        "modified": item.get("modified"),
+        "guid": {"rendered": item.get("guid", {}).get("rendered")},
+    }
+
+
+def upload_filename(digest, local_path):
+    """The filename an image is uploaded as. This is prefixed with the
+    image's digest so that the upload can be identified on the server by its
+    content
+    """
+
+    return "{}-{}".format(digest[:12], os.path.basename(local_path))
+
+
+def legacy_filename(post_id, local_path):
+    """The filename an image was uploaded as by earlier versions of gwbridge,
+    which prefixed it with the id of the post it was uploaded for
+    """
+
+    return "{}-{}".format(post_id, os.path.basename(local_path))
+
+
+def is_local(src):
+    """Determine whether an image source refers to a local file, rather than
+    a remote URL
+    """
+
+    return "://" not in src and not src.startswith(("data:", "//"))
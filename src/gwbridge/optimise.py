@@ -0,0 +1,206 @@
+"""An optional stage which optimises images before they are uploaded. Images
+can be downscaled to a maximum width, recompressed or converted to another
+format, and stripped of their metadata. This is configured by the
+`optimise_images` key of `.deploy/config.json`, for example:
+
+    "optimise_images": {
+        "max_width": 1600,
+        "format": "webp",
+        "quality": 80,
+        "strip_metadata": true
+    }
+
+Optimised images are cached on disk, keyed by the digest of the source image
+and the settings, so that each image is only processed once.
+
+This requires the optional `Pillow` dependency, which can be installed with
+`pip install gwbridge[images]`.
+"""
+import os
+import tempfile
+from gwbridge import IMAGE_CACHE_DIR
+from gwbridge import fingerprint
+from gwbridge import program_log
+
+# The formats images can be converted to, and the extension of each
+FORMATS = {"jpeg": ".jpg", "png": ".png", "webp": ".webp"}
+# The images that are optimised. Other images, such as SVGs and animated
+# GIFs, are uploaded unchanged
+OPTIMISED_EXTENSIONS = {".bmp", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp"}
+DEFAULT_QUALITY = 85
+
+
+class ImageOptimiser:
+    """Optimises images before they are uploaded
+
+    :param max_width: The maximum width of an image in pixels. Wider images
+        are downscaled, preserving their aspect ratio
+    :type max_width: int
+    :param format: The format to convert images to, one of `jpeg`, `png` or
+        `webp`. If `None`, images keep their format
+    :type format: str
+    :param quality: The quality lossy formats are saved with, from 1 to 100
+    :type quality: int
+    :param strip_metadata: Whether to remove EXIF data and colour profiles
+    :type strip_metadata: bool
+    :param cache_dir: The directory optimised images are cached in
+    :type cache_dir: str
+    """
+
+    def __init__(
+        self,
+        max_width=None,
+        format=None,
+        quality=DEFAULT_QUALITY,
+        strip_metadata=True,
+        cache_dir=IMAGE_CACHE_DIR,
+    ):
+        load_pillow()
+        if format is not None and format.lower() not in FORMATS:
+            raise ValueError(
+                "Cannot convert images to {}. Expected one of: {}".format(
+                    format, ", ".join(sorted(FORMATS))
+                )
+            )
+
+        self.max_width = int(max_width) if max_width else None
+        self.format = format.lower() if format else None
+        self.quality = int(quality)
+        self.strip_metadata = bool(strip_metadata)
+        self.cache_dir = cache_dir
+
+    @property
+    def settings(self):
+        return {
+            "max_width": self.max_width,
+            "format": self.format,
+            "quality": self.quality,
+            "strip_metadata": self.strip_metadata,
+        }
+
+    def applies(self, local_path):
+        """Determine whether the image at `local_path` is optimised
+        """
+
+        return os.path.splitext(local_path)[1].lower() in OPTIMISED_EXTENSIONS
+
+    def variant(self, digest):
+        """The digest identifying the optimised version of the image with the
+        given digest. This changes if either the image or the settings change
+        """
+
+        return fingerprint.hash_json({"source": digest, "settings": self.settings})
+
+    def filename(self, local_path):
+        """The name of the optimised version of the image at `local_path`,
+        which has the extension of its new format
+        """
+
+        name, ext = os.path.splitext(os.path.basename(local_path))
+        if self.format:
+            ext = FORMATS.get(self.format)
+        return name + ext
+
+    def optimise(self, path, digest):
+        """Optimise the image at `path`, whose content has the given digest,
+        unless it has already been optimised with these settings
+
+        :return: The path of the optimised image
+        :rtype: str
+        """
+
+        output = os.path.join(
+            self.cache_dir,
+            self.variant(digest) + os.path.splitext(self.filename(path))[1],
+        )
+        if os.path.exists(output):
+            program_log.debug("Using cached optimised image {}".format(output))
+            return output
+
+        program_log.debug("Optimising {} to {}".format(path, output))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        Image = load_pillow()
+        from PIL import ImageOps
+
+        with Image.open(path) as source:
+            format = self.format or (source.format or "png").lower()
+            # Rotate the image as its EXIF orientation says it is displayed,
+            # as the orientation is dropped when the image is resized or its
+            # metadata stripped
+            image = ImageOps.exif_transpose(source)
+            options = {"format": format, "optimize": True}
+            if format in {"jpeg", "webp"}:
+                options["quality"] = self.quality
+            if not self.strip_metadata:
+                for key in ["exif", "icc_profile"]:
+                    if image.info.get(key):
+                        options[key] = image.info.get(key)
+
+            if self.max_width and image.width > self.max_width:
+                height = max(1, round(image.height * self.max_width / image.width))
+                image = image.resize((self.max_width, height), Image.LANCZOS)
+            if format == "jpeg" and image.mode not in {"RGB", "L"}:
+                image = image.convert("RGB")
+
+            # Write to a temporary file first, so that an interrupted run
+            # doesn't leave a partial image in the cache
+            fd, temp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    image.save(f, **options)
+                os.replace(temp, output)
+            except BaseException:
+                os.remove(temp)
+                raise
+
+        return output
+
+
+def load_pillow():
+    """Import Pillow, which is only loaded when images are optimised
+
+    :return: The `PIL.Image` module
+    """
+
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ImportError(
+            "Optimising images requires Pillow. Install it with "
+            "`pip install gwbridge[images]`"
+        )
+
+    return Image
+
+
+def create_optimiser(config):
+    """Create the image optimiser configured by the `optimise_images` key, or
+    `None` if images shouldn't be optimised
+
+    :rtype: `ImageOptimiser`
+    """
+
+    settings = config.get("optimise_images")
+    if not settings:
+        return None
+    if settings is True:
+        settings = {}
+
+    return ImageOptimiser(
+        cache_dir=config.get("image_cache") or IMAGE_CACHE_DIR, **settings
+    )
+
+
+def optimise_images(img_map, optimiser, root="."):
+    """Optimise each image in the image map that needs to be uploaded,
+    recording the path of the file to upload in its `upload_path`
+    """
+
+    for img in img_map.values():
+        if img.get("target_path") is not None or not img.get("source_digest"):
+            continue
+        img["upload_path"] = optimiser.optimise(
+            os.path.join(root, img.get("local_paths")[0]), img.get("source_digest")
+        )
+
+    return img_map
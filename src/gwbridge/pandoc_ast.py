@@ -0,0 +1,201 @@
+"""An alternative rendering pipeline which works on pandoc's JSON AST rather
+than on HTML. The markdown source is converted to the AST, the title and
+images are found and the image URLs replaced by transforming the AST, and
+HTML is rendered once at the end. This avoids parsing and serialising the
+HTML of the post in Python, which is the most expensive part of rendering
+large posts.
+
+The pipeline is selected by setting the `pipeline` key of
+`.deploy/config.json` to `ast`, and requires one of the pandoc converters.
+Only markdown images and headings are seen by the pipeline: images and
+headings written as raw HTML in the source are left as they are.
+"""
+import json
+from gwbridge import convert
+from gwbridge import sources
+
+AST_FORMAT = "json"
+# Inline elements whose content is a list of inlines
+CONTAINER_INLINES = {
+    "Emph",
+    "Underline",
+    "Strong",
+    "Strikeout",
+    "Superscript",
+    "Subscript",
+    "SmallCaps",
+}
+QUOTES = {"SingleQuote": ("‘", "’"), "DoubleQuote": ("“", "”")}
+
+
+class AstDocument:
+    """A post rendered to pandoc's AST, and the converter used to render it
+
+    :param ast: The pandoc AST of the post
+    :type ast: dict
+    :param config: The configuration the post is published with
+    :type config: dict
+    :param converter: The converter used to render HTML from the AST. If
+        `None`, the converter selected in the configuration is used
+    """
+
+    def __init__(self, ast, config, converter=None):
+        self.ast = ast
+        self.config = config
+        self.converter = converter
+
+    def to_html(self):
+        """Render the post to HTML
+        """
+
+        data = json.dumps(self.ast)
+        if self.converter is not None:
+            return self.converter.convert(
+                data, format=AST_FORMAT, to=convert.OUTPUT_FORMAT
+            )
+
+        converter = convert.create_converter(self.config)
+        try:
+            return converter.convert(data, format=AST_FORMAT, to=convert.OUTPUT_FORMAT)
+        finally:
+            converter.close()
+
+
+def render_document(data, config, converter=None, parts=None):
+    """Convert the markdown source of a post to pandoc's AST, as per
+    `gwbridge.application.render_document`
+
+    :return: The post, the post title, and the image elements in the post
+        keyed by their source
+    :rtype: tuple
+    """
+
+    if converter is None:
+        engine = convert.create_converter(config)
+        try:
+            ast = convert_parts(data, engine, parts)
+        finally:
+            engine.close()
+    else:
+        ast = convert_parts(data, converter, parts)
+
+    heading, images = index_document(ast)
+    title = extract_title(heading)
+
+    return AstDocument(ast, config, converter=converter), title, images
+
+
+def convert_parts(data, converter, parts=None):
+    """Convert the markdown source of a post to pandoc's AST, a part at a
+    time if its `parts` are given. The blocks of each part are joined into a
+    single document
+    """
+
+    if parts is None:
+        return json.loads(converter.convert(data, to=AST_FORMAT))
+
+    ast = None
+    for part in parts:
+        part_ast = json.loads(converter.convert(part.text, to=AST_FORMAT))
+        if part.directory:
+            for parent, element in walk(part_ast.get("blocks"), None):
+                if element.get("t") == "Image":
+                    element["c"][2][0] = sources.rebase(
+                        element["c"][2][0], part.directory
+                    )
+        if ast is None:
+            ast = part_ast
+        else:
+            ast["blocks"].extend(part_ast.get("blocks"))
+
+    return ast
+
+
+def finish_document(document, title, img_map, images=None):
+    """Point the images in the post at their uploaded URLs, and render the
+    document to publish, as per `gwbridge.application.finish_document`
+    """
+
+    if images is None:
+        heading, images = index_document(document.ast)
+
+    for img in img_map.values():
+        for local_path in img.get("local_paths"):
+            for image in images.get(local_path, []):
+                image["c"][2][0] = img.get("target_path")
+
+    return {"title": title, "content": document.to_html().lstrip()}
+
+
+def index_document(ast):
+    """Find the first level one heading and the images of a document in a
+    single traversal of its AST
+
+    :return: The first level one heading as a `(parent, element)` tuple, or
+        `None`, and the image elements keyed by their source
+    :rtype: tuple
+    """
+
+    heading = None
+    images = {}
+    for parent, element in walk(ast.get("blocks"), None):
+        if element.get("t") == "Header" and element["c"][0] == 1:
+            heading = heading or (parent, element)
+        elif element.get("t") == "Image" and element["c"][2][0]:
+            images.setdefault(element["c"][2][0], []).append(element)
+
+    return heading, images
+
+
+def extract_title(heading):
+    """Determine the title of the blog post from its first level one heading,
+    and remove the heading from the post
+    """
+
+    if heading is None:
+        return None
+
+    parent, element = heading
+    del parent[next(i for i, x in enumerate(parent) if x is element)]
+
+    return stringify(element["c"][2])
+
+
+def walk(node, parent):
+    """Yield every element in an AST in document order, with the list that
+    contains it
+    """
+
+    if isinstance(node, list):
+        for item in node:
+            yield from walk(item, node)
+    elif isinstance(node, dict):
+        if "t" in node:
+            yield parent, node
+        for value in node.values():
+            if isinstance(value, (list, dict)):
+                yield from walk(value, None)
+
+
+def stringify(inlines):
+    """The plain text of a list of inline elements
+    """
+
+    text = []
+    for inline in inlines:
+        kind = inline.get("t")
+        if kind == "Str":
+            text.append(inline["c"])
+        elif kind in {"Space", "SoftBreak", "LineBreak"}:
+            text.append(" ")
+        elif kind in {"Code", "Math"}:
+            text.append(inline["c"][1])
+        elif kind in CONTAINER_INLINES:
+            text.append(stringify(inline["c"]))
+        elif kind in {"Span", "Link", "Image", "Cite"}:
+            text.append(stringify(inline["c"][1]))
+        elif kind == "Quoted":
+            start, end = QUOTES.get(inline["c"][0]["t"], ("", ""))
+            text.append(start + stringify(inline["c"][1]) + end)
+
+    return "".join(text)
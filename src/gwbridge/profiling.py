@@ -0,0 +1,251 @@
+"""Timing of each stage of publishing, and of each request made to the
+Wordpress server, enabled by `gwbridge publish --profile`. Stages are timed
+with the `stage` context manager, which does nothing unless a profiler has
+been started, so the instrumented code pays no cost otherwise.
+
+The timings can be exported in the Chrome trace event format, which can be
+opened in `chrome://tracing` or https://ui.perfetto.dev.
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from gwbridge import program_log
+
+# The number of slowest requests listed in the summary
+SLOWEST_REQUESTS = 5
+
+_active = None
+
+
+class Profiler:
+    """Records the time spent in each stage of publishing, and in each
+    request made to the Wordpress server. Safe to share between threads
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def record_stage(self, name, start, end, **args):
+        with self._lock:
+            self.spans.append(
+                {
+                    "name": name,
+                    "start": start - self.origin,
+                    "duration": end - start,
+                    "thread": threading.get_ident(),
+                    "args": args,
+                }
+            )
+
+    def record_request(self, method, url, status, sent, received, start, end):
+        with self._lock:
+            self.requests.append(
+                {
+                    "method": method,
+                    "url": url,
+                    "status": status,
+                    "sent": sent,
+                    "received": received,
+                    "start": start - self.origin,
+                    "duration": end - start,
+                    "thread": threading.get_ident(),
+                }
+            )
+
+    def summary(self):
+        """Describe the recorded timings as a table, with the total time spent
+        in each stage, in requests to each endpoint, and in the slowest
+        requests
+
+        :rtype: list
+        """
+
+        lines = [
+            "{:28}{:>7}{:>11}{:>11}{:>11}".format(
+                "Stage", "Count", "Total (s)", "Mean (s)", "Max (s)"
+            )
+        ]
+        for name, durations in group(self.spans, lambda s: s.get("name")):
+            lines.append(format_row(name, durations))
+
+        lines.append("")
+        lines.append(
+            "{:28}{:>7}{:>11}{:>11}{:>11}{:>12}{:>12}".format(
+                "Request",
+                "Count",
+                "Total (s)",
+                "Mean (s)",
+                "Max (s)",
+                "Sent (B)",
+                "Recv (B)",
+            )
+        )
+        for name, requests in group(
+            self.requests,
+            lambda r: "{} {}".format(r.get("method"), urlsplit(r.get("url")).path),
+            values=lambda r: r,
+        ):
+            lines.append(
+                format_row(name, [r.get("duration") for r in requests])
+                + "{:>12}{:>12}".format(
+                    sum(r.get("sent") for r in requests),
+                    sum(r.get("received") for r in requests),
+                )
+            )
+
+        slowest = sorted(self.requests, key=lambda r: -r.get("duration"))
+        if slowest:
+            lines.append("")
+            lines.append("Slowest requests:")
+        for request in slowest[:SLOWEST_REQUESTS]:
+            lines.append(
+                "{:>9.3f}s {} {} {} ({} B sent, {} B received)".format(
+                    request.get("duration"),
+                    request.get("status"),
+                    request.get("method"),
+                    request.get("url"),
+                    request.get("sent"),
+                    request.get("received"),
+                )
+            )
+
+        return lines
+
+    def trace_events(self):
+        """The recorded timings as Chrome trace events
+        """
+
+        pid = os.getpid()
+        events = [
+            {
+                "name": span.get("name"),
+                "cat": "stage",
+                "ph": "X",
+                "ts": span.get("start") * 1e6,
+                "dur": span.get("duration") * 1e6,
+                "pid": pid,
+                "tid": span.get("thread"),
+                "args": span.get("args"),
+            }
+            for span in self.spans
+        ]
+        events.extend(
+            {
+                "name": "{} {}".format(r.get("method"), urlsplit(r.get("url")).path),
+                "cat": "http",
+                "ph": "X",
+                "ts": r.get("start") * 1e6,
+                "dur": r.get("duration") * 1e6,
+                "pid": pid,
+                "tid": r.get("thread"),
+                "args": {k: r.get(k) for k in ["url", "status", "sent", "received"]},
+            }
+            for r in self.requests
+        )
+
+        return sorted(events, key=lambda e: e.get("ts"))
+
+    def write_trace(self, path):
+        """Write the recorded timings to `path` in the Chrome trace event
+        format
+        """
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            f.write(json.dumps({"traceEvents": self.trace_events()}))
+
+
+def group(items, key, values=lambda x: x.get("duration")):
+    """Group items by `key`, in the order each key first appears
+    """
+
+    groups = {}
+    for item in items:
+        groups.setdefault(key(item), []).append(values(item))
+
+    return list(groups.items())
+
+
+def format_row(name, durations):
+    return "{:28}{:>7}{:>11.3f}{:>11.3f}{:>11.3f}".format(
+        name[:27],
+        len(durations),
+        sum(durations),
+        sum(durations) / len(durations),
+        max(durations),
+    )
+
+
+def start():
+    """Start recording timings
+
+    :rtype: `Profiler`
+    """
+
+    global _active
+    _active = Profiler()
+    return _active
+
+
+def stop():
+    """Stop recording timings
+
+    :return: The profiler that was recording, if any
+    :rtype: `Profiler`
+    """
+
+    global _active
+    profiler, _active = _active, None
+    return profiler
+
+
+def active():
+    """The profiler recording timings, or `None`
+    """
+
+    return _active
+
+
+@contextmanager
+def stage(name, **args):
+    """Time the enclosed block as a stage of publishing named `name`. Any
+    keyword arguments are recorded alongside the timing, such as the post or
+    image the stage applies to
+    """
+
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.record_stage(name, start_time, time.perf_counter(), **args)
+
+
+def body_size(body, headers=None):
+    """The number of bytes in a request body, which may be streamed from a
+    file
+    """
+
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    return int((headers or {}).get("Content-Length") or 0)
+
+
+def log_summary(profiler):
+    """Log the summary of the timings recorded by `profiler`
+    """
+
+    for line in profiler.summary():
+        program_log.info(line)
@@ -0,0 +1,71 @@
+"""Commands which manage the project in the current directory. These are
+kept apart from `gwbridge.application` so that they don't need to import the
+libraries used to publish posts.
+"""
+import os
+import json
+import shutil
+from gwbridge import ROOT_DIR
+from gwbridge import files
+from gwbridge import program_log
+
+
+def init(ctx, **kwargs):
+    """Initialise a directory as a project. This creates a `.deploy` folder
+    containing configuration files for the site, and post metadata.
+    """
+
+    default_config_dir = os.path.join(ROOT_DIR, "config")
+    deploy_dir = ".deploy"
+
+    try:
+        # Create a `.deploy` directory in the project root
+        os.makedirs(deploy_dir, exist_ok=False)
+    except FileExistsError:
+        rewrite = (
+            input(
+                "This project has already been initialised! Reset your configuration and start again? (y/[n]): "
+            )
+            or "n"
+        )
+        if rewrite.lower() in {"n", "no"}:
+            exit(0)
+
+    with open(os.path.join(default_config_dir, "config-default.json"), "r") as f:
+        config = json.loads(f.read())
+
+    # Prompt user to update configuration settings
+    while not config.get("base_url", None):
+        config["base_url"] = input(
+            "Enter the base URL of the wordpress blog to update (required): "
+        )
+        if not config.get("base_url"):
+            print("You must enter a base URL.")
+
+    config["api_version"] = input(
+        "Enter the version of the WPI you wish to use [{}]: ".format(
+            config.get("api_version")
+        )
+    ) or config.get("api_version")
+
+    config["file"] = input(
+        "Enter the name of the file to publish [{}]: ".format(config.get("file"))
+    ) or config.get("file")
+
+    # Write the updated configuration to the local repository
+    files.write_atomic(
+        os.path.join(deploy_dir, "config.json"), json.dumps(config, indent=4)
+    )
+
+    program_log.info(
+        "Configuration file created at {}".format(
+            os.path.join(deploy_dir, "config.json")
+        )
+    )
+    shutil.copy(
+        os.path.join(default_config_dir, "metadata-default.json"),
+        os.path.join(deploy_dir, "metadata.json"),
+    )
+    program_log.info(
+        "Metadata file created at {}".format(os.path.join(deploy_dir, "metadata.json"))
+    )
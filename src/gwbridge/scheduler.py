@@ -0,0 +1,325 @@
+"""Scheduling of the requests made to the Wordpress server, shared by every
+request in a run so that concurrent posts and uploads are paced together.
+
+The scheduler limits the rate of requests with a token bucket, and the number
+in flight with a limit that adapts to the responses received: it grows by one
+after each full window of successful requests, and halves when the server
+throttles a request. A request that is throttled (429) is retried after the
+delay given by its `Retry-After` header, during which no other request is
+sent, or otherwise after an exponential backoff with jitter. Requests that
+fail with a transient server or connection error are retried in the same way,
+but only if they are idempotent, as the server may have acted on them.
+"""
+import time
+import random
+import asyncio
+import threading
+import email.utils
+from gwbridge import program_log
+
+DEFAULT_MAX_RETRIES = 5
+# Seconds to back off before the first retry, and the most to wait before any
+# retry, whether backing off or as requested by the server
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_WAIT = 120
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+THROTTLE_STATUSES = {429, 503}
+TRANSIENT_STATUSES = {500, 502, 503, 504}
+# Seconds after the concurrency limit is reduced during which further throttled
+# responses don't reduce it again, as they were sent before it was reduced
+DECREASE_INTERVAL = 1.0
+
+
+class TokenBucket:
+    """Limits requests to `rate` per second on average, allowing bursts of up
+    to `burst` requests. Not thread safe: the scheduler holds a lock while
+    using it
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, now):
+        """Take a token, returning the seconds to wait until it is available
+        """
+
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+
+class Scheduler:
+    """Paces, limits and retries the requests sent through a session. Requests
+    may be made from several threads, or from coroutines on one event loop
+
+    :param rate: The maximum average number of requests per second, or `None`
+        for no limit
+    :type rate: float
+    :param burst: The number of requests that may be sent at once within the
+        rate limit
+    :type burst: int
+    :param concurrency: The maximum number of requests in flight at once
+    :type concurrency: int
+    :param max_retries: The number of times a request is retried
+    :type max_retries: int
+    :param backoff: Seconds to back off before the first retry, doubling with
+        each further retry
+    :type backoff: float
+    :param max_wait: The most seconds to wait before a retry
+    :type max_wait: float
+    """
+
+    def __init__(
+        self,
+        rate=None,
+        burst=None,
+        concurrency=10,
+        max_retries=DEFAULT_MAX_RETRIES,
+        backoff=DEFAULT_BACKOFF,
+        max_wait=DEFAULT_MAX_WAIT,
+    ):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.max_concurrency = max(1, int(concurrency))
+        self.limit = self.max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.active = 0
+        self.successes = 0
+        self.decreased = 0.0
+        # No request is sent before this time, as requested by the server
+        self.resume_at = 0.0
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._async_condition = None
+
+    def try_acquire(self):
+        """Take a place among the requests in flight, if there is one
+        """
+
+        if self.active >= self.limit:
+            return False
+        self.active += 1
+        return True
+
+    def reserve(self):
+        """The seconds to wait before sending a request, to keep within the
+        rate limit and any delay requested by the server
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            wait = self.bucket.reserve(now) if self.bucket else 0.0
+            return max(wait, self.resume_at - now)
+
+    def record(self, method, attempt, status=None, headers=None, error=None):
+        """Adjust the concurrency limit to the outcome of a request, and
+        determine whether to retry it
+
+        :return: The seconds to wait before retrying the request, or `None`
+            if it shouldn't be retried
+        :rtype: float
+        """
+
+        throttled = status in THROTTLE_STATUSES
+        retry_after = parse_retry_after((headers or {}).get("Retry-After"))
+        with self._lock:
+            now = time.monotonic()
+            if throttled:
+                if now - self.decreased > DECREASE_INTERVAL:
+                    self.limit = max(1, self.limit // 2)
+                    self.decreased = now
+                    program_log.debug(
+                        "Reduced request concurrency to {}".format(self.limit)
+                    )
+                self.successes = 0
+                if retry_after is not None:
+                    self.resume_at = max(
+                        self.resume_at, now + min(retry_after, self.max_wait)
+                    )
+            elif error is None and status is not None and status < 500:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self.successes = 0
+            self._condition.notify_all()
+
+        if attempt >= self.max_retries or not is_retryable(method, status, error):
+            return None
+        if retry_after is not None:
+            # Every request waits until then, as the scheduler resumes then
+            return 0.0
+        return random.uniform(0, min(self.max_wait, self.backoff * 2 ** attempt))
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def call(self, method, send, body=None, errors=()):
+        """Send a request with `send`, retrying it as necessary
+
+        :param method: The HTTP method of the request
+        :param send: A function sending the request and returning the response
+        :param body: The body of the request. A file is rewound before the
+            request is retried
+        :param errors: The exceptions raised by `send` for transient failures
+            to connect to or read from the server
+        """
+
+        attempt = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(self.try_acquire)
+            try:
+                wait = self.reserve()
+                if wait > 0:
+                    time.sleep(wait)
+                position = tell(body)
+                response, error = None, None
+                try:
+                    response = send()
+                except errors as e:
+                    error = e
+            finally:
+                self.release()
+
+            wait = self.retry(method, attempt, response, error)
+            if wait is None:
+                if error is not None:
+                    raise error
+                return response
+            time.sleep(wait)
+            rewind(body, position)
+            attempt += 1
+
+    async def call_async(self, method, send, body=None, errors=()):
+        """Send a request with the coroutine function `send`, as per `call`
+        """
+
+        if self._async_condition is None:
+            self._async_condition = asyncio.Condition()
+        condition = self._async_condition
+
+        attempt = 0
+        while True:
+            async with condition:
+                await condition.wait_for(self.try_acquire_locked)
+            try:
+                wait = self.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                position = tell(body)
+                response, error = None, None
+                try:
+                    response = await send()
+                except errors as e:
+                    error = e
+            finally:
+                self.release()
+                async with condition:
+                    condition.notify_all()
+
+            wait = self.retry(method, attempt, response, error)
+            if wait is None:
+                if error is not None:
+                    raise error
+                return response
+            await asyncio.sleep(wait)
+            rewind(body, position)
+            attempt += 1
+
+    def try_acquire_locked(self):
+        with self._lock:
+            return self.try_acquire()
+
+    def retry(self, method, attempt, response, error):
+        """Record the outcome of a request, and log any retry
+        """
+
+        status = getattr(response, "status_code", None)
+        wait = self.record(
+            method,
+            attempt,
+            status=status,
+            headers=getattr(response, "headers", None),
+            error=error,
+        )
+        if wait is not None:
+            program_log.warning(
+                "{} {} failed with {}. Retrying (attempt {} of {})".format(
+                    method,
+                    getattr(response, "url", ""),
+                    status or error,
+                    attempt + 1,
+                    self.max_retries,
+                )
+            )
+        return wait
+
+
+def is_retryable(method, status=None, error=None):
+    """Determine whether a failed request can be retried. A throttled request
+    wasn't acted on by the server, so is always retried, but other failures
+    are only retried for idempotent requests
+    """
+
+    if status == 429:
+        return True
+    if error is None and status not in TRANSIENT_STATUSES:
+        return False
+    return method.upper() in IDEMPOTENT_METHODS
+
+
+def parse_retry_after(value):
+    """The seconds to wait given by a `Retry-After` header, which is either a
+    number of seconds or a date
+    """
+
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+def tell(body):
+    try:
+        return body.tell()
+    except (AttributeError, OSError):
+        return None
+
+
+def rewind(body, position):
+    if position is not None:
+        body.seek(position)
+
+
+def create_scheduler(config, concurrency):
+    """Create the scheduler for a run, as configured by the `rate_limit`,
+    `rate_burst` and `max_retries` keys
+
+    :param concurrency: The most requests that may be in flight at once
+    :type concurrency: int
+    """
+
+    return Scheduler(
+        rate=float(config.get("rate_limit") or 0) or None,
+        burst=config.get("rate_burst"),
+        concurrency=concurrency,
+        max_retries=int(
+            DEFAULT_MAX_RETRIES
+            if config.get("max_retries") is None
+            else config.get("max_retries")
+        ),
+    )
@@ -0,0 +1,168 @@
+"""The markdown source of a post, which may be assembled from several files.
+
+The `file` key of `.deploy/config.json` names either a single markdown file,
+or an ordered list of files, such as the chapters of a long guide. A file may
+also include another at any point with a line of the form:
+
+    <!-- include chapters/introduction.md -->
+
+which is an HTML comment, so that the file still displays sensibly on its
+own. Each file, or the text of a file between its includes, is a part of the
+post, and each part is converted separately, so that a change to one part
+only converts that part again: the others are taken from the conversion
+cache. The footnotes of each part are listed at the end of that part.
+
+The paths of included files are relative to the file including them. The
+images referenced by an included file are relative to that file, while those
+referenced by the files named by the `file` key are relative to the post's
+root, as they are for a post made up of a single file, so that including a
+file doesn't change how the rest of the post is resolved.
+"""
+import os
+import re
+import posixpath
+from gwbridge import media
+
+INCLUDE_PATTERN = re.compile(
+    r"^[ \t]*<!--\s*include\s+(.+?)\s*-->[ \t]*$", re.MULTILINE
+)
+# The text between the parts of a post, so that each part starts a new block
+PART_SEPARATOR = "\n\n"
+
+
+class Part:
+    """A piece of the source of a post, and the file it was read from
+
+    :param path: The path of the file, relative to the post's root
+    :type path: str
+    :param text: The markdown source of the part
+    :type text: str
+    :param directory: The directory the images referenced by the part are
+        relative to, relative to the post's root
+    :type directory: str
+    """
+
+    def __init__(self, path, text, directory=""):
+        self.path = path
+        self.text = text
+        self.directory = directory
+
+    def __repr__(self):
+        return "Part({!r})".format(self.path)
+
+
+def source_files(config):
+    """The files named by the `file` key, in order
+    """
+
+    files = config.get("file")
+    if isinstance(files, str):
+        return [files]
+    return list(files or [])
+
+
+def read_parts(config, root=".", files=None):
+    """Read the parts of the post in `root`, following any includes
+
+    :param files: A list to add the path of each file read to, if given
+    :type files: list
+    :return: The parts of the post, in order
+    :rtype: list
+    :raises ValueError: If a file includes itself
+    """
+
+    parts = []
+    for path in source_files(config):
+        parts.extend(read_file(path, root, files=files))
+    return parts
+
+
+def read_file(path, root=".", including=(), files=None):
+    """Read the parts of a single file, and of the files it includes, as per
+    `read_parts`. The images of the file are relative to the post's root if
+    the file isn't included by another, or otherwise to the file
+
+    :param including: The files which include this one, to detect cycles
+    :type including: tuple
+    """
+
+    path = os.path.normpath(path)
+    if path in including:
+        raise ValueError("{} includes itself".format(path))
+
+    with open(os.path.join(root, path), "r") as f:
+        text = f.read()
+    if files is not None:
+        files.append(path)
+    directory = os.path.dirname(path) if including else ""
+
+    parts = []
+    start = 0
+    for match in INCLUDE_PATTERN.finditer(text):
+        parts.append(Part(path, text[start : match.start()], directory))
+        included = os.path.join(os.path.dirname(path), match.group(1))
+        parts.extend(read_file(included, root, including + (path,), files=files))
+        start = match.end()
+    if not parts:
+        return [Part(path, text, directory)]
+    parts.append(Part(path, text[start:], directory))
+
+    return [part for part in parts if part.text.strip()]
+
+
+def join(parts):
+    """The markdown source of the whole post. The source of a post made up of
+    a single part is the content of its file
+    """
+
+    if len(parts) == 1:
+        return parts[0].text
+    return PART_SEPARATOR.join(part.text.strip("\n") for part in parts)
+
+
+def source_paths(config, root="."):
+    """The paths of every file the post's source is read from, relative to
+    `root`. If a file can't be read, the files read before it are given
+    along with those named by the `file` key
+    """
+
+    paths = []
+    try:
+        read_parts(config, root, files=paths)
+    except (OSError, ValueError):
+        paths.extend(source_files(config))
+
+    return list(dict.fromkeys(paths))
+
+
+def id_prefixes(parts):
+    """The prefix given to the identifiers in the HTML of each part, such as
+    those of its footnotes, so that they are unique within the post. Each
+    prefix is derived from the part's file rather than its position, so that
+    adding a part doesn't change the HTML of the others. A post made up of a
+    single part needs no prefix
+    """
+
+    if len(parts) <= 1:
+        return [None] * len(parts)
+
+    prefixes = []
+    seen = {}
+    for part in parts:
+        slug = re.sub(r"[^a-z0-9]+", "-", part.path.lower()).strip("-")
+        seen[slug] = seen.get(slug, 0) + 1
+        if seen[slug] > 1:
+            slug = "{}-{}".format(slug, seen[slug])
+        prefixes.append(slug + "-")
+    return prefixes
+
+
+def rebase(src, directory):
+    """Resolve the source of an image referenced by a part in `directory`
+    against the post's root
+    """
+
+    if not directory or not media.is_local(src) or src.startswith("/"):
+        return src
+    directory = directory.replace(os.sep, "/")
+    return posixpath.normpath(posixpath.join(directory, src))
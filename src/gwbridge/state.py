@@ -0,0 +1,383 @@
+"""An optional SQLite store for the state kept between runs, for projects
+publishing many posts and images. It replaces the media ledger file, which
+is read in full and rewritten on every run, with indexed tables updated a
+row at a time, and records each published post: its id, the digest of the
+payload last pushed, its fingerprint, and when the server last modified it.
+
+The store is used if the `state_store` key names the database file, such as
+`.deploy/state.db`. Each post's `.deploy/metadata.json` and
+`.deploy/fingerprint.json` are still written, so that they can be committed
+alongside the post, and a post's fingerprint is read from the store if its
+file is missing. `gwbridge state import` fills the store from the JSON
+files, and `gwbridge state export` writes them back out of it.
+"""
+import os
+import json
+import sqlite3
+import threading
+from gwbridge import FINGERPRINT_FILE
+from gwbridge import MEDIA_LEDGER_FILE
+from gwbridge import METADATA_FILE
+from gwbridge import STATE_STORE_FILE
+from gwbridge import fingerprint as fingerprinting
+from gwbridge import files
+from gwbridge import media
+from gwbridge import program_log
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    root TEXT PRIMARY KEY,
+    post_id INTEGER,
+    payload TEXT,
+    modified TEXT,
+    fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS posts_post_id ON posts (post_id);
+CREATE TABLE IF NOT EXISTS media (
+    digest TEXT PRIMARY KEY,
+    media_id INTEGER,
+    url TEXT,
+    filename TEXT
+);
+CREATE INDEX IF NOT EXISTS media_media_id ON media (media_id);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime INTEGER,
+    sha256 TEXT
+);
+"""
+
+
+class StateStore:
+    """The tables of posts, uploaded media and hashed local files, in a
+    SQLite database. The store is safe to share between threads
+
+    :param path: The database file, which is created if it doesn't exist
+    :type path: str
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def query(self, sql, parameters=()):
+        with self._lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def write(self, sql, rows):
+        """Write each of the `rows` in a single transaction
+        """
+
+        with self._lock, self.connection:
+            self.connection.executemany(sql, rows)
+
+    def lookup_media(self, digest):
+        """Obtain the remote media recorded for an image digest, if any
+        """
+
+        rows = self.query(
+            "SELECT media_id, url, filename FROM media WHERE digest = ?", (digest,)
+        )
+        if not rows:
+            return None
+        media_id, url, filename = rows[0]
+        return {"id": media_id, "url": url, "filename": filename}
+
+    def record_media(self, entries):
+        """Record the remote media uploaded for each image digest
+
+        :param entries: The media for each digest, as per
+            `gwbridge.media.MediaLedger.lookup`
+        :type entries: dict
+        """
+
+        self.write(
+            "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?)",
+            [
+                (digest, entry.get("id"), entry.get("url"), entry.get("filename"))
+                for digest, entry in entries.items()
+            ],
+        )
+
+    def lookup_file(self, path):
+        """Obtain the size, modification time and digest recorded for a local
+        file, if any
+        """
+
+        rows = self.query(
+            "SELECT size, mtime, sha256 FROM files WHERE path = ?", (path,)
+        )
+        if not rows:
+            return None
+        size, mtime, sha256 = rows[0]
+        return {"size": size, "mtime": mtime, "sha256": sha256}
+
+    def record_files(self, entries):
+        """Record the size, modification time and digest of local files
+        """
+
+        self.write(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+            [
+                (path, entry.get("size"), entry.get("mtime"), entry.get("sha256"))
+                for path, entry in entries.items()
+            ],
+        )
+
+    def lookup_post(self, root):
+        """Obtain the record of the post in `root`, if it has been published
+        """
+
+        rows = self.query(
+            "SELECT post_id, payload, modified, fingerprint FROM posts "
+            "WHERE root = ?",
+            (post_key(root),),
+        )
+        if not rows:
+            return None
+        post_id, payload, modified, fingerprint = rows[0]
+        return {
+            "id": post_id,
+            "payload": payload,
+            "modified": modified,
+            "fingerprint": json.loads(fingerprint) if fingerprint else None,
+        }
+
+    def record_post(self, root, post_id, fingerprint=None, modified=None):
+        """Record the post in `root` as published with the given fingerprint.
+        The time the server last modified the post is kept if not given
+        """
+
+        self.write(
+            "INSERT OR REPLACE INTO posts VALUES (?, ?, ?, "
+            "COALESCE(?, (SELECT modified FROM posts WHERE root = ?)), ?)",
+            [
+                (
+                    post_key(root),
+                    post_id,
+                    (fingerprint or {}).get("payload"),
+                    modified,
+                    post_key(root),
+                    json.dumps(fingerprint) if fingerprint else None,
+                )
+            ],
+        )
+
+    def posts(self):
+        """The root of every post recorded
+        """
+
+        return [root for root, in self.query("SELECT root FROM posts ORDER BY root")]
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+class StoreLedger(media.MediaLedger):
+    """A media ledger kept in a `StateStore`. Uploads are written to the
+    store as they are recorded, as they are expensive to repeat, while the
+    digests of local files are written when the ledger is saved
+    """
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+
+    def digest(self, path):
+        key = os.path.normpath(path)
+        with self._lock:
+            cached = key in self.files
+        if not cached:
+            entry = self.store.lookup_file(key)
+            if entry is not None:
+                with self._lock:
+                    self.files.setdefault(key, entry)
+
+        return super().digest(path)
+
+    def lookup(self, digest):
+        entry = super().lookup(digest)
+        if entry is None:
+            entry = self.store.lookup_media(digest)
+        return entry
+
+    def record(self, digest, media_id, url, filename):
+        super().record(digest, media_id, url, filename)
+        self.store.record_media({digest: self.lookup(digest)})
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            entries = dict(self.files)
+        program_log.debug("Saving hashed files to {}".format(self.store.path))
+        self.store.record_files(entries)
+
+
+def post_key(root):
+    """The key of the post in `root`, relative to the working directory
+    """
+
+    return os.path.normpath(os.path.relpath(root))
+
+
+def open_store(config):
+    """Open the store named by the `state_store` key, or return `None` if
+    there isn't one
+    """
+
+    if not config.get("state_store"):
+        return None
+    return StateStore(config.get("state_store"))
+
+
+def post_roots(config):
+    """The directories of the posts in the manifest named by the `manifest`
+    key, or otherwise of the post in the working directory
+    """
+
+    if not config.get("manifest"):
+        return ["."]
+
+    from gwbridge import batch
+
+    manifest = batch.load_manifest(config.get("manifest"))
+    return [entry.get("path") for entry in manifest.get("posts")]
+
+
+def import_state(ctx, **kwargs):
+    """Fill the state store from the JSON files of the post in the working
+    directory, or of each post in a manifest
+    """
+
+    from gwbridge import application
+
+    application.configure_verbosity(ctx)
+    config = application.parse_args(**kwargs)
+    store = StateStore(config.get("state_store") or STATE_STORE_FILE)
+    try:
+        import_json(
+            store,
+            roots=post_roots(config),
+            ledger_file=config.get("media_ledger") or MEDIA_LEDGER_FILE,
+        )
+    finally:
+        store.close()
+
+
+def export_state(ctx, **kwargs):
+    """Write the JSON files of every post recorded in the state store, and
+    the media ledger, from the store
+    """
+
+    from gwbridge import application
+
+    application.configure_verbosity(ctx)
+    config = application.parse_args(**kwargs)
+    path = config.get("state_store") or STATE_STORE_FILE
+    if not os.path.exists(path):
+        program_log.error("There is no state store at {}".format(path))
+        ctx.exit(1)
+    store = StateStore(path)
+    try:
+        export_json(store, ledger_file=config.get("media_ledger") or MEDIA_LEDGER_FILE)
+    finally:
+        store.close()
+
+
+def import_json(store, roots=(".",), ledger_file=MEDIA_LEDGER_FILE):
+    """Fill the store from the media ledger file, and the metadata and
+    fingerprint files of the posts in `roots`
+
+    :return: The number of posts imported
+    :rtype: int
+    """
+
+    ledger = media.MediaLedger(ledger_file)
+    store.record_media(ledger.media)
+    store.record_files(ledger.files)
+    program_log.info(
+        "Imported {} media and {} hashed files from {}".format(
+            len(ledger.media), len(ledger.files), ledger_file
+        )
+    )
+
+    imported = 0
+    for root in roots:
+        metadata_file = os.path.join(root, METADATA_FILE)
+        if not os.path.exists(metadata_file):
+            continue
+        with open(metadata_file, "r") as f:
+            post_id = json.loads(f.read()).get("id")
+        if not post_id:
+            continue
+        store.record_post(
+            root, post_id, fingerprint=fingerprinting.load_fingerprint(root) or None
+        )
+        imported += 1
+    program_log.info("Imported {} posts".format(imported))
+
+    return imported
+
+
+def export_json(store, ledger_file=MEDIA_LEDGER_FILE):
+    """Write the media ledger file, and the fingerprint and post id of each
+    post recorded in the store, from the store
+
+    :return: The number of posts exported
+    :rtype: int
+    """
+
+    ledger = {
+        "media": {
+            digest: {"id": media_id, "url": url, "filename": filename}
+            for digest, media_id, url, filename in store.query(
+                "SELECT digest, media_id, url, filename FROM media"
+            )
+        },
+        "files": {
+            path: {"size": size, "mtime": mtime, "sha256": sha256}
+            for path, size, mtime, sha256 in store.query(
+                "SELECT path, size, mtime, sha256 FROM files"
+            )
+        },
+    }
+    files.write_atomic(ledger_file, json.dumps(ledger, indent=4, sort_keys=True))
+    program_log.info(
+        "Exported {} media and {} hashed files to {}".format(
+            len(ledger.get("media")), len(ledger.get("files")), ledger_file
+        )
+    )
+
+    exported = 0
+    for root in store.posts():
+        post = store.lookup_post(root)
+        metadata_file = os.path.join(root, METADATA_FILE)
+        if not os.path.exists(metadata_file):
+            program_log.warning("{} no longer exists. Skipping.".format(root))
+            continue
+        with open(metadata_file, "r") as f:
+            metadata = json.loads(f.read())
+        if metadata.get("id") != post.get("id"):
+            metadata["id"] = post.get("id")
+            files.write_atomic(metadata_file, json.dumps(metadata, indent=4))
+        if post.get("fingerprint"):
+            files.write_atomic(
+                os.path.join(root, FINGERPRINT_FILE),
+                json.dumps(post.get("fingerprint"), indent=4, sort_keys=True),
+            )
+        exported += 1
+    program_log.info("Exported {} posts".format(exported))
+
+    return exported
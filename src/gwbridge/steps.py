@@ -0,0 +1,86 @@
+"""The steps of publishing a post, shared by the threaded and asyncio engines.
+
+A step is a generator which yields each call it needs made, such as a request
+to the Wordpress server or the conversion of markdown to HTML, and is sent
+back the result, or has the exception the call raised thrown into it. `run`
+makes the calls directly, while `run_async` awaits any call returning an
+awaitable, so that the same step makes its requests through either a
+`requests` or an `aiohttp` session, and runs blocking calls in the default
+executor so that they don't stall the event loop.
+
+Steps compose with `yield from`, which returns the value the inner step
+returns.
+"""
+import asyncio
+import inspect
+import functools
+
+
+class Call:
+    """A call made by a step, which the engine running the step makes on its
+    behalf
+
+    :param function: The function to call
+    :param blocking: Whether the call blocks on local work, such as reading or
+        writing files, hashing images or converting markdown, rather than on
+        a request made through the engine's session
+    :type blocking: bool
+    """
+
+    def __init__(self, function, *args, blocking=False, **kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.blocking = blocking
+
+    def __repr__(self):
+        return "Call({})".format(getattr(self.function, "__name__", self.function))
+
+
+def run(steps):
+    """Run a step to completion, making each of its calls in turn
+
+    :return: The value returned by the step
+    """
+
+    try:
+        call = next(steps)
+        while True:
+            try:
+                result = call.function(*call.args, **call.kwargs)
+            except Exception as e:
+                call = steps.throw(e)
+            else:
+                call = steps.send(result)
+    except StopIteration as e:
+        return e.value
+
+
+async def run_async(steps):
+    """Run a step to completion in the running event loop, awaiting the
+    result of any call which returns an awaitable. Blocking calls are run in
+    the default executor
+
+    :return: The value returned by the step
+    """
+
+    loop = asyncio.get_event_loop()
+    try:
+        call = next(steps)
+        while True:
+            try:
+                if call.blocking:
+                    result = await loop.run_in_executor(
+                        None,
+                        functools.partial(call.function, *call.args, **call.kwargs),
+                    )
+                else:
+                    result = call.function(*call.args, **call.kwargs)
+                if inspect.isawaitable(result):
+                    result = await result
+            except Exception as e:
+                call = steps.throw(e)
+            else:
+                call = steps.send(result)
+    except StopIteration as e:
+        return e.value
@@ -0,0 +1,116 @@
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from gwbridge import media
+from gwbridge import profiling
+from gwbridge import scheduler as scheduling
+
+# Seconds to wait to establish a connection, and for the server to respond
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+# The number of connections kept alive to each host
+DEFAULT_POOL_SIZE = 10
+
+
+class WordpressSession(requests.Session):
+    """A `requests.Session` used for every request to the Wordpress server in
+    a run. Connections are kept alive and pooled, so that consecutive and
+    concurrent requests reuse established TCP and TLS connections, and every
+    request is made with a timeout unless one is given explicitly. Requests
+    are paced and retried by the `scheduler`, if one is given.
+
+    :param auth: The authentication attached to every request, such as a
+        `requests_oauthlib.OAuth1` object
+    :type auth: `requests.auth.AuthBase`
+    :param timeout: The timeout for each request, either a single number of
+        seconds or a `(connect, read)` tuple
+    :type timeout: float or tuple
+    :param pool_size: The maximum number of connections kept alive per host.
+        This should be at least the number of threads making requests
+    :type pool_size: int
+    :param scheduler: The scheduler shared by every request in the run
+    :type scheduler: `gwbridge.scheduler.Scheduler`
+    """
+
+    def __init__(
+        self,
+        auth=None,
+        timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+        pool_size=DEFAULT_POOL_SIZE,
+        scheduler=None,
+    ):
+        super().__init__()
+        self.auth = auth
+        self.timeout = timeout
+        self.scheduler = scheduler
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        if self.scheduler is None:
+            return self.send_request(method, url, **kwargs)
+
+        return self.scheduler.call(
+            method,
+            lambda: self.send_request(method, url, **kwargs),
+            body=kwargs.get("data"),
+            errors=(requests.ConnectionError, requests.Timeout),
+        )
+
+    def send_request(self, method, url, **kwargs):
+        """Send a single request, timing it if profiling
+        """
+
+        profiler = profiling.active()
+        if profiler is None:
+            return super().request(method, url, **kwargs)
+
+        start = time.perf_counter()
+        response = super().request(method, url, **kwargs)
+        profiler.record_request(
+            method,
+            response.url,
+            response.status_code,
+            profiling.body_size(response.request.body, response.request.headers),
+            len(response.content),
+            start,
+            time.perf_counter(),
+        )
+        return response
+
+
+def create_session(config, auth=None):
+    """Create the session used to make requests to the Wordpress server, as
+    configured by the `connect_timeout`, `timeout` and `pool_size` keys, and
+    the scheduling keys read by `gwbridge.scheduler.create_scheduler`. The
+    pool is sized for the number of threads that may make requests at once:
+    each post worker may upload several images concurrently
+
+    :param config: The consolidated configuration
+    :type config: dict
+    :param auth: The authentication to attach to every request
+    :type auth: `requests.auth.AuthBase`
+    :return: The session
+    :rtype: `WordpressSession`
+    """
+
+    timeout = (
+        float(config.get("connect_timeout") or DEFAULT_CONNECT_TIMEOUT),
+        float(config.get("timeout") or DEFAULT_READ_TIMEOUT),
+    )
+    pool_size = max(
+        int(config.get("pool_size") or DEFAULT_POOL_SIZE),
+        int(config.get("workers") or 1)
+        * int(config.get("upload_concurrency") or media.DEFAULT_UPLOAD_CONCURRENCY),
+        int(config.get("media_index_workers") or 0),
+    )
+
+    return WordpressSession(
+        auth=auth,
+        timeout=timeout,
+        pool_size=pool_size,
+        scheduler=scheduling.create_scheduler(config, concurrency=pool_size),
+    )
@@ -0,0 +1,222 @@
+"""Republishing of a post whenever its sources change, for `gwbridge watch`.
+The post is published through a single `PublishContext` for the lifetime of
+the process, so the markdown converter, the connection pool and the media
+index stay warm between edits, and an update costs little more than
+rendering the post and a single request.
+
+Files are watched by polling their modification times, which needs no
+dependencies and works on network and container file systems alike.
+"""
+import os
+import time
+from gwbridge import application
+from gwbridge import changes
+from gwbridge import fingerprint
+from gwbridge import program_log
+from gwbridge import sources
+
+# Seconds between checks for changes
+DEFAULT_INTERVAL = 0.2
+# Seconds without further changes to wait before publishing, so that an
+# editor saving several files, or writing a file in several steps, causes a
+# single update
+DEFAULT_DEBOUNCE = 0.3
+# Configuration keys naming the sources of the post, which are read afresh on
+# each publish. A change to any other key rebuilds the publish context, as it
+# may configure the session, converter or state the context holds
+SOURCE_CONFIG_KEYS = {"file"}
+
+
+def watched_files(config, root="."):
+    """The files a post is published from, as per
+    `gwbridge.changes.post_paths`
+    """
+
+    paths = changes.post_paths(config, root, fingerprint.load_fingerprint(root))
+    return sorted({os.path.normpath(path) for path in paths})
+
+
+def watched_sources(config, root="."):
+    """The markdown files a post is published from, as per
+    `gwbridge.sources.source_paths`, in the form given by `watched_files`
+    """
+
+    paths = sources.source_paths(config, root)
+    return sorted({os.path.normpath(os.path.join(root, path)) for path in paths})
+
+
+def snapshot(paths):
+    """The modification time and size of each file, or `None` for files that
+    don't exist
+    """
+
+    state = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            state[path] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            state[path] = None
+
+    return state
+
+
+class Watcher:
+    """Publishes a post, and publishes it again each time its sources change
+
+    :param config: The consolidated configuration, as per
+        `gwbridge.application.parse_args`
+    :type config: dict
+    :param cli_args: The arguments passed on the command line, which are
+        merged into the configuration again if the configuration file changes
+    :type cli_args: dict
+    :param interval: Seconds between checks for changes
+    :type interval: float
+    :param debounce: Seconds without further changes to wait before
+        publishing
+    :type debounce: float
+    """
+
+    def __init__(
+        self,
+        config,
+        cli_args=None,
+        root=".",
+        interval=DEFAULT_INTERVAL,
+        debounce=DEFAULT_DEBOUNCE,
+    ):
+        self.config = config
+        self.cli_args = cli_args or {}
+        self.root = root
+        self.interval = interval
+        self.debounce = debounce
+        self.context = None
+        self.state = {}
+        self.files = []
+        self.sources = set()
+
+    def publish(self):
+        """Publish the post, logging rather than raising any failure so that
+        the watch continues
+        """
+
+        if self.context is None:
+            self.context = application.PublishContext(self.config)
+
+        start = time.monotonic()
+        try:
+            status = application.publish_post(
+                self.config, root=self.root, context=self.context
+            )
+            program_log.info(
+                "Published with status {} in {:.2f}s".format(
+                    status, time.monotonic() - start
+                )
+            )
+        except Exception as e:
+            program_log.error("Failed to publish: {}".format(e))
+
+        # Files written while publishing, such as the metadata of a new post,
+        # aren't changes to be published
+        self.refresh()
+        self.state = snapshot(self.files)
+
+    def refresh(self):
+        """Find the files to watch again. Reading the sources and fingerprint
+        of the post to find them is left out of each check, and only done
+        after publishing or when a markdown file changes, as an include may
+        have been added or removed
+        """
+
+        self.files = watched_files(self.config, self.root)
+        self.sources = set(watched_sources(self.config, self.root))
+
+    def changed(self):
+        """Determine whether any watched file has changed since the last check
+        """
+
+        current = snapshot(self.files)
+        changed = [p for p in current if current.get(p) != self.state.get(p)]
+        if self.sources.intersection(changed):
+            self.refresh()
+            current = snapshot(self.files)
+        self.state = current
+        if changed:
+            program_log.debug("Changed: {}".format(", ".join(changed)))
+        return bool(changed)
+
+    def wait_for_change(self):
+        """Block until a watched file changes, and then until no file has
+        changed for the debounce period
+        """
+
+        while not self.changed():
+            time.sleep(self.interval)
+
+        settled = time.monotonic()
+        while time.monotonic() - settled < self.debounce:
+            time.sleep(self.interval)
+            if self.changed():
+                settled = time.monotonic()
+
+    def reload_config(self):
+        """Read the configuration file again, in case it changed, and close
+        the publish context if any setting it was built from changed, so
+        that it is rebuilt before the post is next published
+        """
+
+        config = application.parse_args(**self.cli_args)
+        keys = (set(config) | set(self.config)) - SOURCE_CONFIG_KEYS
+        if any(config.get(k) != self.config.get(k) for k in keys):
+            program_log.info("The configuration changed. Reconnecting.")
+            self.close()
+        self.config = config
+
+    def run(self, cycles=None):
+        """Publish the post, then publish it again after each change, until
+        interrupted or `cycles` changes have been published
+        """
+
+        self.publish()
+        program_log.info(
+            "Watching {} for changes. Press Ctrl+C to stop.".format(
+                ", ".join(self.files)
+            )
+        )
+        try:
+            while cycles is None or cycles > 0:
+                self.wait_for_change()
+                self.reload_config()
+                self.publish()
+                if cycles is not None:
+                    cycles -= 1
+        except KeyboardInterrupt:
+            program_log.info("Stopped watching")
+        finally:
+            self.close()
+
+    def close(self):
+        """Close the publish context, if one is open
+        """
+
+        if self.context is not None:
+            self.context.close()
+            self.context = None
+
+
+def watch(ctx, **kwargs):
+    """Publish a post, and publish it again each time its sources change
+    """
+
+    application.configure_verbosity(ctx)
+    interval = kwargs.pop("interval", None) or DEFAULT_INTERVAL
+    debounce = kwargs.pop("debounce", None)
+    config = application.parse_args(**kwargs)
+    program_log.debug("Config: {}".format(str(config)))
+
+    Watcher(
+        config,
+        cli_args=kwargs,
+        interval=interval,
+        debounce=DEFAULT_DEBOUNCE if debounce is None else debounce,
+    ).run()
@@ -0,0 +1,215 @@
+import json
+import logging
+import pytest
+from gwbridge import media
+from gwbridge import program_log
+
+web = pytest.importorskip("aiohttp.web")
+
+from gwbridge import aio  # noqa: E402
+
+
+def mock_media_item(media_id):
+    return {
+        "id": media_id,
+        "modified": "2020-05-21T23:16:{:02}".format(media_id % 60),
+        "guid": {
+            "rendered": "https://www.example.com/wp-content/{}.png".format(media_id)
+        },
+    }
+
+
+class MockServer:
+    """A Wordpress media endpoint served locally, recording each request
+    """
+
+    def __init__(self, total=0, fail_uploads=False):
+        self.total = total
+        self.fail_uploads = fail_uploads
+        self.requests = []
+        self.uploads = []
+        self.posts = []
+
+    async def handle(self, request):
+        self.requests.append(request)
+        if request.method == "POST":
+            if self.fail_uploads:
+                return web.json_response({}, status=500)
+            self.uploads.append(await request.read())
+            return web.json_response(mock_media_item(250 + len(self.uploads)))
+
+        per_page = int(request.query.get("per_page", 10))
+        page = int(request.query.get("page", 1))
+        pages = max(1, -(-self.total // per_page))
+        items = range((page - 1) * per_page, min(page * per_page, self.total))
+        return web.json_response(
+            [mock_media_item(i) for i in items],
+            headers={"X-WP-Total": str(self.total), "X-WP-TotalPages": str(pages)},
+        )
+
+    async def handle_posts(self, request):
+        if request.content_type == "application/json":
+            self.posts.append(await request.json())
+        else:
+            self.posts.append(dict(await request.post()))
+        post_id = int(request.match_info.get("id", 300))
+        return web.json_response(
+            {
+                "id": post_id,
+                "modified_gmt": "2020-05-24T10:00:00",
+                "guid": {"rendered": "https://www.example.com/?p={}".format(post_id)},
+            }
+        )
+
+    def run(self, test, config=None):
+        """Start the server, and run `test(session, media_url)` against it
+        """
+
+        async def main():
+            app = web.Application()
+            app.router.add_route("*", "/wp-json/wp/v2/media", self.handle)
+            app.router.add_post("/wp-json/wp/v2/posts", self.handle_posts)
+            app.router.add_post("/wp-json/wp/v2/posts/{id}", self.handle_posts)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = runner.addresses[0][1]
+            session = aio.create_session(config or {})
+            try:
+                return await test(
+                    session, "http://127.0.0.1:{}/wp-json/wp/v2/media".format(port)
+                )
+            finally:
+                await session.close()
+                await runner.cleanup()
+
+        return aio.run(main())
+
+
+@pytest.fixture
+def mock_post_dir(tmp_path):
+    (tmp_path / "img").mkdir()
+    (tmp_path / "img" / "test1.png").write_bytes(b"test1")
+    (tmp_path / "img" / "test2.jpg").write_bytes(b"test2")
+    yield tmp_path
+
+
+@pytest.fixture
+def img_map():
+    return {
+        "aaaa": {
+            "filename": "aaaa-test1.png",
+            "local_paths": ["img/test1.png"],
+            "target_path": None,
+        },
+        "bbbb": {
+            "filename": "bbbb-test2.jpg",
+            "local_paths": ["img/test2.jpg"],
+            "target_path": None,
+        },
+    }
+
+
+def test_session_signs_requests():
+    server = MockServer()
+    config = {
+        "client_key": "key",
+        "client_secret": "secret",
+        "resource_owner_key": "owner-key",
+        "resource_owner_secret": "owner-secret",
+    }
+
+    async def test(session, media_url):
+        return await session.get(media_url, params={"search": "a b"})
+
+    response = server.run(test, config)
+
+    assert response.status_code == 200
+    request = server.requests[0]
+    assert request.query.get("search") == "a b"
+    assert request.headers.get("Authorization").startswith("OAuth ")
+
+
+def test_index_fetch_paginated():
+    server = MockServer(total=250)
+
+    async def test(session, media_url):
+        return await aio.AsyncMediaIndex(session).fetch(media_url, {"parent": 254})
+
+    items = server.run(test)
+
+    assert [x.get("id") for x in items] == list(range(250))
+    assert len(server.requests) == 3
+    assert all(r.query.get("parent") == "254" for r in server.requests)
+
+
+def test_upload_images(mock_post_dir, img_map):
+    server = MockServer()
+    ledger = media.MediaLedger()
+
+    async def test(session, media_url):
+        return await aio.upload_images(
+            img_map, media_url, session, root=str(mock_post_dir), ledger=ledger
+        )
+
+    img_map = server.run(test)
+
+    assert sorted(server.uploads) == [b"test1", b"test2"]
+    assert [r.headers.get("Content-Length") for r in server.requests] == ["5", "5"]
+    assert all(img.get("target_path") for img in img_map.values())
+    assert {ledger.lookup("aaaa").get("id"), ledger.lookup("bbbb").get("id")} == {
+        251,
+        252,
+    }
+
+
+def test_upload_images_failure(mock_post_dir, img_map):
+    server = MockServer(fail_uploads=True)
+
+    async def test(session, media_url):
+        return await aio.upload_images(
+            img_map, media_url, session, root=str(mock_post_dir)
+        )
+
+    with pytest.raises(Exception) as e:
+        server.run(test)
+
+    assert set(e.value.failures) == {"img/test1.png", "img/test2.jpg"}
+    assert img_map.get("aaaa").get("target_path") is None
+
+
+def test_publish_post(mock_post_dir, caplog):
+    caplog.set_level(logging.DEBUG, logger=program_log.name)
+    server = MockServer()
+    (mock_post_dir / ".deploy").mkdir()
+    (mock_post_dir / ".deploy" / "metadata.json").write_text(
+        json.dumps({"status": "draft"})
+    )
+    (mock_post_dir / "README.md").write_text("# Title\n\n![](img/test1.png)\n")
+    root = str(mock_post_dir)
+
+    async def test(session, media_url):
+        config = {
+            "base_url": media_url[: -len("/wp/v2/media")],
+            "api_version": "wp/v2",
+            "file": "README.md",
+            "batch_requests": False,
+            "media_ledger": str(mock_post_dir / ".deploy" / "media.json"),
+            "media_index": str(mock_post_dir / ".deploy" / "media-index.json"),
+            "conversion_cache": str(mock_post_dir / ".deploy" / "conversions"),
+        }
+        first = await aio.publish_post(config, root=root)
+        second = await aio.publish_post(config, root=root)
+        return first, second
+
+    assert server.run(test) == (200, 304)
+    assert server.uploads == [b"test1"]
+    # A blank post is created, and then updated with the content
+    assert len(server.posts) == 2
+    assert server.posts[1].get("title") == "Title"
+    assert "wp-content/251.png" in server.posts[1].get("content")
+    with open(str(mock_post_dir / ".deploy" / "metadata.json")) as f:
+        assert json.load(f).get("id") == 300
+    # Each exchange with the server is logged, as by the threaded engine
+    assert "---------------- request ----------------" in caplog.text
@@ -1,10 +1,14 @@
 import pytest
+import hashlib
 import json
 import os
 import pypandoc
+import requests
 from bs4 import BeautifulSoup
 from mock import patch, mock_open
 from gwbridge import application
+from gwbridge import media
+from gwbridge import transport
 
 
 @pytest.fixture(scope="module")
@@ -77,6 +81,31 @@ def mock_get_existing_images_response():
     yield mock_response
 
 
+@pytest.fixture
+def session():
+    session = transport.WordpressSession()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def mock_post_dir(tmp_path, mock_md_file):
+    """Create an initialised post directory containing the mock markdown file
+    and the images it references
+    """
+
+    (tmp_path / ".deploy").mkdir()
+    (tmp_path / ".deploy" / "metadata.json").write_text(
+        json.dumps({"id": 254, "status": "draft"})
+    )
+    (tmp_path / "README.md").write_text(mock_md_file)
+    (tmp_path / "img").mkdir()
+    (tmp_path / "img" / "test1.png").write_bytes(b"test1")
+    (tmp_path / "img" / "test2.jpg").write_bytes(b"test2")
+
+    yield tmp_path
+
+
 @patch(
     "builtins.open",
     new_callable=mock_open,
@@ -116,10 +145,10 @@ def test_parse_args(mock_os, mock_file):
     assert config.get("api_version") == "wp/v2"
 
 
-@patch("builtins.open", new_callable=mock_open, read_data="")
 def test_parse_document(
-    mock_file,
     requests_mock,
+    session,
+    mock_post_dir,
     mock_md_file,
     mock_parse_document_result,
     mock_get_existing_images_response,
@@ -130,6 +159,7 @@ def test_parse_document(
     config = {
         "base_url": "https://www.example.com/wp-json",
         "api_version": "wp/v2",
+        "conversion_cache": False,
     }
 
     metadata = {
@@ -147,7 +177,18 @@ def test_parse_document(
     requests_mock.post(media_url, text=mock_upload_image_response)
     requests_mock.post(posts_url, text=mock_blank_post_response)
 
-    payload = application.parse_document(mock_md_file, config, metadata, None)
+    # The first image has been uploaded before, and is recorded in the ledger
+    ledger = media.MediaLedger()
+    ledger.record(
+        hashlib.sha256(b"test1").hexdigest(),
+        248,
+        "https://www.example.com/wp-content/uploads/2020/05/24/254-test1.png",
+        "254-test1.png",
+    )
+
+    payload = application.parse_document(
+        mock_md_file, config, metadata, session, root=str(mock_post_dir), ledger=ledger
+    )
 
     soup_comparison = BeautifulSoup(mock_parse_document_result, "html.parser")
     assert payload.get("title") == "This is the heading of the post"
@@ -156,68 +197,312 @@ def test_parse_document(
     )
 
 
-def test_create_blank_post(requests_mock, mock_blank_post_response):
+def test_create_blank_post(requests_mock, session, mock_blank_post_response):
 
     url = "https://www.example.com/wp-json/wp/v2/posts"
-    oauth = None
     requests_mock.post(url, text=mock_blank_post_response)
-    post_id = application.create_blank_post(url, oauth)
+    post_id = application.create_blank_post(url, session)
 
     assert post_id == 254
 
 
+def test_publish_post_creation_failure(requests_mock, mock_post_dir):
+    (mock_post_dir / ".deploy" / "metadata.json").write_text(
+        json.dumps({"status": "draft"})
+    )
+    config = {
+        "base_url": "https://www.example.com/wp-json",
+        "api_version": "wp/v2",
+        "file": "README.md",
+        "client_key": "wwww",
+        "client_secret": "xxxx",
+        "resource_owner_key": "yyyy",
+        "resource_owner_secret": "zzzz",
+        "media_ledger": str(mock_post_dir / ".deploy" / "media.json"),
+    }
+    requests_mock.post(
+        "https://www.example.com/wp-json/wp/v2/posts",
+        json={"code": "rest_cannot_create"},
+        status_code=401,
+    )
+
+    assert application.publish_post(config, root=str(mock_post_dir)) is None
+    assert requests_mock.call_count == 1
+    with open(str(mock_post_dir / ".deploy" / "metadata.json")) as f:
+        assert "id" not in json.load(f)
+
+
 def test_get_image_replacement_map(
-    requests_mock, mock_md_file, mock_get_existing_images_response
+    requests_mock,
+    session,
+    mock_post_dir,
+    mock_md_file,
+    mock_get_existing_images_response,
 ):
     media_url = "https://www.example.com/wp-json/wp/v2/media"
     requests_mock.get(media_url, text=mock_get_existing_images_response)
     html = pypandoc.convert_text(mock_md_file, "html", format="md")
     soup = BeautifulSoup(html, "html.parser")
     post_id = 254
+    test1_digest = hashlib.sha256(b"test1").hexdigest()
+    test2_digest = hashlib.sha256(b"test2").hexdigest()
+    ledger = media.MediaLedger()
+    ledger.record(
+        test1_digest,
+        248,
+        "https://www.example.com/wp-content/uploads/2020/05/24/254-test1.png",
+        "254-test1.png",
+    )
 
-    image_map = application.get_image_replacement_map(soup, media_url, post_id, None)
+    image_map = application.get_image_replacement_map(
+        soup, media_url, post_id, session, ledger=ledger, root=str(mock_post_dir)
+    )
     image_map_comparison = {
-        "254-test1.png": {
-            "local_path": "img/test1.png",
+        test1_digest: {
+            "filename": "{}-test1.png".format(test1_digest[:12]),
+            "local_paths": ["img/test1.png"],
             "target_path": "https://www.example.com/wp-content/uploads/2020/05/24/254-test1.png",
         },
-        "254-test2.jpg": {"local_path": "img/test2.jpg", "target_path": None},
+        test2_digest: {
+            "filename": "{}-test2.jpg".format(test2_digest[:12]),
+            "local_paths": ["img/test2.jpg"],
+            "target_path": None,
+        },
     }
 
     assert image_map is not None
     assert image_map == image_map_comparison
 
 
-@patch(
-    "builtins.open", new_callable=mock_open, read_data="",
-)
-def test_upload_images(mock_file, requests_mock, mock_upload_image_response):
+def test_get_image_replacement_map_by_content(requests_mock, session, mock_post_dir):
+    """This test shows that images are identified by their content. Two paths
+    to identical images share a single entry, and an image that exists on the
+    server under its content addressed filename is recognised and recorded in
+    the ledger
+    """
+
+    media_url = "https://www.example.com/wp-json/wp/v2/media"
+    (mock_post_dir / "img" / "copy").mkdir()
+    (mock_post_dir / "img" / "copy" / "test1.png").write_bytes(b"test1")
+    test1_digest = hashlib.sha256(b"test1").hexdigest()
+    remote_url = "https://www.example.com/wp-content/uploads/2020/05/{}-test1.png".format(
+        test1_digest[:12]
+    )
+    requests_mock.get(media_url, json=[{"id": 260, "guid": {"rendered": remote_url}}])
+    soup = BeautifulSoup(
+        '<p><img src="img/test1.png" /><img src="img/copy/test1.png" />'
+        '<img src="https://www.example.com/remote.png" /></p>',
+        "html.parser",
+    )
+    ledger = media.MediaLedger()
+
+    image_map = application.get_image_replacement_map(
+        soup, media_url, 254, session, ledger=ledger, root=str(mock_post_dir)
+    )
+
+    assert list(image_map.keys()) == [test1_digest]
+    assert image_map.get(test1_digest).get("local_paths") == [
+        "img/test1.png",
+        "img/copy/test1.png",
+    ]
+    assert image_map.get(test1_digest).get("target_path") == remote_url
+    assert ledger.lookup(test1_digest).get("url") == remote_url
+
+    # Once recorded in the ledger, the server doesn't need to be queried
+    call_count = requests_mock.call_count
+    application.get_image_replacement_map(
+        soup, media_url, 254, session, ledger=ledger, root=str(mock_post_dir)
+    )
+    assert requests_mock.call_count == call_count
+
+
+def test_get_image_replacement_map_legacy_filename(
+    requests_mock, session, mock_post_dir, mock_get_existing_images_response
+):
+    """This test shows that an image uploaded by an earlier version, under a
+    filename prefixed with the post id, is recognised and isn't uploaded again
+    """
+
+    media_url = "https://www.example.com/wp-json/wp/v2/media"
+    requests_mock.get(media_url, text=mock_get_existing_images_response)
+    requests_mock.post(media_url, status_code=500)
+    soup = BeautifulSoup('<p><img src="img/test1.png" /></p>', "html.parser")
+    test1_digest = hashlib.sha256(b"test1").hexdigest()
+    remote_url = "https://www.example.com/wp-content/uploads/2020/05/24/254-test1.png"
+    ledger = media.MediaLedger()
+
+    image_map = application.get_image_replacement_map(
+        soup, media_url, 254, session, ledger=ledger, root=str(mock_post_dir)
+    )
+    application.upload_images(
+        image_map,
+        media_url,
+        session,
+        root=str(mock_post_dir),
+        ledger=ledger,
+        post_id=254,
+    )
+
+    assert not [r for r in requests_mock.request_history if r.method == "POST"]
+    assert image_map.get(test1_digest).get("target_path") == remote_url
+    assert ledger.lookup(test1_digest).get("url") == remote_url
+
+
+def test_upload_images(
+    requests_mock, session, mock_post_dir, mock_upload_image_response
+):
 
     media_url = "https://www.example.com/wp-json/wp/v2/media"
 
     requests_mock.post(media_url, text=mock_upload_image_response)
     img_map = {
-        "254-test1.png": {
-            "local_path": "img/test1.png",
+        "aaaa": {
+            "filename": "aaaa-test1.png",
+            "local_paths": ["img/test1.png"],
             "target_path": "https://www.example.com/wp-content/uploads/2020/05/24/254-test1.png",
         },
-        "254-test2.jpg": {"local_path": "img/test2.jpg", "target_path": None},
+        "bbbb": {
+            "filename": "bbbb-test2.jpg",
+            "local_paths": ["img/test2.jpg"],
+            "target_path": None,
+        },
     }
+    ledger = media.MediaLedger()
+
+    img_map = application.upload_images(
+        img_map,
+        media_url,
+        session,
+        root=str(mock_post_dir),
+        ledger=ledger,
+        post_id=254,
+    )
 
-    img_map = application.upload_images(img_map, media_url, oauth=None)
-
+    assert requests_mock.call_count == 1
+    assert requests_mock.last_request.qs == {"post": ["254"]}
+    # The image is streamed from disk, rather than read into memory
+    assert requests_mock.last_request.body.name.endswith("test2.jpg")
+    assert requests_mock.last_request.headers.get("Content-Length") == "5"
     assert (
-        img_map.get("254-test1.png").get("target_path")
+        img_map.get("aaaa").get("target_path")
         == "https://www.example.com/wp-content/uploads/2020/05/24/254-test1.png"
     )
-    assert img_map.get("254-test2.jpg").get("target_path") is not None
+    assert img_map.get("bbbb").get("target_path") is not None
+    assert ledger.lookup("bbbb").get("id") == 250
+    assert ledger.lookup("bbbb").get("url") == img_map.get("bbbb").get("target_path")
+
+
+def test_upload_images_unknown_type(requests_mock, session, mock_post_dir):
+    media_url = "https://www.example.com/wp-json/wp/v2/media"
+    (mock_post_dir / "img" / "test.unknownext").write_bytes(b"data")
+    img_map = {
+        "cccc": {
+            "filename": "cccc-test.unknownext",
+            "local_paths": ["img/test.unknownext"],
+            "target_path": None,
+        }
+    }
+
+    def upload_response(request, context):
+        # The streamed body is sent intact, rather than read when signing
+        assert request.body.read() == b"data"
+        return {"id": 251, "guid": {"rendered": "https://www.example.com/test"}}
+
+    requests_mock.post(media_url, json=upload_response, status_code=201)
+
+    img_map = application.upload_images(
+        img_map, media_url, session, root=str(mock_post_dir)
+    )
+
+    assert (
+        requests_mock.last_request.headers.get("Content-Type")
+        == "application/octet-stream"
+    )
+    assert img_map.get("cccc").get("target_path") == "https://www.example.com/test"
+
+
+def test_upload_images_concurrently(requests_mock, session, mock_post_dir):
+    media_url = "https://www.example.com/wp-json/wp/v2/media"
+    img_map = {}
+    for i in range(8):
+        (mock_post_dir / "img" / "{}.png".format(i)).write_bytes(bytes([i]))
+        img_map["digest{}".format(i)] = {
+            "filename": "digest{}-{}.png".format(i, i),
+            "local_paths": ["img/{}.png".format(i)],
+            "target_path": None,
+        }
+
+    def upload_response(request, context):
+        filename = request.headers.get("Content-Disposition").split("=")[-1]
+        return {
+            "id": int(request.body.read()[0]),
+            "guid": {"rendered": "https://www.example.com/{}".format(filename)},
+        }
+
+    requests_mock.post(media_url, json=upload_response, status_code=201)
+
+    img_map = application.upload_images(
+        img_map, media_url, session, root=str(mock_post_dir), concurrency=4
+    )
+
+    assert requests_mock.call_count == 8
+    for i in range(8):
+        assert img_map.get("digest{}".format(i)).get(
+            "target_path"
+        ) == "https://www.example.com/digest{}-{}.png".format(i, i)
+
+
+def test_upload_images_failure(requests_mock, session, mock_post_dir):
+    """This test shows that if an image fails to upload, the failure is
+    reported and the image map isn't updated, but successful uploads are
+    recorded in the ledger
+    """
+
+    media_url = "https://www.example.com/wp-json/wp/v2/media"
+    img_map = {
+        "aaaa": {
+            "filename": "aaaa-test1.png",
+            "local_paths": ["img/test1.png"],
+            "target_path": None,
+        },
+        "bbbb": {
+            "filename": "bbbb-test2.jpg",
+            "local_paths": ["img/test2.jpg"],
+            "target_path": None,
+        },
+    }
 
+    def upload_response(request, context):
+        if request.body.read() == b"test2":
+            context.status_code = 500
+            return {"code": "internal_server_error"}
+        context.status_code = 201
+        return {"id": 250, "guid": {"rendered": "https://www.example.com/test1.png"}}
 
-def test_get_existing_images(requests_mock, mock_get_existing_images_response):
+    requests_mock.post(media_url, json=upload_response)
+    ledger = media.MediaLedger()
+
+    with pytest.raises(application.UploadError) as e:
+        application.upload_images(
+            img_map,
+            media_url,
+            session,
+            root=str(mock_post_dir),
+            ledger=ledger,
+            concurrency=2,
+        )
+
+    assert list(e.value.failures.keys()) == ["img/test2.jpg"]
+    assert all(img.get("target_path") is None for img in img_map.values())
+    assert ledger.lookup("aaaa").get("url") == "https://www.example.com/test1.png"
+    assert ledger.lookup("bbbb") is None
+
+
+def test_get_existing_images(requests_mock, session, mock_get_existing_images_response):
 
     media_url = "https://www.example.com/wp-json/wp/v2/media"
     requests_mock.get(media_url, text=mock_get_existing_images_response)
-    image_urls = application.get_existing_images(media_url, None)
+    image_urls = application.get_existing_images(media_url, session)
 
     assert "254-test1.png" in image_urls.keys()
     assert "reverse-proxy.png" in image_urls.keys()
@@ -245,12 +530,14 @@ def test_replace_image_links(mock_md_file):
     html = pypandoc.convert_text(mock_md_file, "html", format="md")
     soup = BeautifulSoup(html, "html.parser")
     img_map = {
-        "254-test1.png": {
-            "local_path": "img/test1.png",
+        "aaaa": {
+            "filename": "aaaa-test1.png",
+            "local_paths": ["img/test1.png"],
             "target_path": "https://www.example.com/wp-content/uploads/2020/05/24/254-test1.png",
         },
-        "254-test2.jpg": {
-            "local_path": "img/test2.jpg",
+        "bbbb": {
+            "filename": "bbbb-test2.jpg",
+            "local_paths": ["img/test2.jpg"],
             "target_path": "https://www.example.com/wp-content/uploads/2020/05/24/254-test2.jpg",
         },
     }
@@ -287,3 +574,203 @@ def test_construct_url():
 
     url = application.construct_url(base_url, api_version, endpoint, 2)
     assert url == "https://www.example.com/wp-json/wp/v2/media/2"
+
+
+def test_publish_post_skips_unchanged(
+    requests_mock,
+    mock_post_dir,
+    mock_get_existing_images_response,
+    mock_upload_image_response,
+    mock_blank_post_response,
+):
+    config = {
+        "base_url": "https://www.example.com/wp-json",
+        "api_version": "wp/v2",
+        "file": "README.md",
+        "client_key": "wwww",
+        "client_secret": "xxxx",
+        "resource_owner_key": "yyyy",
+        "resource_owner_secret": "zzzz",
+        "media_ledger": str(mock_post_dir / ".deploy" / "media.json"),
+        "media_index": str(mock_post_dir / ".deploy" / "cache" / "media-index.json"),
+        "conversion_cache": str(mock_post_dir / ".deploy" / "cache" / "conversions"),
+    }
+    media_url = "https://www.example.com/wp-json/wp/v2/media"
+    post_url = "https://www.example.com/wp-json/wp/v2/posts/254"
+    requests_mock.get(media_url, text=mock_get_existing_images_response)
+    requests_mock.post(media_url, text=mock_upload_image_response)
+    requests_mock.post(post_url, text=mock_blank_post_response)
+    root = str(mock_post_dir)
+
+    assert application.publish_post(config, root=root) == 200
+    assert os.path.exists(os.path.join(root, ".deploy", "fingerprint.json"))
+    call_count = requests_mock.call_count
+
+    # Nothing has changed, so no requests should be made
+    assert application.publish_post(config, root=root) == 304
+    assert requests_mock.call_count == call_count
+
+    # Forcing the publish always pushes the post
+    assert application.publish_post({**config, "force": True}, root=root) == 200
+    assert requests_mock.call_count > call_count
+    call_count = requests_mock.call_count
+
+    # Editing an image causes the post to be rendered again. As the rendered
+    # payload is identical, the update itself isn't sent
+    (mock_post_dir / "img" / "test1.png").write_bytes(b"edited")
+    assert application.publish_post(config, root=root) == 304
+    assert requests_mock.call_count > call_count
+    assert post_url not in [r.url for r in requests_mock.request_history[call_count:]]
+
+
+def test_publish_post_sends_changed_fields(
+    requests_mock,
+    mock_post_dir,
+    mock_get_existing_images_response,
+    mock_upload_image_response,
+    mock_blank_post_response,
+):
+    """This test shows that updates to a published post only send the fields
+    that changed, and that the post isn't rendered if only its metadata
+    changed
+    """
+
+    config = {
+        "base_url": "https://www.example.com/wp-json",
+        "api_version": "wp/v2",
+        "file": "README.md",
+        "client_key": "wwww",
+        "client_secret": "xxxx",
+        "resource_owner_key": "yyyy",
+        "resource_owner_secret": "zzzz",
+        "media_ledger": str(mock_post_dir / ".deploy" / "media.json"),
+        "media_index": str(mock_post_dir / ".deploy" / "cache" / "media-index.json"),
+        "conversion_cache": False,
+    }
+    media_url = "https://www.example.com/wp-json/wp/v2/media"
+    post_url = "https://www.example.com/wp-json/wp/v2/posts/254"
+    requests_mock.get(media_url, text=mock_get_existing_images_response)
+    requests_mock.post(media_url, text=mock_upload_image_response)
+    requests_mock.post(post_url, text=mock_blank_post_response)
+    root = str(mock_post_dir)
+
+    assert application.publish_post(config, root=root) == 200
+    assert set(requests_mock.last_request.json()) == {
+        "date",
+        "title",
+        "content",
+        "id",
+        "status",
+    }
+
+    (mock_post_dir / ".deploy" / "metadata.json").write_text(
+        json.dumps({"id": 254, "status": "publish"})
+    )
+    with patch.object(application, "render_document") as mock_render:
+        assert application.publish_post(config, root=root) == 200
+        assert not mock_render.called
+    assert requests_mock.last_request.json() == {"status": "publish"}
+
+    data = (mock_post_dir / "README.md").read_text()
+    (mock_post_dir / "README.md").write_text(data.replace("# ", "# New ", 1))
+    assert application.publish_post(config, root=root) == 200
+    assert set(requests_mock.last_request.json()) == {"title"}
+
+
+def test_publish_post_resumes(
+    requests_mock,
+    mock_post_dir,
+    mock_get_existing_images_response,
+    mock_upload_image_response,
+    mock_blank_post_response,
+):
+    """This test shows that a run which dies after creating the post and
+    uploading its images is resumed from its journal, without creating
+    another post or uploading the images again, even if the metadata and
+    media ledger weren't saved
+    """
+
+    config = {
+        "base_url": "https://www.example.com/wp-json",
+        "api_version": "wp/v2",
+        "file": "README.md",
+        "client_key": "wwww",
+        "client_secret": "xxxx",
+        "resource_owner_key": "yyyy",
+        "resource_owner_secret": "zzzz",
+        "media_ledger": str(mock_post_dir / ".deploy" / "media.json"),
+        "media_index": str(mock_post_dir / ".deploy" / "cache" / "media-index.json"),
+        "conversion_cache": False,
+    }
+    media_url = "https://www.example.com/wp-json/wp/v2/media"
+    posts_url = "https://www.example.com/wp-json/wp/v2/posts"
+    metadata_file = mock_post_dir / ".deploy" / "metadata.json"
+    journal_file = mock_post_dir / ".deploy" / "journal.jsonl"
+    metadata_file.write_text(json.dumps({"id": "", "status": "draft"}))
+    requests_mock.get(media_url, text=mock_get_existing_images_response)
+    requests_mock.post(media_url, text=mock_upload_image_response)
+    requests_mock.post(posts_url, text=mock_blank_post_response)
+    requests_mock.post(posts_url + "/254", exc=requests.ConnectionError)
+    root = str(mock_post_dir)
+
+    with pytest.raises(requests.ConnectionError):
+        application.publish_post(config, root=root)
+
+    steps = [json.loads(line).get("step") for line in open(str(journal_file))]
+    # test1.png is already on the server under its legacy filename
+    assert steps == ["post_created", "media_uploaded"]
+
+    # Lose the state saved outside the journal
+    metadata_file.write_text(json.dumps({"id": "", "status": "draft"}))
+    os.remove(config.get("media_ledger"))
+    call_count = requests_mock.call_count
+    requests_mock.post(posts_url + "/254", text=mock_blank_post_response)
+
+    assert application.publish_post(config, root=root) == 200
+    methods = [
+        (r.method, r.url.split("?")[0])
+        for r in requests_mock.request_history[call_count:]
+    ]
+    assert ("POST", posts_url) not in methods
+    assert ("POST", media_url) not in methods
+    assert json.loads(metadata_file.read_text()).get("id") == 254
+    assert not journal_file.exists()
+
+
+class MockConverter:
+    def convert(self, data, **kwargs):
+        return data
+
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize("parser", ["html.parser", "lxml"])
+def test_render_document(parser):
+    """This test shows that the title and images of a document are found in a
+    single pass, and that the content doesn't depend on the parser
+    """
+
+    pytest.importorskip(parser.split(".")[0])
+    html = (
+        '<h1 id="title">Title</h1>\n<p><img src="img/test1.png" /></p>\n'
+        '<h1>Section</h1>\n<p><img src="img/test1.png" /><img src="a.png" /></p>\n'
+    )
+
+    soup, title, images = application.render_document(
+        html, {"html_parser": parser}, converter=MockConverter()
+    )
+    document = application.finish_document(
+        soup,
+        title,
+        {"aaaa": {"local_paths": ["img/test1.png"], "target_path": "b.png"}},
+        images=images,
+    )
+
+    assert title == "Title"
+    assert sorted(images) == ["a.png", "img/test1.png"]
+    assert len(images.get("img/test1.png")) == 2
+    assert document.get("content") == (
+        '<p><img src="b.png"></p>\n'
+        '<h1>Section</h1>\n<p><img src="b.png"><img src="a.png"></p>\n'
+    )
@@ -0,0 +1,104 @@
+import json
+import os
+import pytest
+from mock import patch
+from gwbridge import batch
+
+
+@pytest.fixture
+def mock_post_tree(tmp_path):
+    """Create a repository containing two post directories, each initialised
+    with its own `.deploy` folder, and a manifest listing them
+    """
+
+    for name in ["first", "second"]:
+        deploy_dir = tmp_path / "posts" / name / ".deploy"
+        deploy_dir.mkdir(parents=True)
+        (deploy_dir / "config.json").write_text(
+            json.dumps({"file": "{}.md".format(name)})
+        )
+        (deploy_dir / "metadata.json").write_text(json.dumps({"id": ""}))
+
+    manifest = tmp_path / "posts.json"
+    manifest.write_text(
+        json.dumps(
+            {
+                "workers": 2,
+                "posts": ["posts/first", {"path": "posts/second", "file": "index.md"},],
+            }
+        )
+    )
+
+    yield tmp_path
+
+
+def test_load_manifest(mock_post_tree):
+    manifest = batch.load_manifest(str(mock_post_tree / "posts.json"))
+
+    assert manifest.get("workers") == 2
+    assert [p.get("path") for p in manifest.get("posts")] == [
+        os.path.join(str(mock_post_tree), "posts", "first"),
+        os.path.join(str(mock_post_tree), "posts", "second"),
+    ]
+    assert manifest.get("posts")[0].get("config") == {}
+    assert manifest.get("posts")[1].get("config") == {"file": "index.md"}
+
+
+def test_load_manifest_list(tmp_path):
+    manifest_file = tmp_path / "posts.json"
+    manifest_file.write_text(json.dumps(["a", "b"]))
+
+    manifest = batch.load_manifest(str(manifest_file))
+
+    assert [p.get("path") for p in manifest.get("posts")] == [
+        os.path.join(str(tmp_path), "a"),
+        os.path.join(str(tmp_path), "b"),
+    ]
+
+
+def test_build_post_config(mock_post_tree):
+    """This test shows that the post configuration file overrides the project
+    configuration, and that manifest overrides and command line arguments
+    take priority over both
+    """
+
+    config = {
+        "base_url": "https://www.example.com/wp-json",
+        "file": "README.md",
+        "api_version": "wp/v2",
+    }
+    root = str(mock_post_tree / "posts" / "second")
+
+    post_config = batch.build_post_config(
+        config, root, {"api_version": "wp/v3"}, {"client_key": "wwww", "file": None}
+    )
+
+    assert post_config.get("base_url") == "https://www.example.com/wp-json"
+    assert post_config.get("file") == "second.md"
+    assert post_config.get("api_version") == "wp/v3"
+    assert post_config.get("client_key") == "wwww"
+
+
+@patch("gwbridge.application.publish_post")
+def test_publish_manifest(mock_publish_post, mock_post_tree):
+    def fake_publish_post(config, root, context):
+        if root.endswith("second"):
+            raise FileNotFoundError("second.md")
+        return 200
+
+    mock_publish_post.side_effect = fake_publish_post
+    config = {
+        "manifest": str(mock_post_tree / "posts.json"),
+        "media_ledger": str(mock_post_tree / "media.json"),
+        "media_index": str(mock_post_tree / "media-index.json"),
+    }
+
+    results = batch.publish_manifest(config)
+
+    assert mock_publish_post.call_count == 2
+    assert [r.get("ok") for r in results] == [True, False]
+    assert results[0].get("status") == 200
+    assert "FileNotFoundError" in results[1].get("error")
+    # A single context is shared between all posts
+    contexts = {id(c.kwargs.get("context")) for c in mock_publish_post.call_args_list}
+    assert len(contexts) == 1
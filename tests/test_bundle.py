@@ -0,0 +1,159 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import requests
+from gwbridge import aio
+from gwbridge import bundle
+
+BASE_URL = "https://www.example.com/wp-json"
+BATCH_URL = BASE_URL + "/batch/v1"
+POSTS_URL = BASE_URL + "/wp/v2/posts"
+
+
+def batch_reply(request, context):
+    """Reply to a batch request as a Wordpress server would, creating or
+    updating each post
+    """
+
+    return {
+        "responses": [
+            {
+                "status": 201 if sub.get("path") == "/wp/v2/posts" else 200,
+                "headers": {},
+                "body": {
+                    "id": 300
+                    if sub.get("path") == "/wp/v2/posts"
+                    else int(sub.get("path").rsplit("/", 1)[-1])
+                },
+            }
+            for sub in request.json().get("requests")
+        ]
+    }
+
+
+def post_all(bundler, urls):
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        return list(executor.map(lambda url: bundler.post(url, {"title": "a"}), urls))
+
+
+def test_batch(requests_mock):
+    """This test shows that requests made at once are sent in a single batch,
+    and that each receives its own response
+    """
+
+    requests_mock.post(BATCH_URL, status_code=207, json=batch_reply)
+    bundler = bundle.Bundler(requests.Session(), BASE_URL, size=3, window=5)
+
+    responses = post_all(bundler, [POSTS_URL, POSTS_URL + "/254", POSTS_URL + "/255"])
+
+    assert requests_mock.call_count == 1
+    assert [r.status_code for r in responses] == [201, 200, 200]
+    assert [r.json().get("id") for r in responses] == [300, 254, 255]
+    paths = [sub.get("path") for sub in requests_mock.last_request.json()["requests"]]
+    assert sorted(paths) == ["/wp/v2/posts", "/wp/v2/posts/254", "/wp/v2/posts/255"]
+
+
+def test_batch_window(requests_mock):
+    """This test shows that a request isn't held for longer than the batch
+    window, and is sent on its own if no other request was queued
+    """
+
+    requests_mock.post(POSTS_URL + "/254", json={"id": 254})
+    bundler = bundle.Bundler(requests.Session(), BASE_URL, size=3, window=0.01)
+
+    assert bundler.post(POSTS_URL + "/254", {"title": "a"}).json() == {"id": 254}
+    assert requests_mock.last_request.url == POSTS_URL + "/254"
+
+
+def test_batch_unsupported(requests_mock):
+    """This test shows that requests are sent individually if the server has
+    no batch endpoint, and that no further batches are attempted
+    """
+
+    requests_mock.post(BATCH_URL, status_code=404, json={"code": "rest_no_route"})
+    requests_mock.post(POSTS_URL + "/254", json={"id": 254})
+    requests_mock.post(POSTS_URL + "/255", json={"id": 255})
+    bundler = bundle.Bundler(requests.Session(), BASE_URL, size=2, window=5)
+
+    responses = post_all(bundler, [POSTS_URL + "/254", POSTS_URL + "/255"])
+
+    assert [r.json().get("id") for r in responses] == [254, 255]
+    assert not bundler.supported
+    assert requests_mock.call_count == 3
+
+    post_all(bundler, [POSTS_URL + "/254", POSTS_URL + "/255"])
+    assert requests_mock.call_count == 5
+
+
+def test_batch_not_allowed(requests_mock):
+    def reply(request, context):
+        return {
+            "responses": [
+                {"status": 200, "body": {"id": 254}},
+                {"status": 400, "body": {"code": "rest_batch_not_allowed"}},
+            ]
+        }
+
+    requests_mock.post(BATCH_URL, status_code=207, json=reply)
+    requests_mock.post(POSTS_URL + "/255", json={"id": 255})
+    bundler = bundle.Bundler(requests.Session(), BASE_URL, size=2, window=5)
+    bundler.pending = [
+        bundle.Queued(bundler.build_request(POSTS_URL + "/254", {})),
+        bundle.Queued(bundler.build_request(POSTS_URL + "/255", {})),
+    ]
+
+    queued = bundler.take()
+    bundler.send(queued)
+
+    assert [e.response.json().get("id") for e in queued] == [254, 255]
+    assert requests_mock.last_request.url == POSTS_URL + "/255"
+
+
+def test_async_batch():
+    class Session:
+        def __init__(self):
+            self.requests = []
+
+        async def post(self, url, data=None, headers=None):
+            self.requests.append(url)
+            response = requests.Response()
+            response.status_code = 207
+            response._content = json.dumps(
+                {
+                    "responses": [
+                        {"status": 200, "body": {"id": i}}
+                        for i, _ in enumerate(json.loads(data).get("requests"))
+                    ]
+                }
+            ).encode("utf-8")
+            return response
+
+    session = Session()
+    bundler = bundle.AsyncBundler(session, BASE_URL, size=25, window=0.01)
+
+    async def post_all():
+        return await asyncio.gather(
+            *[bundler.post(POSTS_URL + "/{}".format(i), {}) for i in range(30)]
+        )
+
+    responses = aio.run(post_all())
+
+    assert session.requests == [BATCH_URL, BATCH_URL]
+    assert [r.json().get("id") for r in responses] == list(range(25)) + list(range(5))
+
+
+@pytest.mark.parametrize(
+    "config, workers, size",
+    [
+        ({"base_url": BASE_URL}, 1, None),
+        ({"base_url": BASE_URL, "batch_requests": False}, 8, None),
+        ({"base_url": BASE_URL}, 8, 8),
+        ({"base_url": BASE_URL}, 100, 25),
+        ({"base_url": BASE_URL, "batch_size": 4}, 8, 4),
+    ],
+)
+def test_create_bundler(config, workers, size):
+    bundler = bundle.create_bundler(config, requests.Session(), workers=workers)
+
+    assert getattr(bundler, "size", None) == size
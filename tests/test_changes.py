@@ -0,0 +1,106 @@
+import json
+import os
+import subprocess
+import pytest
+from gwbridge import FINGERPRINT_FILE
+from gwbridge import batch
+from gwbridge import changes
+
+
+def git(repo, *args):
+    subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"]
+        + list(args),
+        cwd=str(repo),
+        check=True,
+        stdout=subprocess.PIPE,
+    )
+
+
+@pytest.fixture
+def mock_repo(tmp_path):
+    """Create a git repository containing two posts and a manifest listing
+    them. The first post was last published with an image shared between
+    posts, and the second post has never been published
+    """
+
+    (tmp_path / "shared").mkdir()
+    (tmp_path / "shared" / "a.png").write_bytes(b"a")
+    for name in ["first", "second"]:
+        deploy_dir = tmp_path / "posts" / name / ".deploy"
+        deploy_dir.mkdir(parents=True)
+        (deploy_dir / "config.json").write_text(json.dumps({"file": "post.md"}))
+        (deploy_dir / "metadata.json").write_text(json.dumps({"id": ""}))
+        (tmp_path / "posts" / name / "post.md").write_text("# Title\n")
+        (tmp_path / "posts" / name / "b.png").write_bytes(b"b")
+    (tmp_path / "posts" / "first" / FINGERPRINT_FILE).write_text(
+        json.dumps({"images": {"../../shared/a.png": "digest"}, "payload": "digest"})
+    )
+    (tmp_path / "posts.json").write_text(
+        json.dumps({"posts": ["posts/first", "posts/second"]})
+    )
+
+    git(tmp_path, "init", "-q")
+    git(tmp_path, "add", ".")
+    git(tmp_path, "commit", "-q", "-m", "Initial commit")
+    yield tmp_path
+
+
+def select_posts(repo):
+    manifest = batch.load_manifest(str(repo / "posts.json"))
+    cwd = os.getcwd()
+    os.chdir(str(repo))
+    try:
+        posts = batch.select_posts(
+            {"since": "HEAD", "manifest": "posts.json"}, manifest.get("posts")
+        )
+    finally:
+        os.chdir(cwd)
+    return [os.path.basename(p.get("path")) for p in posts]
+
+
+def test_changed_files(mock_repo):
+    (mock_repo / "shared" / "a.png").write_bytes(b"c")
+
+    assert changes.changed_files("HEAD", cwd=str(mock_repo)) == {
+        os.path.realpath(str(mock_repo / "shared" / "a.png"))
+    }
+
+
+def test_changed_files_unknown_ref(mock_repo):
+    with pytest.raises(changes.ChangeDetectionError):
+        changes.changed_files("does-not-exist", cwd=str(mock_repo))
+
+
+def test_select_posts_unchanged(mock_repo):
+    assert select_posts(mock_repo) == []
+
+
+def test_select_posts_image_only(mock_repo):
+    """This test shows that a change to an image referenced by a published
+    post outside its directory selects only that post
+    """
+
+    (mock_repo / "shared" / "a.png").write_bytes(b"c")
+
+    assert select_posts(mock_repo) == ["first"]
+
+
+def test_select_posts_unpublished(mock_repo):
+    """This test shows that a post which hasn't been published is selected by
+    a change to any file in its directory, and that a published post isn't
+    selected by a change to a file it doesn't reference
+    """
+
+    (mock_repo / "posts" / "first" / "b.png").write_bytes(b"c")
+    (mock_repo / "posts" / "second" / "b.png").write_bytes(b"c")
+
+    assert select_posts(mock_repo) == ["second"]
+
+
+def test_select_posts_manifest_changed(mock_repo):
+    (mock_repo / "posts.json").write_text(
+        json.dumps({"workers": 2, "posts": ["posts/first", "posts/second"]})
+    )
+
+    assert select_posts(mock_repo) == ["first", "second"]
@@ -0,0 +1,77 @@
+import os
+import subprocess
+import sys
+from click.testing import CliRunner
+from gwbridge import cli
+
+# Libraries which are slow to import, and are only needed to publish posts
+HEAVY_MODULES = {
+    "aiohttp",
+    "bs4",
+    "lxml",
+    "markdown_it",
+    "PIL",
+    "pypandoc",
+    "requests",
+    "requests_oauthlib",
+}
+
+
+def imported_modules(statement):
+    """Run `statement` in a new interpreter with `-X importtime`, returning
+    the cumulative import time in microseconds of each module it imported
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:") :].split("|")
+        modules[name.strip()] = int(cumulative)
+
+    return modules
+
+
+def test_cli_import_is_light():
+    """This test shows that the command line interface, and the modules
+    needed to show help and initialise a project, don't import the libraries
+    used to publish posts
+    """
+
+    modules = imported_modules("import gwbridge.cli, gwbridge.project")
+
+    assert "gwbridge.cli" in modules
+    assert not {m.split(".")[0] for m in modules} & HEAVY_MODULES
+
+
+def test_import_does_not_configure_logging():
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import logging, gwbridge.application; "
+            "print(len(logging.getLogger('gwbridge').handlers))",
+        ],
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+    assert result.stdout.strip() == "0"
+
+
+def test_help():
+    result = CliRunner().invoke(cli.cli, ["--help"])
+
+    assert result.exit_code == 0
+    assert "publish" in result.output
@@ -0,0 +1,179 @@
+import os
+import pytest
+from bs4 import BeautifulSoup
+from gwbridge import application
+from gwbridge import convert
+from gwbridge import sources
+
+MARKDOWN = """# A Post Title
+
+Some *emphasised* text, and a [link](https://www.example.com).
+
+![A screenshot](img/test1.png)
+
+- one
+- two
+
+```python
+print("hello")
+```
+
+![A diagram](img/test2.jpg) and ![the screenshot again](img/test1.png)
+"""
+
+
+@pytest.fixture(params=sorted(convert.CONVERTERS))
+def converter(request):
+    if request.param == "commonmark":
+        pytest.importorskip("markdown_it")
+    try:
+        converter = convert.create_converter(
+            {"converter": request.param, "conversion_cache": False}
+        )
+        converter.convert("")
+    except (OSError, RuntimeError) as e:
+        pytest.skip("{} is unavailable: {}".format(request.param, e))
+    yield converter
+    converter.close()
+
+
+def test_conformance(converter):
+    """This test shows that each converter produces a post with the same
+    title, text and images
+    """
+
+    soup, title, images = application.render_document(MARKDOWN, {}, converter=converter)
+    document = application.finish_document(
+        soup,
+        title,
+        {
+            "aaaa": {
+                "local_paths": ["img/test1.png"],
+                "target_path": "https://www.example.com/test1.png",
+            },
+            "bbbb": {
+                "local_paths": ["img/test2.jpg"],
+                "target_path": "https://www.example.com/test2.jpg",
+            },
+        },
+    )
+    content = BeautifulSoup(document.get("content"), "html.parser")
+
+    assert document.get("title") == "A Post Title"
+    assert content.h1 is None
+    assert [x.get("src") for x in content.find_all("img")] == [
+        "https://www.example.com/test1.png",
+        "https://www.example.com/test2.jpg",
+        "https://www.example.com/test1.png",
+    ]
+    assert content.em.string == "emphasised"
+    assert content.a.get("href") == "https://www.example.com"
+    assert [x.string for x in content.find_all("li")] == ["one", "two"]
+    assert 'print("hello")' in content.code.get_text()
+
+
+def test_conformance_parts(converter):
+    """This test shows that each pandoc converter keeps the identifiers of
+    footnotes in different parts of a post unique
+    """
+
+    if isinstance(converter, convert.CommonMarkConverter):
+        pytest.skip("CommonMark has no footnotes")
+
+    parts = [
+        sources.Part("one.md", "# Title\n\nOne[^1]\n\n[^1]: First\n"),
+        sources.Part("two.md", "Two[^1]\n\n[^1]: Second\n"),
+    ]
+    soup, title, images = application.render_document(
+        sources.join(parts), {}, converter=converter, parts=parts
+    )
+
+    ids = [x.get("id") for x in soup.find_all(id=True)]
+    assert len(ids) == len(set(ids))
+    assert "Second" in soup.find(id="two-md-fn1").get_text()
+
+
+def test_pandoc_server_reused(converter):
+    if not isinstance(converter, convert.PandocServerConverter):
+        pytest.skip("Only applies to the pandoc server")
+
+    process = converter.process
+    converter.convert("# First")
+    converter.convert("# Second")
+
+    assert converter.process is process
+    assert process.poll() is None
+
+
+def test_create_converter(tmp_path, monkeypatch):
+    monkeypatch.delenv("XDG_CACHE_HOME", raising=False)
+    converter = convert.create_converter({})
+    assert isinstance(converter, convert.CachingConverter)
+    assert isinstance(converter.converter, convert.PandocConverter)
+    assert converter.cache.directory == ".deploy/cache/conversions"
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    converter = convert.create_converter({"converter": "pandoc-server"})
+    assert converter.cache.directory == str(tmp_path / "gwbridge" / "conversions")
+
+    converter = convert.create_converter(
+        {
+            "converter": "pandoc-server",
+            "pandoc_server": "http://localhost:3030",
+            "conversion_cache": False,
+        }
+    )
+    assert converter.url == "http://localhost:3030"
+
+    with pytest.raises(ValueError):
+        convert.create_converter({"converter": "unknown"})
+
+
+class MockConverter:
+    def __init__(self, version="1.0"):
+        self.version = version
+        self.calls = 0
+
+    def convert(self, data, **kwargs):
+        self.calls += 1
+        return "<p>{}</p>".format(data)
+
+    def identity(self):
+        return {"engine": "mock", "version": self.version}
+
+    def close(self):
+        pass
+
+
+def test_conversion_cache(tmp_path):
+    cache = convert.ConversionCache(str(tmp_path))
+    engine = MockConverter()
+    converter = convert.CachingConverter(engine, cache)
+
+    assert converter.convert("a") == "<p>a</p>"
+    assert converter.convert("a") == "<p>a</p>"
+    assert converter.convert("b") == "<p>b</p>"
+    assert engine.calls == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # A new version of the engine may produce different HTML
+    engine = MockConverter(version="2.0")
+    converter = convert.CachingConverter(engine, cache)
+    converter.convert("a")
+    assert engine.calls == 1
+
+
+def test_conversion_cache_eviction(tmp_path):
+    cache = convert.ConversionCache(str(tmp_path), max_size=20)
+    cache.put("a", "a" * 10)
+    cache.put("b", "b" * 10)
+    # Using an entry makes it the most recently used
+    os.utime(str(tmp_path / "a.html"), ns=(0, 0))
+    os.utime(str(tmp_path / "b.html"), ns=(0, 0))
+    assert cache.get("a") == "a" * 10
+
+    cache.put("c", "c" * 10)
+
+    assert cache.get("a") == "a" * 10
+    assert cache.get("b") is None
+    assert cache.get("c") == "c" * 10
@@ -0,0 +1,96 @@
+import hashlib
+from gwbridge import fingerprint
+
+
+def test_hash_file(tmp_path):
+    image = tmp_path / "test1.png"
+    image.write_bytes(b"\x89PNG")
+
+    assert fingerprint.hash_file(str(image)) == hashlib.sha256(b"\x89PNG").hexdigest()
+    assert fingerprint.hash_file(str(tmp_path / "missing.png")) is None
+
+
+def test_hash_json():
+    assert fingerprint.hash_json({"a": 1, "b": 2}) == fingerprint.hash_json(
+        {"b": 2, "a": 1}
+    )
+
+
+def test_source_fingerprint_ignores_credentials(tmp_path):
+    config = {"base_url": "https://www.example.com/wp-json", "client_key": "wwww"}
+    first = fingerprint.source_fingerprint("# Title", {"id": 254}, config, [])
+    config["client_key"] = "xxxx"
+    second = fingerprint.source_fingerprint("# Title", {"id": 254}, config, [])
+
+    assert first == second
+
+
+def test_source_fingerprint_ignores_settings(tmp_path):
+    config = {"base_url": "https://www.example.com/wp-json", "timeout": 10}
+    first = fingerprint.source_fingerprint("# Title", {"id": 254}, config, [])
+    config.update(
+        {
+            "timeout": 30,
+            "pool_size": 20,
+            "media_ledger": "media.json",
+            "workers": 4,
+            "upload_concurrency": 8,
+        }
+    )
+    second = fingerprint.source_fingerprint("# Title", {"id": 254}, config, [])
+
+    assert first == second
+
+    config["converter"] = "commonmark"
+    third = fingerprint.source_fingerprint("# Title", {"id": 254}, config, [])
+
+    assert third.get("config") != first.get("config")
+
+
+def test_is_unchanged(tmp_path):
+    (tmp_path / "img").mkdir()
+    image = tmp_path / "img" / "test1.png"
+    image.write_bytes(b"first")
+    data = "# Title\n\n![](img/test1.png)"
+    metadata = {"id": 254, "status": "draft"}
+    config = {"file": "README.md"}
+
+    previous = fingerprint.source_fingerprint(
+        data, metadata, config, ["img/test1.png"], root=str(tmp_path)
+    )
+    # A fingerprint without a published payload is never considered unchanged
+    assert not fingerprint.is_unchanged(
+        previous, data, metadata, config, root=str(tmp_path)
+    )
+
+    previous["payload"] = fingerprint.hash_json({"title": "Title"})
+    assert fingerprint.is_unchanged(
+        previous, data, metadata, config, root=str(tmp_path)
+    )
+    assert not fingerprint.is_unchanged(
+        previous, data, {"id": 254, "status": "publish"}, config, root=str(tmp_path)
+    )
+    assert not fingerprint.is_unchanged(
+        previous, data + "\n\nMore", metadata, config, root=str(tmp_path)
+    )
+
+    image.write_bytes(b"second")
+    assert not fingerprint.is_unchanged(
+        previous, data, metadata, config, root=str(tmp_path)
+    )
+
+
+def test_save_and_load_fingerprint(tmp_path):
+    (tmp_path / ".deploy").mkdir()
+    assert fingerprint.load_fingerprint(str(tmp_path)) == {}
+
+    fingerprint.save_fingerprint({"source": "abc"}, str(tmp_path))
+    assert fingerprint.load_fingerprint(str(tmp_path)) == {"source": "abc"}
+
+
+def test_changed_fields():
+    fields = fingerprint.hash_fields({"title": "Title", "status": "draft"})
+
+    assert fingerprint.changed_fields(
+        {"title": "Title", "status": "publish", "categories": [1]}, fields
+    ) == {"status": "publish", "categories": [1]}
@@ -0,0 +1,70 @@
+import json
+import os
+import stat
+from gwbridge import files
+from gwbridge import journal
+from gwbridge import media
+
+
+def test_record_and_load(tmp_path):
+    path = str(tmp_path / ".deploy" / "journal.jsonl")
+    first = journal.Journal(path)
+    first.record(journal.POST_CREATED, id=254)
+    first.record(journal.MEDIA_UPLOADED, digest="aaaa", id=251, url="a", filename="a")
+
+    second = journal.Journal(path)
+    assert second.completed(journal.POST_CREATED) == [
+        {"step": "post_created", "id": 254}
+    ]
+    assert len(second.completed(journal.MEDIA_UPLOADED)) == 1
+
+    second.clear()
+    assert not journal.Journal(path).entries
+
+
+def test_load_partial_entry(tmp_path):
+    """This test shows that a step which was being written when the run died
+    is treated as not completed
+    """
+
+    path = tmp_path / "journal.jsonl"
+    path.write_text(json.dumps({"step": "post_created", "id": 254}) + '\n{"step": "me')
+
+    assert journal.Journal(str(path)).entries == [{"step": "post_created", "id": 254}]
+
+
+def test_resume():
+    log = journal.Journal()
+    log.record(journal.POST_CREATED, id=254)
+    log.record(journal.MEDIA_UPLOADED, digest="aaaa", id=251, url="a", filename="a")
+    log.record(journal.CONTENT_PUSHED, post=254, fingerprint={"payload": "abc"})
+    metadata = {"id": ""}
+    ledger = media.MediaLedger()
+
+    assert journal.resume(log, metadata, ledger) == {"payload": "abc"}
+    assert metadata.get("id") == 254
+    assert ledger.lookup("aaaa") == {"id": 251, "url": "a", "filename": "a"}
+
+
+def test_write_atomic(tmp_path):
+    path = str(tmp_path / "state" / "metadata.json")
+    files.write_atomic(path, "first")
+    files.write_atomic(path, "second")
+
+    with open(path) as f:
+        assert f.read() == "second"
+    assert [p.name for p in (tmp_path / "state").iterdir()] == ["metadata.json"]
+
+
+def test_write_atomic_mode(tmp_path):
+    """This test shows that a new file is created with the mode given by the
+    umask, and that a replaced file keeps its mode
+    """
+
+    path = str(tmp_path / "metadata.json")
+    files.write_atomic(path, "first")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o666 & ~files.UMASK
+
+    os.chmod(path, 0o640)
+    files.write_atomic(path, "second")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
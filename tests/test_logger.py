@@ -0,0 +1,57 @@
+import json
+import logging
+import requests
+from mock import patch
+from gwbridge import logger
+from gwbridge import transport
+
+
+def test_truncate():
+    assert logger.truncate("abcdef", limit=10) == "abcdef"
+    assert logger.truncate("abcdef", limit=4) == "abcd... (2 more characters)"
+    assert logger.truncate(None) is None
+
+
+def test_log_exchange_disabled(requests_mock):
+    """This test shows that an exchange isn't formatted unless debug messages
+    are enabled
+    """
+
+    requests_mock.post("https://www.example.com/posts", text="x" * 10000)
+    response = transport.WordpressSession().post(
+        "https://www.example.com/posts", data="y" * 10000
+    )
+    log = logging.getLogger("gwbridge.test.disabled")
+    log.setLevel(logging.INFO)
+
+    with patch.object(logger.Exchange, "__str__") as mock_str:
+        logger.log_exchange(log, response)
+        assert not mock_str.called
+
+
+def test_trace(requests_mock, tmp_path):
+    trace_file = str(tmp_path / "trace.jsonl")
+    requests_mock.post("https://www.example.com/posts", text="x" * 10000)
+    response = transport.WordpressSession().post(
+        "https://www.example.com/posts", data="y" * 10000
+    )
+    log = logging.getLogger("gwbridge.test.trace")
+    log.setLevel(logging.INFO)
+
+    trace = logger.start_trace(log, trace_file)
+    log.info("Publishing %s", "post")
+    logger.log_exchange(log, response)
+    logger.stop_trace(log, trace)
+
+    with open(trace_file) as f:
+        entries = [json.loads(line) for line in f]
+
+    assert log.level == logging.INFO
+    assert [e.get("message") for e in entries] == [
+        "Publishing post",
+        "POST https://www.example.com/posts returned 200",
+    ]
+    exchange = entries[1]
+    assert exchange.get("response").get("status") == requests.codes.ok
+    assert len(exchange.get("request").get("body")) < 2000
+    assert exchange.get("response").get("body").endswith("(9000 more characters)")
@@ -0,0 +1,145 @@
+import hashlib
+import os
+from mock import patch
+from gwbridge import fingerprint
+from gwbridge import media
+from gwbridge import transport
+
+MEDIA_URL = "https://www.example.com/wp-json/wp/v2/media"
+
+
+def mock_media_page(ids):
+    return [
+        {
+            "id": i,
+            "modified": "2020-05-21T23:16:{:02}".format(i % 60),
+            "guid": {
+                "rendered": "https://www.example.com/wp-content/uploads/{}.png".format(
+                    i
+                )
+            },
+        }
+        for i in ids
+    ]
+
+
+def test_ledger_digest(tmp_path):
+    image = tmp_path / "test1.png"
+    image.write_bytes(b"test1")
+    ledger = media.MediaLedger()
+
+    with patch(
+        "gwbridge.fingerprint.hash_file", side_effect=fingerprint.hash_file
+    ) as mock_hash_file:
+        digest = ledger.digest(str(image))
+        assert digest == hashlib.sha256(b"test1").hexdigest()
+        # The file is unchanged, so it isn't hashed again
+        assert ledger.digest(str(image)) == digest
+        assert mock_hash_file.call_count == 1
+
+        image.write_bytes(b"edited")
+        os.utime(str(image), ns=(0, 0))
+        assert ledger.digest(str(image)) == hashlib.sha256(b"edited").hexdigest()
+        assert mock_hash_file.call_count == 2
+
+    assert ledger.digest(str(tmp_path / "missing.png")) is None
+
+
+def test_ledger_save_and_load(tmp_path):
+    ledger_file = str(tmp_path / ".deploy" / "media.json")
+    image = tmp_path / "test1.png"
+    image.write_bytes(b"test1")
+
+    ledger = media.MediaLedger(ledger_file)
+    digest = ledger.digest(str(image))
+    ledger.record(digest, 250, "https://www.example.com/test1.png", "test1.png")
+    ledger.save()
+
+    ledger = media.MediaLedger(ledger_file)
+    assert ledger.lookup(digest) == {
+        "id": 250,
+        "url": "https://www.example.com/test1.png",
+        "filename": "test1.png",
+    }
+    assert ledger.files.get(str(image)).get("sha256") == digest
+
+
+def test_upload_filename():
+    assert media.upload_filename("0123456789abcdef", "img/test1.png") == (
+        "0123456789ab-test1.png"
+    )
+
+
+def test_is_local():
+    assert media.is_local("img/test1.png")
+    assert not media.is_local("https://www.example.com/test1.png")
+    assert not media.is_local("//www.example.com/test1.png")
+    assert not media.is_local("data:image/png;base64,iVBORw0KGgo=")
+
+
+def test_index_fetch_paginated(requests_mock):
+    headers = {"X-WP-Total": "250", "X-WP-TotalPages": "3"}
+    for page, ids in [(1, range(0, 100)), (2, range(100, 200)), (3, range(200, 250))]:
+        requests_mock.get(
+            "{}?page={}".format(MEDIA_URL, page),
+            json=mock_media_page(ids),
+            headers=headers,
+        )
+    index = media.MediaIndex(transport.WordpressSession())
+
+    items = index.fetch(MEDIA_URL, {"parent": 254})
+
+    assert [x.get("id") for x in items] == list(range(250))
+    assert requests_mock.call_count == 3
+    for request in requests_mock.request_history:
+        assert request.qs.get("per_page") == ["100"]
+        assert request.qs.get("parent") == ["254"]
+
+
+def test_index_revalidation(requests_mock, tmp_path):
+    cache_file = str(tmp_path / "media-index.json")
+    headers = {"X-WP-Total": "150", "X-WP-TotalPages": "2"}
+    requests_mock.get(
+        "{}?page=1".format(MEDIA_URL),
+        json=mock_media_page(range(0, 100)),
+        headers=headers,
+    )
+    requests_mock.get(
+        "{}?page=2".format(MEDIA_URL),
+        json=mock_media_page(range(100, 150)),
+        headers=headers,
+    )
+    index = media.MediaIndex(transport.WordpressSession(), cache_file=cache_file)
+    index.fetch(MEDIA_URL)
+    index.save()
+    assert requests_mock.call_count == 2
+
+    # The first page is unchanged, so the cached listing is used
+    index = media.MediaIndex(transport.WordpressSession(), cache_file=cache_file)
+    items = index.fetch(MEDIA_URL)
+    assert len(items) == 150
+    assert requests_mock.call_count == 3
+
+    # A new item has been uploaded, so the listing is fetched again
+    requests_mock.get(
+        "{}?page=1".format(MEDIA_URL),
+        json=mock_media_page(range(150, 250)),
+        headers={"X-WP-Total": "151", "X-WP-TotalPages": "2"},
+    )
+    items = index.fetch(MEDIA_URL)
+    assert len(items) == 150
+    assert requests_mock.call_count == 5
+
+
+def test_index_etag(requests_mock):
+    requests_mock.get(
+        MEDIA_URL, json=mock_media_page(range(0, 10)), headers={"ETag": '"abc"'}
+    )
+    index = media.MediaIndex(transport.WordpressSession())
+    index.fetch(MEDIA_URL)
+
+    requests_mock.get(MEDIA_URL, status_code=304)
+    items = index.fetch(MEDIA_URL)
+
+    assert requests_mock.last_request.headers.get("If-None-Match") == '"abc"'
+    assert len(items) == 10
@@ -0,0 +1,107 @@
+import pytest
+from bs4 import BeautifulSoup
+from mock import patch
+from gwbridge import application
+from gwbridge import media
+
+Image = pytest.importorskip("PIL.Image")
+
+from gwbridge import optimise  # noqa: E402
+
+
+@pytest.fixture
+def mock_image(tmp_path):
+    path = tmp_path / "img" / "screenshot.png"
+    path.parent.mkdir()
+    Image.new("RGBA", (400, 200), (255, 0, 0, 255)).save(str(path))
+    yield path
+
+
+def test_optimise(mock_image, tmp_path):
+    optimiser = optimise.ImageOptimiser(
+        max_width=100, format="webp", cache_dir=str(tmp_path / "cache")
+    )
+
+    output = optimiser.optimise(str(mock_image), "aaaa")
+
+    assert output.endswith(".webp")
+    with Image.open(output) as image:
+        assert image.format == "WEBP"
+        assert image.size == (100, 50)
+
+
+def test_optimise_orientation(tmp_path):
+    path = tmp_path / "photo.jpg"
+    exif = Image.Exif()
+    # Rotated 90 degrees clockwise for display
+    exif[0x0112] = 6
+    Image.new("RGB", (400, 200)).save(str(path), exif=exif)
+    optimiser = optimise.ImageOptimiser(
+        max_width=100, strip_metadata=False, cache_dir=str(tmp_path / "cache")
+    )
+
+    output = optimiser.optimise(str(path), "aaaa")
+
+    with Image.open(output) as image:
+        assert image.size == (100, 200)
+        assert image.getexif().get(0x0112) in (None, 1)
+
+
+def test_optimise_cached(mock_image, tmp_path):
+    optimiser = optimise.ImageOptimiser(
+        max_width=100, cache_dir=str(tmp_path / "cache")
+    )
+    output = optimiser.optimise(str(mock_image), "aaaa")
+
+    with patch("PIL.Image.open") as mock_open:
+        assert optimiser.optimise(str(mock_image), "aaaa") == output
+        assert not mock_open.called
+
+    # Changing the settings produces a new optimised image
+    optimiser.max_width = 200
+    assert optimiser.optimise(str(mock_image), "aaaa") != output
+
+
+def test_create_optimiser(tmp_path):
+    assert optimise.create_optimiser({}) is None
+
+    optimiser = optimise.create_optimiser(
+        {"optimise_images": {"max_width": 1600, "format": "WebP"}}
+    )
+    assert optimiser.max_width == 1600
+    assert optimiser.format == "webp"
+
+    with pytest.raises(ValueError):
+        optimise.create_optimiser({"optimise_images": {"format": "bmp"}})
+
+
+def test_collect_images_optimised(mock_image, tmp_path):
+    """This test shows that optimised images are identified by both their
+    content and the optimisation settings, and are uploaded from the cache
+    """
+
+    soup = BeautifulSoup(
+        '<img src="img/screenshot.png"><img src="img/diagram.svg">', "html.parser"
+    )
+    (tmp_path / "img" / "diagram.svg").write_text("<svg></svg>")
+    ledger = media.MediaLedger()
+    optimiser = optimise.ImageOptimiser(
+        format="webp", cache_dir=str(tmp_path / "cache")
+    )
+
+    img_map = application.collect_images(
+        soup, ledger, root=str(tmp_path), optimiser=optimiser
+    )
+    optimise.optimise_images(img_map, optimiser, root=str(tmp_path))
+
+    source = ledger.digest(str(mock_image))
+    variant = optimiser.variant(source)
+    assert variant in img_map
+    assert img_map.get(variant).get("filename") == "{}-screenshot.webp".format(
+        variant[:12]
+    )
+    assert img_map.get(variant).get("upload_path").endswith(".webp")
+    # SVGs aren't optimised
+    svg = ledger.digest(str(tmp_path / "img" / "diagram.svg"))
+    assert img_map.get(svg).get("filename") == "{}-diagram.svg".format(svg[:12])
+    assert "upload_path" not in img_map.get(svg)
@@ -0,0 +1,136 @@
+import pytest
+from bs4 import BeautifulSoup
+from gwbridge import application
+from gwbridge import convert
+from gwbridge import pandoc_ast
+
+MARKDOWN = """Some text before the title.
+
+# A "Quoted" Title
+
+Some *emphasised* text, and a [link](https://www.example.com).
+
+![A screenshot](img/test1.png)
+
+> A quote with an image ![inline](img/test2.jpg)
+>
+> # Not the title
+
+| Column | Image |
+|--------|-------|
+| One    | ![cell](img/test1.png) |
+
+![Remote](https://www.example.com/remote.png)
+"""
+
+IMG_MAP = {
+    "aaaa": {
+        "local_paths": ["img/test1.png"],
+        "target_path": "https://www.example.com/test1.png",
+    },
+    "bbbb": {
+        "local_paths": ["img/test2.jpg"],
+        "target_path": "https://www.example.com/test2.jpg",
+    },
+}
+
+
+@pytest.fixture
+def converter():
+    converter = convert.create_converter({"conversion_cache": False})
+    try:
+        converter.convert("")
+    except OSError as e:
+        pytest.skip("pandoc is unavailable: {}".format(e))
+    yield converter
+    converter.close()
+
+
+def publish(pipeline, converter):
+    config = {"pipeline": pipeline}
+    soup, title, images = application.render_document(
+        MARKDOWN, config, converter=converter
+    )
+    img_map = application.collect_images(
+        soup, application.media.MediaLedger(), images=images
+    )
+    return (
+        sorted(images),
+        img_map,
+        application.finish_document(soup, title, IMG_MAP, images=images),
+    )
+
+
+def normalise(html):
+    return BeautifulSoup(html, "html.parser").encode(formatter="html5")
+
+
+def test_conformance(converter):
+    """This test shows that the AST pipeline produces the same document as
+    the HTML pipeline
+    """
+
+    html_images, html_map, html_document = publish("html", converter)
+    ast_images, ast_map, ast_document = publish("ast", converter)
+
+    assert ast_document.get("title") == "A “Quoted” Title"
+    assert ast_document.get("title") == html_document.get("title")
+    assert ast_images == html_images
+    assert normalise(ast_document.get("content")) == normalise(
+        html_document.get("content")
+    )
+    assert "https://www.example.com/test2.jpg" in ast_document.get("content")
+
+
+@pytest.mark.parametrize("pipeline", ["html", "ast"])
+@pytest.mark.parametrize(
+    "markdown,title",
+    [
+        ("# Using *gwbridge*\n\nSome text.\n", "Using gwbridge"),
+        ("Some text, without a title.\n", None),
+    ],
+)
+def test_extract_title(converter, pipeline, markdown, title):
+    """This test shows that both pipelines take the title from the text of the
+    heading, without its markup, and that a post without a title has none
+    """
+
+    soup, extracted, images = application.render_document(
+        markdown, {"pipeline": pipeline}, converter=converter
+    )
+    document = application.finish_document(soup, extracted, {}, images=images)
+
+    assert extracted == title
+    assert document.get("title") == title
+    assert "Some text" in document.get("content")
+    assert "gwbridge" not in document.get("content")
+
+
+def test_index_document():
+    ast = {
+        "blocks": [
+            {"t": "Para", "c": [{"t": "Str", "c": "Before"}]},
+            {
+                "t": "Div",
+                "c": [
+                    ["", [], []],
+                    [
+                        {
+                            "t": "Header",
+                            "c": [1, ["t", [], []], [{"t": "Str", "c": "T"}]],
+                        }
+                    ],
+                ],
+            },
+            {
+                "t": "Para",
+                "c": [{"t": "Image", "c": [["", [], []], [], ["a.png", ""]]}],
+            },
+        ]
+    }
+
+    heading, images = pandoc_ast.index_document(ast)
+
+    assert pandoc_ast.extract_title(heading) == "T"
+    assert ast["blocks"][1]["c"][1] == []
+    assert list(images) == ["a.png"]
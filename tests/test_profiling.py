@@ -0,0 +1,67 @@
+import json
+import pytest
+from gwbridge import profiling
+from gwbridge import transport
+
+
+@pytest.fixture
+def profiler():
+    profiler = profiling.start()
+    yield profiler
+    profiling.stop()
+
+
+def test_stage_inactive():
+    assert profiling.active() is None
+    with profiling.stage("render"):
+        pass
+    assert profiling.stop() is None
+
+
+def test_stage(profiler):
+    with profiling.stage("render", post="."):
+        pass
+    with pytest.raises(ValueError):
+        with profiling.stage("render", post="."):
+            raise ValueError()
+
+    assert [s.get("name") for s in profiler.spans] == ["render", "render"]
+    assert profiler.spans[0].get("args") == {"post": "."}
+    assert profiler.summary()[1].split()[:2] == ["render", "2"]
+
+
+def test_record_request(profiler, requests_mock):
+    requests_mock.post("https://www.example.com/wp/v2/posts/1", text="x" * 100)
+    transport.WordpressSession().post(
+        "https://www.example.com/wp/v2/posts/1", data="y" * 10
+    )
+
+    request = profiler.requests[0]
+    assert request.get("method") == "POST"
+    assert request.get("status") == 200
+    assert request.get("sent") == 10
+    assert request.get("received") == 100
+
+    summary = profiler.summary()
+    assert any(line.split()[:3] == ["POST", "/wp/v2/posts/1", "1"] for line in summary)
+    assert "Slowest requests:" in summary
+
+
+def test_write_trace(profiler, requests_mock, tmp_path):
+    trace_file = str(tmp_path / "profile.json")
+    requests_mock.get("https://www.example.com/wp/v2/media", text="[]")
+    with profiling.stage("images.resolve"):
+        transport.WordpressSession().get("https://www.example.com/wp/v2/media")
+    profiler.write_trace(trace_file)
+
+    with open(trace_file) as f:
+        events = json.load(f).get("traceEvents")
+
+    assert [(e.get("name"), e.get("cat"), e.get("ph")) for e in events] == [
+        ("images.resolve", "stage", "X"),
+        ("GET /wp/v2/media", "http", "X"),
+    ]
+    stage, request = events
+    assert stage.get("ts") <= request.get("ts")
+    assert request.get("ts") + request.get("dur") <= stage.get("ts") + stage.get("dur")
+    assert request.get("args").get("status") == 200
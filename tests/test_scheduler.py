@@ -0,0 +1,138 @@
+import email.utils
+import time
+import pytest
+import requests
+from gwbridge import aio
+from gwbridge import scheduler
+from gwbridge import transport
+
+URL = "https://www.example.com/wp-json/wp/v2/media"
+
+
+@pytest.fixture
+def session():
+    return transport.WordpressSession(
+        scheduler=scheduler.Scheduler(concurrency=4, max_retries=2, backoff=0)
+    )
+
+
+def test_parse_retry_after():
+    assert scheduler.parse_retry_after(None) is None
+    assert scheduler.parse_retry_after("2") == 2
+    assert scheduler.parse_retry_after("garbage") is None
+
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 < scheduler.parse_retry_after(date) <= 30
+
+
+def test_is_retryable():
+    assert scheduler.is_retryable("POST", status=429)
+    assert scheduler.is_retryable("GET", status=503)
+    assert scheduler.is_retryable("GET", error=requests.ConnectionError())
+    assert not scheduler.is_retryable("POST", status=503)
+    assert not scheduler.is_retryable("POST", error=requests.ConnectionError())
+    assert not scheduler.is_retryable("GET", status=404)
+
+
+def test_token_bucket():
+    bucket = scheduler.TokenBucket(rate=10, burst=2)
+
+    assert bucket.reserve(bucket.updated) == 0
+    assert bucket.reserve(bucket.updated) == 0
+    assert bucket.reserve(bucket.updated) == pytest.approx(0.1)
+    # Tokens are replenished over time
+    assert bucket.reserve(bucket.updated + 1) == 0
+
+
+def test_retry_throttled(session, requests_mock):
+    """This test shows that a throttled request is retried, even if it isn't
+    idempotent, after the delay requested by the server, and that the
+    concurrency limit is reduced
+    """
+
+    requests_mock.post(
+        URL,
+        [
+            {"status_code": 429, "headers": {"Retry-After": "0.1"}},
+            {"status_code": 201, "json": {"id": 251}},
+        ],
+    )
+
+    start = time.monotonic()
+    response = session.post(URL, data=b"image")
+
+    assert response.status_code == 201
+    assert requests_mock.call_count == 2
+    assert time.monotonic() - start >= 0.1
+    assert session.scheduler.limit == 2
+
+
+def test_retry_rewinds_file(session, requests_mock, tmp_path):
+    image = tmp_path / "image.png"
+    image.write_bytes(b"image")
+    bodies = []
+
+    def upload(request, context):
+        bodies.append(request.body.read())
+        context.status_code = 429 if len(bodies) == 1 else 201
+        return {"id": 251}
+
+    requests_mock.post(URL, json=upload)
+
+    with open(str(image), "rb") as f:
+        session.post(URL, data=f)
+
+    assert bodies == [b"image", b"image"]
+
+
+def test_no_retry_unsafe(session, requests_mock):
+    requests_mock.post(URL, status_code=503)
+    requests_mock.get(URL, status_code=503)
+
+    assert session.post(URL, data=b"image").status_code == 503
+    assert requests_mock.call_count == 1
+
+    # Idempotent requests are retried until the retries are exhausted
+    assert session.get(URL).status_code == 503
+    assert requests_mock.call_count == 4
+
+
+def test_retry_connection_error(session, requests_mock):
+    requests_mock.get(URL, [{"exc": requests.ConnectionError}, {"json": []}])
+    assert session.get(URL).json() == []
+
+    requests_mock.get(URL, exc=requests.ConnectionError)
+    with pytest.raises(requests.ConnectionError):
+        session.get(URL)
+
+
+def test_concurrency_recovers():
+    limiter = scheduler.Scheduler(concurrency=4)
+    limiter.record("GET", 0, status=429)
+    assert limiter.limit == 2
+
+    for _ in range(2):
+        limiter.record("GET", 0, status=200)
+    assert limiter.limit == 3
+    for _ in range(10):
+        limiter.record("GET", 0, status=200)
+    assert limiter.limit == 4
+
+
+def test_call_async():
+    class Response:
+        def __init__(self, status_code):
+            self.status_code = status_code
+            self.headers = {}
+
+    responses = [Response(429), Response(200)]
+    limiter = scheduler.Scheduler(concurrency=2, backoff=0)
+
+    async def send():
+        return responses.pop(0)
+
+    response = aio.run(limiter.call_async("POST", send))
+
+    assert response.status_code == 200
+    assert not responses
+    assert limiter.active == 0
@@ -0,0 +1,165 @@
+import pytest
+from gwbridge import application
+from gwbridge import convert
+from gwbridge import sources
+
+
+@pytest.fixture
+def mock_guide(tmp_path):
+    """Create a post assembled from an introduction, and a guide which
+    includes two chapters, one of which references an image in its own
+    directory
+    """
+
+    (tmp_path / "chapters" / "img").mkdir(parents=True)
+    (tmp_path / "intro.md").write_text("<h1>Guide</h1>\n")
+    (tmp_path / "guide.md").write_text(
+        "<p>Contents</p>\n"
+        "<!-- include chapters/one.md -->\n"
+        "<!-- include chapters/two.md -->\n"
+    )
+    (tmp_path / "chapters" / "one.md").write_text('<p><img src="img/a.png" /></p>\n')
+    (tmp_path / "chapters" / "two.md").write_text("<p>Two</p>\n")
+    (tmp_path / "chapters" / "img" / "a.png").write_bytes(b"a")
+    yield tmp_path
+
+
+class CountingConverter:
+    def __init__(self):
+        self.converted = []
+
+    def convert(self, data, **kwargs):
+        self.converted.append(data)
+        return data
+
+    def identity(self):
+        return {"engine": "test"}
+
+    def close(self):
+        pass
+
+
+def test_read_parts(mock_guide):
+    parts = sources.read_parts({"file": ["intro.md", "guide.md"]}, str(mock_guide))
+
+    assert [part.path for part in parts] == [
+        "intro.md",
+        "guide.md",
+        "chapters/one.md",
+        "chapters/two.md",
+    ]
+    assert sources.source_paths(
+        {"file": ["intro.md", "guide.md"]}, str(mock_guide)
+    ) == ["intro.md", "guide.md", "chapters/one.md", "chapters/two.md"]
+
+
+def test_read_single_file(mock_guide):
+    """This test shows that the source of a post with a single file is the
+    content of that file
+    """
+
+    parts = sources.read_parts({"file": "intro.md"}, str(mock_guide))
+
+    assert sources.join(parts) == "<h1>Guide</h1>\n"
+
+
+def test_include_cycle(tmp_path):
+    (tmp_path / "a.md").write_text("<!-- include b.md -->\n")
+    (tmp_path / "b.md").write_text("<!-- include a.md -->\n")
+
+    with pytest.raises(ValueError):
+        sources.read_parts({"file": "a.md"}, str(tmp_path))
+    assert sources.source_paths({"file": "a.md"}, str(tmp_path)) == ["a.md", "b.md"]
+
+
+def test_include_keeps_image_paths(tmp_path):
+    """This test shows that adding an include to a post doesn't change how
+    the images referenced by the post's own file are resolved
+    """
+
+    (tmp_path / "posts").mkdir()
+    (tmp_path / "posts" / "guide.md").write_text(
+        '<h1>Guide</h1>\n<p><img src="img/a.png" /></p>\n<!-- include ch.md -->\n'
+    )
+    (tmp_path / "posts" / "ch.md").write_text('<p><img src="img/b.png" /></p>\n')
+    config = {"file": "posts/guide.md"}
+    parts = sources.read_parts(config, str(tmp_path))
+
+    soup, title, images = application.render_document(
+        sources.join(parts), config, converter=CountingConverter(), parts=parts
+    )
+
+    assert [part.directory for part in parts] == ["", "posts"]
+    assert list(images) == ["img/a.png", "posts/img/b.png"]
+
+
+def test_id_prefixes(mock_guide):
+    parts = sources.read_parts({"file": ["intro.md", "guide.md"]}, str(mock_guide))
+
+    assert sources.id_prefixes(parts) == [
+        "intro-md-",
+        "guide-md-",
+        "chapters-one-md-",
+        "chapters-two-md-",
+    ]
+    assert sources.id_prefixes(parts[:1]) == [None]
+
+
+def test_render_footnotes(tmp_path):
+    """This test shows that the footnotes of each part are given distinct
+    identifiers
+    """
+
+    pytest.importorskip("pypandoc")
+    (tmp_path / "one.md").write_text("# Guide\n\nOne[^1]\n\n[^1]: First\n")
+    (tmp_path / "two.md").write_text("Two[^1]\n\n[^1]: Second\n")
+    config = {"file": ["one.md", "two.md"], "conversion_cache": False}
+    parts = sources.read_parts(config, str(tmp_path))
+    try:
+        soup, title, images = application.render_document(
+            sources.join(parts), config, parts=parts
+        )
+    except OSError as e:
+        pytest.skip("pandoc is unavailable: {}".format(e))
+
+    ids = [tag["id"] for tag in soup.find_all(id=True)]
+    assert len(ids) == len(set(ids))
+    assert soup.find(id="two-md-fn1").get_text().startswith("Second")
+
+
+def test_rebase():
+    assert sources.rebase("img/a.png", "chapters") == "chapters/img/a.png"
+    assert sources.rebase("../img/a.png", "chapters") == "img/a.png"
+    assert sources.rebase("img/a.png", "") == "img/a.png"
+    assert sources.rebase("https://example.com/a.png", "chapters") == (
+        "https://example.com/a.png"
+    )
+
+
+def test_render_parts(mock_guide, tmp_path_factory):
+    """This test shows that each part of a post is converted separately, so
+    that only the part which changed is converted again, and that the images
+    of a part are resolved against the post's root
+    """
+
+    config = {"file": ["intro.md", "guide.md"]}
+    engine = CountingConverter()
+    converter = convert.CachingConverter(
+        engine, convert.ConversionCache(str(tmp_path_factory.mktemp("cache")))
+    )
+
+    def render():
+        parts = sources.read_parts(config, str(mock_guide))
+        return application.render_document(
+            sources.join(parts), config, converter=converter, parts=parts
+        )
+
+    soup, title, images = render()
+    assert title == "Guide"
+    assert list(images) == ["chapters/img/a.png"]
+    assert len(engine.converted) == 4
+
+    (mock_guide / "chapters" / "two.md").write_text("<p>Second</p>\n")
+    soup, title, images = render()
+    assert engine.converted[4:] == ["<p>Second</p>\n"]
+    assert "Second" in soup.decode()
@@ -0,0 +1,131 @@
+import json
+import pytest
+from gwbridge import FINGERPRINT_FILE
+from gwbridge import METADATA_FILE
+from gwbridge import application
+from gwbridge import journal
+from gwbridge import media
+from gwbridge import state
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = state.StateStore(str(tmp_path / ".deploy" / "state.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def mock_project(tmp_path, monkeypatch):
+    """Create a project with a published post, an unpublished post, and a
+    media ledger recording one upload
+    """
+
+    for name, post_id in [("first", 254), ("second", "")]:
+        deploy_dir = tmp_path / "posts" / name / ".deploy"
+        deploy_dir.mkdir(parents=True)
+        (deploy_dir / "metadata.json").write_text(
+            json.dumps({"id": post_id, "status": "draft"})
+        )
+    (tmp_path / "posts" / "first" / FINGERPRINT_FILE).write_text(
+        json.dumps({"payload": "abc", "images": {}})
+    )
+    ledger = media.MediaLedger(str(tmp_path / ".deploy" / "media.json"))
+    ledger.record("aaaa", 251, "https://www.example.com/a.png", "aaaa-a.png")
+    ledger.save()
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+
+
+def test_ledger(store, tmp_path):
+    """This test shows that uploads and the digests of local files recorded in
+    a store ledger are seen by later runs
+    """
+
+    image = tmp_path / "a.png"
+    image.write_bytes(b"a")
+    ledger = state.StoreLedger(store)
+    digest = ledger.digest(str(image))
+    ledger.record(digest, 251, "https://www.example.com/a.png", "a.png")
+    ledger.save()
+
+    ledger = state.StoreLedger(store)
+    assert ledger.lookup(digest) == {
+        "id": 251,
+        "url": "https://www.example.com/a.png",
+        "filename": "a.png",
+    }
+    assert store.lookup_file(str(image)).get("sha256") == digest
+    assert ledger.digest(str(image)) == digest
+
+
+def test_record_post(store, tmp_path):
+    root = str(tmp_path / "post")
+    store.record_post(root, 254, {"payload": "abc"}, modified="2020-05-23T11:59:47")
+    store.record_post(root, 254, {"payload": "def"})
+
+    post = store.lookup_post(root)
+    assert post.get("payload") == "def"
+    # The remote modification time is kept until it is known again
+    assert post.get("modified") == "2020-05-23T11:59:47"
+    assert post.get("fingerprint") == {"payload": "def"}
+
+
+def test_load_fingerprint(store, tmp_path):
+    """This test shows that a post's fingerprint is read from the store if the
+    post has no fingerprint file
+    """
+
+    root = tmp_path / "post"
+    (root / ".deploy").mkdir(parents=True)
+    application.save_fingerprint(
+        {"payload": "abc"}, str(root), {"id": 254}, store=store
+    )
+
+    assert application.load_fingerprint(str(root), store=store) == {"payload": "abc"}
+    (root / FINGERPRINT_FILE).unlink()
+    assert application.load_fingerprint(str(root), store=store) == {"payload": "abc"}
+    assert application.load_fingerprint(str(root)) == {}
+
+
+def test_resume_post(store, tmp_path):
+    """This test shows that content pushed by an interrupted run is recorded
+    in the store when the post is resumed
+    """
+
+    root = tmp_path / "post"
+    (root / ".deploy").mkdir(parents=True)
+    log = journal.open_journal(str(root))
+    log.record(journal.POST_CREATED, id=254)
+    log.record(journal.CONTENT_PUSHED, post=254, fingerprint={"payload": "abc"})
+    metadata = {"status": "draft"}
+
+    application.resume_post(log, metadata, media.MediaLedger(), str(root), store=store)
+
+    post = store.lookup_post(str(root))
+    assert post.get("id") == 254
+    assert post.get("fingerprint") == {"payload": "abc"}
+
+
+def test_import_export(mock_project, store):
+    roots = ["posts/first", "posts/second"]
+
+    assert state.import_json(store, roots=roots) == 1
+    assert store.posts() == ["posts/first"]
+    assert store.lookup_media("aaaa").get("id") == 251
+
+    (mock_project / ".deploy" / "media.json").unlink()
+    (mock_project / "posts" / "first" / FINGERPRINT_FILE).unlink()
+    (mock_project / "posts" / "first" / METADATA_FILE).write_text(
+        json.dumps({"id": "", "status": "draft"})
+    )
+
+    assert state.export_json(store) == 1
+    assert media.MediaLedger(".deploy/media.json").lookup("aaaa").get("id") == 251
+    metadata = json.loads(
+        (mock_project / "posts" / "first" / METADATA_FILE).read_text()
+    )
+    assert metadata == {"id": 254, "status": "draft"}
+    assert json.loads(
+        (mock_project / "posts" / "first" / FINGERPRINT_FILE).read_text()
+    ) == {"payload": "abc", "images": {}}
@@ -0,0 +1,48 @@
+import asyncio
+import pytest
+from gwbridge import aio
+from gwbridge import steps
+from gwbridge.steps import Call
+
+
+def fail():
+    raise ValueError("failed")
+
+
+def double_steps(value):
+    return (yield Call(lambda x: x * 2, value))
+
+
+def pipeline_steps(value):
+    doubled = yield from double_steps(value)
+    blocked = yield Call(sum, [doubled, 1], blocking=True)
+    try:
+        yield Call(fail)
+    except ValueError as e:
+        return blocked, str(e)
+
+
+def test_run():
+    assert steps.run(pipeline_steps(2)) == (5, "failed")
+
+
+def test_run_async():
+    async def double(x):
+        await asyncio.sleep(0)
+        return x * 2
+
+    def async_steps(value):
+        doubled = yield Call(double, value)
+        return (yield from pipeline_steps(doubled))
+
+    assert aio.run(steps.run_async(async_steps(2))) == (9, "failed")
+
+
+def test_run_raises():
+    def failing_steps():
+        yield Call(fail)
+
+    with pytest.raises(ValueError):
+        steps.run(failing_steps())
+    with pytest.raises(ValueError):
+        aio.run(steps.run_async(failing_steps()))
@@ -0,0 +1,44 @@
+from requests.auth import HTTPBasicAuth
+from gwbridge import transport
+
+
+def test_session_timeout(requests_mock):
+    url = "https://www.example.com/wp-json/wp/v2/posts"
+    requests_mock.get(url, text="[]")
+    session = transport.WordpressSession(timeout=(1, 2))
+
+    session.get(url)
+    assert requests_mock.last_request.timeout == (1, 2)
+
+    # An explicit timeout takes priority
+    session.get(url, timeout=5)
+    assert requests_mock.last_request.timeout == 5
+
+
+def test_session_auth(requests_mock):
+    url = "https://www.example.com/wp-json/wp/v2/posts"
+    requests_mock.post(url, text="{}")
+    session = transport.WordpressSession(auth=HTTPBasicAuth("user", "pass"))
+
+    session.post(url, data="{}")
+
+    assert requests_mock.last_request.headers.get("Authorization").startswith("Basic")
+
+
+def test_create_session():
+    session = transport.create_session(
+        {"timeout": "30", "connect_timeout": 5, "workers": 8, "upload_concurrency": 2}
+    )
+
+    assert session.timeout == (5.0, 30.0)
+    # Each post worker may upload several images at once
+    adapter = session.get_adapter("https://www.example.com")
+    assert adapter._pool_maxsize == 16
+
+    session = transport.create_session({})
+    assert session.timeout == (
+        transport.DEFAULT_CONNECT_TIMEOUT,
+        transport.DEFAULT_READ_TIMEOUT,
+    )
+    adapter = session.get_adapter("https://www.example.com")
+    assert adapter._pool_maxsize == transport.DEFAULT_POOL_SIZE
@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+import pytest
+from mock import MagicMock
+from mock import patch
+from gwbridge import application
+from gwbridge import watch
+
+
+@pytest.fixture
+def mock_post_dir(tmp_path, monkeypatch):
+    (tmp_path / ".deploy").mkdir()
+    (tmp_path / ".deploy" / "metadata.json").write_text(json.dumps({"id": 254}))
+    (tmp_path / ".deploy" / "fingerprint.json").write_text(
+        json.dumps({"images": {"img/a.png": "digest"}})
+    )
+    (tmp_path / "post.md").write_text("# Title\n")
+    (tmp_path / "img").mkdir()
+    (tmp_path / "img" / "a.png").write_bytes(b"a")
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+
+
+def test_watched_files(mock_post_dir):
+    assert watch.watched_files({"file": "post.md"}) == [
+        ".deploy/config.json",
+        ".deploy/metadata.json",
+        "img/a.png",
+        "post.md",
+    ]
+
+
+def test_changed(mock_post_dir):
+    watcher = watch.Watcher({"file": "post.md"})
+    watcher.refresh()
+    watcher.state = watch.snapshot(watcher.files)
+
+    assert not watcher.changed()
+    (mock_post_dir / "img" / "a.png").write_bytes(b"ab")
+    assert watcher.changed()
+    assert not watcher.changed()
+
+
+def test_changed_refresh(mock_post_dir):
+    """This test shows that the files to watch are only found again when a
+    markdown file changes, and that a file it starts to include is watched
+    """
+
+    watcher = watch.Watcher({"file": "post.md"})
+    watcher.refresh()
+    watcher.state = watch.snapshot(watcher.files)
+    (mock_post_dir / "part.md").write_text("Part\n")
+
+    with patch.object(watch, "watched_files", wraps=watch.watched_files) as mock:
+        (mock_post_dir / "img" / "a.png").write_bytes(b"ab")
+        assert watcher.changed()
+        assert not watcher.changed()
+        assert not mock.called
+
+        (mock_post_dir / "post.md").write_text("# Title\n\n<!-- include part.md -->\n")
+        assert watcher.changed()
+        assert mock.call_count == 1
+
+    assert "part.md" in watcher.files
+    (mock_post_dir / "part.md").write_text("Changed\n")
+    assert watcher.changed()
+
+
+def test_run(mock_post_dir):
+    """This test shows that the post is published on start and after each
+    burst of changes, through a single publish context
+    """
+
+    def edit():
+        time.sleep(0.1)
+        for i in range(3):
+            (mock_post_dir / "post.md").write_text("# Title\n\n{}\n".format(i))
+            time.sleep(0.02)
+
+    watcher = watch.Watcher(
+        {"file": "post.md"}, cli_args={"file": "post.md"}, interval=0.01, debounce=0.1
+    )
+    with patch.object(application, "PublishContext") as mock_context, patch.object(
+        application, "publish_post", return_value=200
+    ) as mock_publish:
+        editor = threading.Thread(target=edit)
+        editor.start()
+        watcher.run(cycles=1)
+        editor.join()
+
+    assert mock_publish.call_count == 2
+    assert mock_context.call_count == 1
+    assert mock_context.return_value.close.called
+
+
+def test_reload_config(mock_post_dir):
+    """This test shows that the publish context is only rebuilt when a
+    setting other than the post's sources changes
+    """
+
+    config = {"file": "post.md", "timeout": 10}
+    watcher = watch.Watcher(dict(config), cli_args={})
+    context = watcher.context = MagicMock()
+
+    with patch.object(
+        application, "parse_args", return_value={**config, "file": "other.md"}
+    ):
+        watcher.reload_config()
+    assert watcher.context is context
+    assert watcher.config.get("file") == "other.md"
+
+    with patch.object(
+        application, "parse_args", return_value={**config, "timeout": 30}
+    ):
+        watcher.reload_config()
+    assert watcher.context is None
+    assert context.close.called